@@ -0,0 +1,203 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks decoding gateway payloads with JSON against ETF.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_gateway --members 5000
+    python -m benchmarks.bench_gateway --payload recorded_guild_create.json
+
+Recorded payloads are JSON dispatches, as logged from the gateway. For the ETF side, every
+snowflake string in them is turned into an int, as Discord sends them over ETF.
+"""
+import argparse
+import json
+import random
+import time
+import typing
+import zlib
+
+from curious.core import etf
+
+DISCORD_EPOCH = 1420070400000
+
+
+def _snowflake(rng: random.Random) -> str:
+    timestamp = rng.randint(0, int(time.time() * 1000) - DISCORD_EPOCH)
+    return str((timestamp << 22) | rng.getrandbits(22))
+
+
+def make_guild_create(members: int = 1000, channels: int = 50, roles: int = 20,
+                      seed: int = 0) -> dict:
+    """
+    Makes a GUILD_CREATE dispatch shaped like the ones Discord sends.
+
+    :param members: The number of members (and presences) in the guild.
+    :param channels: The number of channels in the guild.
+    :param roles: The number of roles in the guild.
+    :param seed: The seed for the generated data.
+    :return: The dispatch, with snowflakes as strings like the JSON encoding.
+    """
+    rng = random.Random(seed)
+    guild_id = _snowflake(rng)
+    role_ids = [_snowflake(rng) for _ in range(roles)]
+    member_ids = [_snowflake(rng) for _ in range(members)]
+
+    return {
+        "op": 0,
+        "s": 2,
+        "t": "GUILD_CREATE",
+        "d": {
+            "id": guild_id,
+            "name": "benchmark guild",
+            "icon": "a" * 32,
+            "owner_id": member_ids[0],
+            "region": "us-east",
+            "afk_channel_id": None,
+            "afk_timeout": 300,
+            "verification_level": 1,
+            "default_message_notifications": 1,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "large": members > 250,
+            "unavailable": False,
+            "member_count": members,
+            "joined_at": "2017-01-01T00:00:00.000000+00:00",
+            "features": [],
+            "emojis": [],
+            "voice_states": [],
+            "roles": [{
+                "id": role_id,
+                "name": "role {}".format(index),
+                "color": rng.randint(0, 0xffffff),
+                "hoist": False,
+                "position": index,
+                "permissions": 104324161,
+                "managed": False,
+                "mentionable": False,
+            } for index, role_id in enumerate(role_ids)],
+            "channels": [{
+                "id": _snowflake(rng),
+                "type": 0,
+                "name": "channel-{}".format(index),
+                "position": index,
+                "parent_id": None,
+                "topic": "the topic of channel {}".format(index),
+                "nsfw": False,
+                "last_message_id": _snowflake(rng),
+                "permission_overwrites": [{
+                    "id": rng.choice(role_ids),
+                    "type": "role",
+                    "allow": 1024,
+                    "deny": 0,
+                }],
+            } for index in range(channels)],
+            "members": [{
+                "user": {
+                    "id": member_id,
+                    "username": "user {}".format(index),
+                    "discriminator": "{:04d}".format(rng.randint(1, 9999)),
+                    "avatar": "b" * 32 if rng.random() < 0.7 else None,
+                },
+                "nick": "nick {}".format(index) if rng.random() < 0.2 else None,
+                "roles": rng.sample(role_ids, rng.randint(0, min(3, roles))),
+                "joined_at": "2017-01-01T00:00:00.000000+00:00",
+                "deaf": False,
+                "mute": False,
+            } for index, member_id in enumerate(member_ids)],
+            "presences": [{
+                "user": {"id": member_id},
+                "status": rng.choice(["online", "idle", "dnd"]),
+                "game": {"name": "a game", "type": 0} if rng.random() < 0.3 else None,
+            } for member_id in member_ids if rng.random() < 0.4],
+        },
+    }
+
+
+def snowflakes_to_ints(obj: typing.Any) -> typing.Any:
+    """
+    Turns every snowflake string in a JSON payload into an int, as the ETF encoding sends them.
+    """
+    if isinstance(obj, dict):
+        return {key: snowflakes_to_ints(value) for key, value in obj.items()}
+
+    if isinstance(obj, list):
+        return [snowflakes_to_ints(item) for item in obj]
+
+    if isinstance(obj, str) and 15 <= len(obj) <= 20 and obj.isdigit():
+        return int(obj)
+
+    return obj
+
+
+def _best_of(fn: typing.Callable[[], typing.Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def _decompress(data: bytes) -> bytes:
+    # a fresh inflater per frame, like the first frame of a zlib-stream
+    return zlib.decompressobj().decompress(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--payload", help="A recorded JSON dispatch to decode.")
+    parser.add_argument("--members", type=int, default=1000,
+                        help="The number of members in the generated GUILD_CREATE.")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="The number of times to decode each payload; the best is reported.")
+    args = parser.parse_args()
+
+    if args.payload:
+        with open(args.payload, "rb") as f:
+            payload = json.loads(f.read())
+    else:
+        payload = make_guild_create(members=args.members)
+
+    json_data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    etf_data = etf.encode(snowflakes_to_ints(payload))
+    json_frame = zlib.compress(json_data)
+    etf_frame = zlib.compress(etf_data)
+
+    # sanity check that both decode to the same structure
+    assert snowflakes_to_ints(json.loads(json_data)) == etf.decode(etf_data)
+
+    rows = [
+        ("json", len(json_data), len(json_frame),
+         _best_of(lambda: json.loads(json_data), args.repeat),
+         _best_of(lambda: json.loads(_decompress(json_frame)), args.repeat)),
+        ("etf", len(etf_data), len(etf_frame),
+         _best_of(lambda: etf.decode(etf_data), args.repeat),
+         _best_of(lambda: etf.decode(_decompress(etf_frame)), args.repeat)),
+    ]
+
+    print("{:>8} {:>12} {:>12} {:>12} {:>16}".format("encoding", "bytes", "zlib bytes",
+                                                     "decode ms", "inflate+decode ms"))
+    for name, size, compressed, decode, inflate_decode in rows:
+        print("{:>8} {:>12} {:>12} {:>12.2f} {:>16.2f}".format(name, size, compressed,
+                                                               decode * 1000,
+                                                               inflate_decode * 1000))
+
+
+if __name__ == "__main__":
+    main()
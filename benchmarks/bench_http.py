@@ -0,0 +1,221 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks the :class:`.HTTPClient` request path against the :class:`.MockDiscord` server.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_http --lib trio --time-scale 0.1
+    python -m benchmarks.bench_http messages reactions --scale 2
+    python -m benchmarks.bench_http burst --check
+
+Each scenario reports the requests per second, the p50/p99 latency of the requests that got a
+response, the time spent waiting on ratelimits, and the 429s and server errors seen. With
+``--check``, it exits with an error if any request hit the global ratelimit.
+"""
+import argparse
+import math
+import time
+import typing
+
+import multio
+
+from benchmarks.mockdiscord import MockDiscord
+from curious.core.httpclient import HTTPClient
+from curious.core.httpstats import RequestRecord
+
+
+class Result(object):
+    """
+    The result of running a scenario.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.records = []  # type: typing.List[RequestRecord]
+        self.elapsed = 0.0
+
+        #: The number of 429s caused by the global ratelimit.
+        self.global_429s = 0
+
+    def percentile(self, q: float) -> float:
+        latencies = sorted(record.latency for record in self.records
+                           if record.status_code is not None)
+        if not latencies:
+            return 0.0
+
+        return latencies[min(len(latencies) - 1, max(0, math.ceil(q * len(latencies)) - 1))]
+
+    def summary(self) -> typing.Dict[str, typing.Any]:
+        statuses = [record.status_code for record in self.records]
+        return {
+            "scenario": self.name,
+            "requests": len(self.records),
+            "seconds": self.elapsed,
+            "rps": len(self.records) / self.elapsed if self.elapsed else 0.0,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "bucket_wait": sum(record.bucket_wait for record in self.records),
+            "global_wait": sum(record.global_wait for record in self.records),
+            "429s": statuses.count(429),
+            "global_429s": self.global_429s,
+            "5xxs": sum(1 for status in statuses if status is not None and status >= 500),
+        }
+
+
+async def _gather(*fns: typing.Callable[[], typing.Awaitable[None]]) -> None:
+    async with multio.asynclib.task_manager() as tg:
+        for fn in fns:
+            await multio.asynclib.spawn(tg, fn)
+
+
+async def message_sends(http: HTTPClient, scale: int) -> None:
+    """
+    Sends messages to 10 channels at once, as a bot replying to commands would.
+    """
+    async def send_to(channel_id: int):
+        await _gather(*[
+            lambda i=i: http.send_message(channel_id, "message {}".format(i))
+            for i in range(10 * scale)
+        ])
+
+    await _gather(*[lambda c=c: send_to(1000 + c) for c in range(10)])
+
+
+async def reaction_storm(http: HTTPClient, scale: int) -> None:
+    """
+    Adds many reactions to a single message at once, as a reaction menu would.
+    """
+    await _gather(*[
+        lambda i=i: http.add_reaction(2000, 2001, chr(0x1f600 + i))
+        for i in range(10 * scale)
+    ])
+
+
+async def member_pagination(http: HTTPClient, scale: int) -> None:
+    """
+    Pages through the members of a guild, as a chunking fallback would.
+    """
+    after = 0
+    while True:
+        members = await http.get_guild_members(3000, limit=1000, after=after)
+        if len(members) < 1000:
+            return
+
+        after = int(members[-1]["user"]["id"])
+
+
+async def global_burst(http: HTTPClient, scale: int) -> None:
+    """
+    Sends a burst of GETs to distinct buckets, so that only the global ratelimit applies.
+    """
+    await _gather(*[lambda i=i: http.get_channel(4000 + i) for i in range(150 * scale)])
+
+
+async def mixed(http: HTTPClient, scale: int) -> None:
+    """
+    All of the other scenarios at once.
+    """
+    await _gather(lambda: message_sends(http, scale), lambda: reaction_storm(http, scale),
+                  lambda: member_pagination(http, scale))
+
+
+SCENARIOS = {
+    "messages": message_sends,
+    "reactions": reaction_storm,
+    "members": member_pagination,
+    "burst": global_burst,
+    "mixed": mixed,
+}
+
+
+async def run_scenario(name: str, *, scale: int = 1, time_scale: float = 0.1,
+                       latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0,
+                       seed: int = 0) -> Result:
+    """
+    Runs a scenario against a fresh :class:`.MockDiscord` server and :class:`.HTTPClient`.
+
+    :param name: The name of the scenario.
+    :param scale: The factor to scale the number of requests by.
+    :return: The :class:`.Result` of the scenario.
+    """
+    server = MockDiscord(time_scale=time_scale, latency=latency, jitter=jitter,
+                         error_rate=error_rate, guild_members=10000 * scale, seed=seed)
+    http = HTTPClient("benchmark", ratelimit_backend=server.ratelimit_backend())
+    server.attach(http)
+
+    result = Result(name)
+    http.instrumentation.add_listener(result.records.append)
+
+    start = time.monotonic()
+    await SCENARIOS[name](http, scale)
+    result.elapsed = time.monotonic() - start
+    result.global_429s = server.global_ratelimits
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help="The scenarios to run, out of {}. Defaults to all of them."
+                        .format(", ".join(SCENARIOS)))
+    parser.add_argument("--lib", default="curio", choices=["curio", "trio"],
+                        help="The async library to run on.")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="The factor to scale the number of requests by.")
+    parser.add_argument("--time-scale", type=float, default=0.1,
+                        help="The factor to scale ratelimit windows by.")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="The minimum response latency, in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.02,
+                        help="The maximum random latency added to each response, in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="The fraction of requests that get a 502.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true",
+                        help="Exit with an error if any request hit the global ratelimit.")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario {}".format(name))
+
+    multio.init(args.lib)
+
+    columns = ("scenario", "requests", "seconds", "rps", "p50_ms", "p99_ms", "bucket_wait",
+               "global_wait", "429s", "global_429s", "5xxs")
+    print(" ".join("{:>11}".format(column) for column in columns))
+
+    global_429s = 0
+    for name in args.scenarios or SCENARIOS:
+        results = []
+
+        async def _run():
+            results.append(await run_scenario(name, scale=args.scale, time_scale=args.time_scale,
+                                              latency=args.latency, jitter=args.jitter,
+                                              error_rate=args.error_rate, seed=args.seed))
+
+        multio.run(_run)
+        summary = results[0].summary()
+        global_429s += summary["global_429s"]
+        print(" ".join("{:>11.2f}".format(summary[column]) if isinstance(summary[column], float)
+                       else "{:>11}".format(summary[column]) for column in columns))
+
+    if args.check and global_429s:
+        parser.exit(1, "{} requests hit the global ratelimit\n".format(global_429s))
+
+
+if __name__ == "__main__":
+    main()
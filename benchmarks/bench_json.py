@@ -0,0 +1,149 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks the installed JSON codecs on gateway frames.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_json --members 5000
+    python -m benchmarks.bench_json --codec stdlib --codec orjson
+
+Each codec decodes a large GUILD_CREATE, decodes a batch of small MESSAGE_CREATE dispatches, and
+encodes a batch of the frames a client sends (heartbeats, presence updates and member requests).
+"""
+import argparse
+import typing
+
+from benchmarks.bench_gateway import _best_of, make_guild_create
+from curious.core.jsoncodec import CODECS, JSONCodec, available_codecs, get_codec
+
+
+def make_message_create(index: int) -> dict:
+    """
+    Makes a small MESSAGE_CREATE dispatch, the most common frame a bot receives.
+    """
+    return {
+        "op": 0,
+        "s": index,
+        "t": "MESSAGE_CREATE",
+        "d": {
+            "id": str(400000000000000000 + index),
+            "channel_id": "300000000000000000",
+            "guild_id": "200000000000000000",
+            "type": 0,
+            "content": "message number {} \N{SMILING FACE WITH OPEN MOUTH}".format(index),
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "timestamp": "2017-01-01T00:00:00.000000+00:00",
+            "edited_timestamp": None,
+            "nonce": str(500000000000000000 + index),
+            "author": {
+                "id": "100000000000000000",
+                "username": "someone",
+                "discriminator": "0001",
+                "avatar": None,
+            },
+        },
+    }
+
+
+def make_outgoing_frames() -> typing.List[dict]:
+    """
+    Makes the frames a client sends the gateway, in roughly the proportions it sends them.
+    """
+    frames = [{"op": 1, "d": sequence} for sequence in range(80)]
+    frames += [{
+        "op": 3,
+        "d": {"game": {"name": "game {}".format(index), "type": 0}, "status": "online",
+              "since": None, "afk": False},
+    } for index in range(15)]
+    frames += [{
+        "op": 8,
+        "d": {"guild_id": [str(200000000000000000 + index)], "query": "", "limit": 0},
+    } for index in range(5)]
+    return frames
+
+
+def run_codec(codec: JSONCodec, guild_create: bytes, messages: typing.List[bytes],
+              outgoing: typing.List[dict], repeat: int) -> typing.Tuple[float, float, float]:
+    """
+    Times a codec.
+
+    :return: A tuple of the best (GUILD_CREATE decode, MESSAGE_CREATE decode, encode) times.
+    """
+    loads, dumps = codec.loads, codec.dumps
+
+    def _decode_messages():
+        for message in messages:
+            loads(message)
+
+    def _encode_outgoing():
+        for frame in outgoing:
+            dumps(frame)
+
+    return (_best_of(lambda: loads(guild_create), repeat),
+            _best_of(_decode_messages, repeat),
+            _best_of(_encode_outgoing, repeat))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--codec", action="append", dest="codecs",
+                        help="A codec to benchmark, out of {}. Defaults to every installed codec."
+                        .format(", ".join(CODECS)))
+    parser.add_argument("--members", type=int, default=1000,
+                        help="The number of members in the generated GUILD_CREATE.")
+    parser.add_argument("--messages", type=int, default=1000,
+                        help="The number of MESSAGE_CREATE dispatches to decode.")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="The number of times to run each case; the best is reported.")
+    args = parser.parse_args()
+
+    installed = available_codecs()
+    for name in args.codecs or ():
+        if name not in installed:
+            parser.error("unknown or uninstalled codec {}".format(name))
+
+    # frames arrive as UTF-8 bytes once inflated, so encode them with the stdlib codec up front
+    reference = get_codec("stdlib")
+    payload = make_guild_create(members=args.members)
+    guild_create = reference.dumpb(payload)
+    messages = [reference.dumpb(make_message_create(index)) for index in range(args.messages)]
+    outgoing = make_outgoing_frames()
+
+    print("GUILD_CREATE: {} bytes, {} x MESSAGE_CREATE, {} outgoing frames"
+          .format(len(guild_create), len(messages), len(outgoing)))
+    print("{:>10} {:>18} {:>20} {:>12}".format("codec", "guild_create ms", "message_create ms",
+                                               "encode ms"))
+
+    for name in args.codecs or installed:
+        codec = get_codec(name)
+        # sanity check that every codec agrees
+        assert codec.loads(guild_create) == payload
+        assert reference.loads(codec.dumpb(payload)) == payload
+
+        guild, message, encode = run_codec(codec, guild_create, messages, outgoing, args.repeat)
+        print("{:>10} {:>18.2f} {:>20.2f} {:>12.2f}".format(name, guild * 1000, message * 1000,
+                                                            encode * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An in-process stand-in for the Discord REST API, for benchmarking the :class:`.HTTPClient` without
+touching the network.
+
+It emulates per-route ratelimit buckets (with the ``X-Ratelimit-*`` headers), 429s, the global
+ratelimit, server errors and response latency, and answers a few endpoints with realistic
+payloads. Everything else gets an empty JSON object.
+
+.. code-block:: python3
+
+    server = MockDiscord(time_scale=0.1)
+    http = HTTPClient("token", ratelimit_backend=server.ratelimit_backend())
+    server.attach(http)
+    await http.send_message(1, "hello")
+"""
+import datetime
+import itertools
+import json
+import random
+import re
+import time
+import typing
+import zlib
+from email.utils import formatdate
+from urllib.parse import parse_qsl, urlsplit
+
+import multio
+from multidict import CIMultiDict
+
+from curious.core.httpclient import Endpoints
+from curious.core.httpstats import route_template
+from curious.core.ratelimit import LocalRatelimitBackend
+
+DISCORD_EPOCH = 1420070400000
+
+#: The default (limit, window in seconds) of the emulated ratelimit buckets, by method and route.
+DEFAULT_BUCKETS = {
+    ("POST", "/channels/{id}/messages"): (5, 5.0),
+    ("PUT", "/channels/{id}/messages/{id}/reactions/{emoji}/@me"): (1, 0.25),
+    ("DELETE", "/channels/{id}/messages/{id}/reactions/{emoji}/@me"): (1, 0.25),
+    ("DELETE", "/channels/{id}/messages/{id}"): (5, 1.0),
+    ("GET", "/channels/{id}/messages"): (5, 5.0),
+    ("GET", "/guilds/{id}/members"): (10, 10.0),
+}
+
+#: The (limit, window in seconds) of routes not in the bucket table.
+DEFAULT_BUCKET = (10, 10.0)
+
+_MAJOR_PARAMETER = re.compile(r"^/(channels|guilds|webhooks)/(\d+)")
+
+
+class MockResponse(object):
+    """
+    A response from the :class:`.MockDiscord` server, with the parts of the asks response API that
+    the :class:`.HTTPClient` uses.
+    """
+
+    def __init__(self, status_code: int, headers: typing.Mapping[str, str], body: bytes):
+        self.status_code = status_code
+        self.headers = CIMultiDict(headers)
+        self.body = body
+
+    def __repr__(self) -> str:
+        return "<MockResponse status={}>".format(self.status_code)
+
+    @property
+    def content(self) -> bytes:
+        return self.body
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8")
+
+    def json(self) -> typing.Any:
+        return json.loads(self.body.decode("utf-8"))
+
+
+class MockSession(object):
+    """
+    Stands in for the :class:`.PooledSession` of a :class:`.HTTPClient`, sending every request to a
+    :class:`.MockDiscord` server.
+    """
+
+    def __init__(self, server: 'MockDiscord'):
+        self.server = server
+
+    @property
+    def pool_stats(self) -> typing.Dict[str, int]:
+        return {"hits": 0, "misses": 0, "evictions": 0, "idle": 0, "checked_out": 0}
+
+    async def request(self, method: str, *, url: str, headers: typing.Mapping[str, str] = None,
+                      data: typing.Any = None, params: typing.Mapping[str, typing.Any] = None,
+                      **kwargs) -> MockResponse:
+        return await self.server.handle(method, url, headers=headers or {}, data=data,
+                                        params=params or {})
+
+
+class _Bucket(object):
+    __slots__ = "limit", "window", "remaining", "reset_at", "hash"
+
+    def __init__(self, limit: int, window: float, bucket_hash: str):
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset_at = 0.0
+        self.hash = bucket_hash
+
+
+class MockDiscord(object):
+    """
+    An in-process emulation of the Discord REST API.
+    """
+
+    def __init__(self, *,
+                 buckets: typing.Mapping[typing.Tuple[str, str], typing.Tuple[int, float]] = None,
+                 global_limit: int = 50,
+                 time_scale: float = 1.0,
+                 latency: float = 0.05,
+                 jitter: float = 0.02,
+                 error_rate: float = 0.0,
+                 guild_members: int = 10000,
+                 seed: int = None):
+        """
+        :param buckets: The mapping of (method, route template) -> (limit, window in seconds) of
+            the emulated buckets. Defaults to :data:`.DEFAULT_BUCKETS`.
+        :param global_limit: The number of requests allowed per second, across all buckets.
+        :param time_scale: The factor to scale every ratelimit window by. Values below 1 make
+            ratelimits proportionally shorter, so benchmarks finish quicker.
+        :param latency: The minimum time to answer a request in, in seconds.
+        :param jitter: The maximum random time added to the latency, in seconds.
+        :param error_rate: The fraction of requests that get a ``502 Bad Gateway``.
+        :param guild_members: The number of members in every emulated guild.
+        :param seed: The seed for the latency jitter and errors.
+        """
+        self.bucket_table = dict(DEFAULT_BUCKETS if buckets is None else buckets)
+        self.global_limit = global_limit
+        self.time_scale = time_scale
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.guild_members = guild_members
+
+        self._random = random.Random(seed)
+        self._buckets = {}  # type: typing.Dict[tuple, _Bucket]
+        self._global_remaining = global_limit
+        self._global_reset_at = 0.0
+        self._ids = itertools.count()
+
+        #: The number of requests answered, by status code.
+        self.responses = {}  # type: typing.Dict[int, int]
+
+        #: The number of 429s caused by the global ratelimit.
+        self.global_ratelimits = 0
+
+    def __repr__(self) -> str:
+        return "<MockDiscord buckets={} responses={}>".format(len(self._buckets), self.responses)
+
+    @property
+    def global_rate(self) -> float:
+        """
+        :return: The global ratelimit, in requests per second, after time scaling.
+        """
+        return self.global_limit / self.time_scale
+
+    def ratelimit_backend(self) -> LocalRatelimitBackend:
+        """
+        :return: A :class:`.LocalRatelimitBackend` whose global limiter matches this server's
+            global ratelimit, after time scaling.
+        """
+        return LocalRatelimitBackend(global_rate=self.global_rate, global_window=self.time_scale)
+
+    def attach(self, http) -> None:
+        """
+        Points a :class:`.HTTPClient` at this server.
+        """
+        http.session = MockSession(self)
+
+    def _snowflake(self) -> str:
+        now = int(time.time() * 1000) - DISCORD_EPOCH
+        return str((now << 22) | (next(self._ids) & 0x3fffff))
+
+    def _bucket_for(self, method: str, path: str, route: str) -> _Bucket:
+        major = _MAJOR_PARAMETER.match(path)
+        key = (method, route, major.group(0) if major else None)
+        try:
+            return self._buckets[key]
+        except KeyError:
+            limit, window = self.bucket_table.get((method, route), DEFAULT_BUCKET)
+            bucket_hash = "{:08x}".format(zlib.crc32("{} {}".format(method, route).encode()))
+            bucket = self._buckets[key] = _Bucket(limit, window * self.time_scale, bucket_hash)
+            return bucket
+
+    def _respond(self, status_code: int, headers: dict, payload: typing.Any = None) -> MockResponse:
+        self.responses[status_code] = self.responses.get(status_code, 0) + 1
+        headers["Date"] = formatdate(usegmt=True)
+        if payload is None:
+            return MockResponse(status_code, headers, b"")
+
+        headers["Content-Type"] = "application/json"
+        return MockResponse(status_code, headers, json.dumps(payload).encode("utf-8"))
+
+    async def handle(self, method: str, url: str, *, headers: typing.Mapping[str, str],
+                     data: typing.Any = None,
+                     params: typing.Mapping[str, typing.Any] = None) -> MockResponse:
+        """
+        Answers a request.
+        """
+        await multio.asynclib.sleep(self.latency + self._random.uniform(0, self.jitter))
+
+        split = urlsplit(url)
+        path = split.path
+        if path.startswith(Endpoints.API_BASE):
+            path = path[len(Endpoints.API_BASE):]
+
+        query = dict(parse_qsl(split.query))
+        query.update({key: str(value) for key, value in (params or {}).items()})
+
+        if self._random.random() < self.error_rate:
+            return self._respond(502, {})
+
+        now = time.monotonic()
+
+        # the global ratelimit comes first, and has no bucket headers
+        if now >= self._global_reset_at:
+            self._global_remaining = self.global_limit
+            self._global_reset_at = now + self.time_scale
+
+        if self._global_remaining <= 0:
+            self.global_ratelimits += 1
+            retry_after = self._global_reset_at - now
+            return self._respond(429, {
+                "X-Ratelimit-Global": "true",
+                "Retry-After": str(int(retry_after * 1000)),
+            }, {"message": "You are being rate limited.", "retry_after": retry_after,
+                "global": True})
+
+        self._global_remaining -= 1
+
+        route = route_template(path)
+        bucket = self._bucket_for(method, path, route)
+        if now >= bucket.reset_at:
+            bucket.remaining = bucket.limit
+            bucket.reset_at = now + bucket.window
+
+        reset_after = bucket.reset_at - now
+        ratelimit_headers = {
+            "X-Ratelimit-Limit": str(bucket.limit),
+            "X-Ratelimit-Reset": "{:.3f}".format(time.time() + reset_after),
+            "X-Ratelimit-Reset-After": "{:.3f}".format(reset_after),
+            "X-Ratelimit-Bucket": bucket.hash,
+        }
+
+        if bucket.remaining <= 0:
+            ratelimit_headers["X-Ratelimit-Remaining"] = "0"
+            ratelimit_headers["Retry-After"] = str(int(reset_after * 1000))
+            return self._respond(429, ratelimit_headers, {
+                "message": "You are being rate limited.", "retry_after": reset_after,
+                "global": False
+            })
+
+        bucket.remaining -= 1
+        ratelimit_headers["X-Ratelimit-Remaining"] = str(bucket.remaining)
+
+        status_code, payload = self._route(method, path, route, query, data)
+        return self._respond(status_code, ratelimit_headers, payload)
+
+    def _route(self, method: str, path: str, route: str, query: typing.Mapping[str, str],
+               data: typing.Any) -> typing.Tuple[int, typing.Any]:
+        ids = re.findall(r"\d+", path)
+
+        if (method, route) == ("POST", "/channels/{id}/messages"):
+            try:
+                body = json.loads(bytes(data).decode("utf-8")) if data else {}
+            except (TypeError, ValueError):
+                # multipart uploads aren't decoded
+                body = {}
+
+            return 200, {
+                "id": self._snowflake(),
+                "channel_id": ids[0],
+                "type": 0,
+                "content": body.get("content", ""),
+                "tts": body.get("tts", False),
+                "embeds": [body["embed"]] if body.get("embed") else [],
+                "author": {"id": "1", "username": "curious", "discriminator": "0001",
+                           "avatar": None, "bot": True},
+                "timestamp": datetime.datetime.utcnow().isoformat() + "+00:00",
+                "edited_timestamp": None,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": [],
+                "pinned": False,
+            }
+
+        if route.endswith("/reactions/{emoji}/@me") or method == "DELETE":
+            return 204, None
+
+        if (method, route) == ("GET", "/guilds/{id}/members"):
+            limit = max(1, min(int(query.get("limit", 1)), 1000))
+            after = int(query.get("after", 0))
+            first = after + 1
+            last = min(after + limit, self.guild_members)
+            return 200, [{
+                "user": {"id": str(member_id), "username": "member{}".format(member_id),
+                         "discriminator": "{:04d}".format(member_id % 10000), "avatar": None},
+                "nick": None,
+                "roles": [],
+                "joined_at": "2017-01-01T00:00:00+00:00",
+                "deaf": False,
+                "mute": False,
+            } for member_id in range(first, last + 1)]
+
+        return 200, {}
@@ -25,9 +25,16 @@ delegating it to client code.
     :toctree: core
     
     client
+    etf
     event
     gateway
+    httpcache
     httpclient
+    httpstats
+    jsoncodec
+    multipart
+    ratelimit
+    sharedratelimit
     state
 """
 
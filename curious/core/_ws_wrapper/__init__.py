@@ -53,4 +53,10 @@ class BasicWebsocketWrapper(AsyncIterable):
     async def send_text(self, text: str) -> None:
         """
         Sends text down the websocket.
+        """
+
+    @abc.abstractmethod
+    async def send_binary(self, data: bytes) -> None:
+        """
+        Sends binary data down the websocket.
         """
\ No newline at end of file
@@ -75,6 +75,13 @@ class CurioWebsocketWrapper(BasicWebsocketWrapper):
         """
         self._ws.send_text(message)
 
+    @async_thread
+    def send_binary(self, data: bytes):
+        """
+        Sends binary data to the websocket.
+        """
+        self._ws.send_binary(data)
+
     @async_thread
     def close(self, code: int = 1000, reason: str = "Client disconnect", reconnect: bool = False,
               forceful: bool = False):
@@ -95,6 +95,14 @@ class TrioWebsocketWrapper(BasicWebsocketWrapper):
         """
         self._ws.send_text(text)
 
+    async def send_binary(self, data: bytes) -> None:
+        """
+        Sends binary data down the websocket.
+
+        :param data: The data to send.
+        """
+        self._ws.send_binary(data)
+
     async def __aiter__(self) -> 'AsyncIterator[Event]':
         async for item in self._queue:
             if item == self._done:
@@ -84,7 +84,7 @@ class Chunker(object):
 
             if len(guilds) < self.batch_size:
                 # if all are available, skip the exit check
-                if any(guild.unavailable for guild in self.client.guilds_for(shard)):
+                if self.client.state.unavailable_count(shard) > 0:
                     continue
 
             # pray for the gil
@@ -103,14 +103,14 @@ class Chunker(object):
         if self._ready[shard_id]:
             return
 
-        guilds = self.client.guilds_for(shard_id)
+        state = self.client.state
 
         # if they're unavailable we clearly don't have the members
-        if any(guild.unavailable is True for guild in guilds):
+        if state.unavailable_count(shard_id) > 0:
             return
 
         # if they're not all set then we don't want to fire ready at all
-        if not all(guild._finished_chunking.is_set() for guild in guilds if guild.large):
+        if state.unchunked_large_count(shard_id) > 0:
             return
 
         # fire a ready
@@ -28,12 +28,15 @@ import inspect
 import logging
 import multio
 import typing
+from async_generator import aclosing
 from types import MappingProxyType
 
 from curious.core import chunker as md_chunker
 from curious.core.event import EventContext, EventManager, event as ev_dec, scan_events
 from curious.core.gateway import GatewayHandler, open_websocket
 from curious.core.httpclient import HTTPClient
+from curious.core.jsoncodec import JSONCodec, get_codec
+from curious.core.ratelimit import RatelimitBackend
 from curious.dataclasses import channel as dt_channel, guild as dt_guild, member as dt_member
 from curious.dataclasses.appinfo import AppInfo
 from curious.dataclasses.bases import allow_external_makes
@@ -43,7 +46,7 @@ from curious.dataclasses.presence import Game, Status
 from curious.dataclasses.user import BotUser, User
 from curious.dataclasses.webhook import Webhook
 from curious.dataclasses.widget import Widget
-from curious.util import base64ify
+from curious.util import base64ify, coerce_agen
 
 logger = logging.getLogger("curious.client")
 
@@ -106,11 +109,22 @@ class Client(object):
 
     def __init__(self, token: str, *,
                  state_klass: type = None,
-                 bot_type: int = (BotType.BOT | BotType.ONLY_USER)):
+                 bot_type: int = (BotType.BOT | BotType.ONLY_USER),
+                 json_codec: typing.Union[str, JSONCodec] = None,
+                 ignored_dispatches: typing.Iterable[str] = (),
+                 ratelimit_backend: RatelimitBackend = None):
         """
         :param token: The current token for this bot.
         :param state_klass: The class to construct the connection state from.
         :param bot_type: A union of :class:`.BotType` that defines the type of this bot.
+        :param json_codec: The :class:`.JSONCodec` (or the name of one) used for the gateway and
+            HTTP. Defaults to the fastest installed codec.
+        :param ignored_dispatches: The names of gateway dispatches (such as ``TYPING_START``) to
+            drop without decoding or handling them. The state is not updated for these, and no
+            events are fired for them.
+        :param ratelimit_backend: The :class:`.RatelimitBackend` the :class:`.HTTPClient` stores
+            ratelimit state in. Pass a :class:`.SharedRatelimitBackend` to share ratelimits
+            between processes. If None, a :class:`.LocalRatelimitBackend` is used.
         """
         #: The mapping of `shard_id -> gateway` objects.
         self._gateways = {}  # type: typing.MutableMapping[int, GatewayHandler]
@@ -142,12 +156,22 @@ class Client(object):
 
         self._ready_state = {}
 
+        #: The :class:`.JSONCodec` used for this bot.
+        self.json_codec = get_codec(json_codec)
+
         #: The :class:`.HTTPClient` used for this bot.
-        self.http = HTTPClient(self._token, bot=bool(self.bot_type & BotType.BOT))
+        self.http = HTTPClient(self._token, bot=bool(self.bot_type & BotType.BOT),
+                               json_codec=self.json_codec, ratelimit_backend=ratelimit_backend)
 
         #: The cached gateway URL.
         self._gw_url = None  # type: str
 
+        #: The gateway payload encoding.
+        self._gw_encoding = "json"
+
+        #: The gateway dispatches to drop without handling.
+        self._ignored_dispatches = frozenset(ignored_dispatches)
+
         #: The application info for this bot. Instance of :class:`.AppInfo`.
         #: This will be None for user bots.
         self.application_info = None  # type: AppInfo
@@ -471,6 +495,103 @@ class Client(object):
 
         return member
 
+    async def stream_guild_members(self, guild_id: int, *,
+                                   after: int = None, page_size: int = 1000,
+                                   cache_users: bool = True) \
+            -> 'typing.AsyncGenerator[dt_member.Member, None]':
+        """
+        Streams the members for a :class:`.Guild` over HTTP, page by page.
+
+        Whilst the client is running, the next page is fetched in the client's task group whilst
+        the current one is being consumed. Only one page of members is held at any time.
+
+        Close the generator if you stop iterating early, so that a page being fetched in the
+        background is cancelled straight away. :func:`async_generator.aclosing` does this on
+        both curio and trio:
+
+        .. code-block:: python3
+
+            async with aclosing(client.stream_guild_members(id)) as gen:
+                async for member in gen:
+                    ...
+
+        :param guild_id: The ID of the guild to download members for.
+        :param after: The member ID after which to get members for.
+        :param page_size: The number of members to request per page.
+        :param cache_users: If the users of the downloaded members should be kept in the state. \
+            If False, users that are not otherwise referenced are dropped straight away.
+        :return: An async generator of :class:`.Member`.
+        """
+        async def fetch(after_id: int, promise: multio.Promise):
+            try:
+                data = await self.http.get_guild_members(guild_id=guild_id, limit=page_size,
+                                                         after=after_id)
+            except Exception as e:
+                await promise.set((False, e))
+            else:
+                await promise.set((True, data))
+
+        async def prefetch(after_id: int, promise: multio.Promise, groups: list):
+            # this runs in the client's task group, as a task group can't be kept open across a
+            # yield; the fetch gets a task group of its own so that it can be cancelled if the
+            # stream is closed before the page is used
+            async with multio.asynclib.task_manager() as tg:
+                # the stream was closed before this task started
+                if promise.is_set():
+                    return
+
+                groups.append(tg)
+                await multio.asynclib.spawn(tg, fetch, after_id, promise)
+
+        last_id = after or 0
+        next_page = None  # type: multio.Promise
+        prefetch_groups = []
+        try:
+            page = await self.http.get_guild_members(guild_id=guild_id, limit=page_size,
+                                                     after=last_id)
+
+            while page:
+                # if there's less data than the page size, this is the last page
+                if len(page) < page_size:
+                    next_page = None
+                else:
+                    last_id = page[-1]["user"]["id"]
+                    next_page = multio.Promise()
+                    # without a running client, there's nowhere to prefetch in
+                    if self.task_manager is not None:
+                        prefetch_groups = []
+                        await multio.asynclib.spawn(self.task_manager, prefetch, last_id,
+                                                    next_page, prefetch_groups)
+
+                for datum in page:
+                    member = dt_member.Member(self, **datum)
+                    member.guild_id = guild_id
+                    if not cache_users:
+                        self.state._check_decache_user(member.id)
+
+                    yield member
+
+                # drop our reference to this page before waiting on the next one
+                page = None
+                if next_page is None:
+                    break
+
+                if self.task_manager is None:
+                    await fetch(last_id, next_page)
+
+                success, result = await next_page.wait()
+                next_page = None
+                if not success:
+                    raise result
+
+                page = result
+        finally:
+            # the stream was closed early, so stop the prefetch rather than letting it finish
+            if next_page is not None and not next_page.is_set():
+                await next_page.set((False, None))
+                for group in prefetch_groups:
+                    await multio.asynclib.cancel_task_group(group)
+
     async def download_guild_members(self, guild_id: int, *,
                                      after: int = None, limit: int = 1000,
                                      get_all: bool = True) -> 'typing.Iterable[dt_member.Member]':
@@ -479,7 +600,8 @@ class Client(object):
         
         .. warning::
         
-            This can take a long time on big guilds.
+            This can take a long time on big guilds. Use :meth:`.stream_guild_members` to avoid
+            holding every member in memory at once.
         
         :param guild_id: The ID of the guild to download members for.
         :param after: The member ID after which to get members for.
@@ -487,26 +609,11 @@ class Client(object):
         :param get_all: Should *all* members be fetched?
         :return: An iterable of :class:`.Member`.
         """
-        member_data = []
         if get_all is True:
-            last_id = 0
-            while True:
-                next_data = await self.http.get_guild_members(guild_id=guild_id, limit=limit,
-                                                              after=last_id)
-                # no more members to get
-                if not next_data:
-                    break
+            return await coerce_agen(self.stream_guild_members(guild_id, page_size=limit))
 
-                member_data.extend(next_data)
-                # if there's less data than limit, we are finished downloading members
-                if len(next_data) < limit:
-                    break
-
-                last_id = member_data[-1]["user"]["id"]
-        else:
-            next_data = await self.http.get_guild_members(guild_id=guild_id, limit=limit,
-                                                          after=after)
-            member_data.extend(next_data)
+        member_data = await self.http.get_guild_members(guild_id=guild_id, limit=limit,
+                                                        after=after)
 
         # create the member objects
         members = []
@@ -555,16 +662,31 @@ class Client(object):
 
         # update the guild store
         self.state._guilds[guild_id] = guild
+        self.state._index_guild(guild)
 
         if full:
-            # download all of the members
-            members = await self.download_guild_members(guild_id=guild_id, get_all=True)
-            # update the `_members` dict
-            guild._members = {m.id: m for m in members}
+            # stream all of the members straight into a new `_members` dict
+            members = {}
+            gen = self.stream_guild_members(guild_id)
+            async with aclosing(gen) as agen:
+                async for member in agen:
+                    members[member.id] = member
+                    self.state._add_user_ref(member.id, guild_id)
+
+            old_members, guild._members = guild._members, members
+            for member_id in old_members.keys() - members.keys():
+                self.state._remove_user_ref(member_id, guild_id)
 
             # download all of the channels
             channels = await self.download_channels(guild_id=guild_id)
-            guild._channels = {c.id: c for c in channels}
+            for channel_id in guild._channels:
+                self.state._channels.pop(channel_id, None)
+
+            # update in-place, as the channel wrapper holds a reference to this dict
+            guild._channels.clear()
+            for channel in channels:
+                guild._channels[channel.id] = channel
+                self.state._channels[channel.id] = channel
 
         return guild
 
@@ -628,7 +750,10 @@ class Client(object):
         """
         # consume events
         async with open_websocket(self._token, self._gw_url,
-                                  shard_id=shard_id, shard_count=shard_count) as gw:
+                                  shard_id=shard_id, shard_count=shard_count,
+                                  encoding=self._gw_encoding,
+                                  json_codec=self.json_codec,
+                                  ignored_dispatches=self._ignored_dispatches) as gw:
             self._gateways[shard_id] = gw
 
             try:
@@ -661,19 +786,25 @@ class Client(object):
             for shard_id in range(0, shard_count):
                 await multio.asynclib.spawn(tg, self.handle_shard, shard_id, shard_count)
 
-    async def run_async(self, *, shard_count: int = 1, autoshard: bool = True):
+    async def run_async(self, *, shard_count: int = 1, autoshard: bool = True,
+                        encoding: str = "json"):
         """
         Runs the client asynchronously.
 
         :param shard_count: The number of shards to boot.
         :param autoshard: If the bot should be autosharded.
+        :param encoding: The gateway payload encoding to use, either ``json`` or ``etf``.
         """
+        if encoding not in ("json", "etf"):
+            raise ValueError("Unknown gateway encoding: {}".format(encoding))
+
         if autoshard:
             url, shard_count = await self.get_gateway_url(get_shard_count=True)
         else:
             url, shard_count = await self.get_gateway_url(get_shard_count=False), shard_count
 
         self._gw_url = url
+        self._gw_encoding = encoding
         self.shard_count = shard_count
         return await self.start(shard_count)
 
@@ -684,15 +815,18 @@ class Client(object):
         for gateway in self._gateways.copy().values():
             await gateway.close(code=1006, reason="Bot killed", reconnect=False)
 
-    def run(self, *, shard_count: int = 1, autoshard: bool = True, **kwargs):
+    def run(self, *, shard_count: int = 1, autoshard: bool = True, encoding: str = "json",
+            **kwargs):
         """
         Convenience method to run the bot with multio.
 
         :param shard_count: The number of shards to use. Ignored if autoshard is True.
         :param autoshard: If the bot should be autosharded.
+        :param encoding: The gateway payload encoding to use, either ``json`` or ``etf``.
         """
 
-        p = functools.partial(self.run_async, shard_count=shard_count, autoshard=autoshard)
+        p = functools.partial(self.run_async, shard_count=shard_count, autoshard=autoshard,
+                              encoding=encoding)
         multio.run(p, **kwargs)
 
     @classmethod
@@ -0,0 +1,357 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A pure-Python encoder and decoder for the Erlang External Term Format, as used by the gateway with
+``encoding=etf``.
+
+Only the subset of the format that Discord sends and accepts is supported:
+
+- Binaries and Erlang strings are decoded as :class:`str`.
+- The atoms ``nil``, ``true`` and ``false`` are decoded as None, True and False; other atoms are
+  decoded as :class:`str`.
+- Integers, including the big integers Discord uses for snowflakes, are decoded as :class:`int`.
+- Maps are decoded as :class:`dict`, and lists and tuples as :class:`list`.
+
+.. currentmodule:: curious.core.etf
+"""
+import struct
+import typing
+import zlib
+
+FORMAT_VERSION = 131
+
+NEW_FLOAT_EXT = 70
+COMPRESSED = 80
+SMALL_INTEGER_EXT = 97
+INTEGER_EXT = 98
+FLOAT_EXT = 99
+ATOM_EXT = 100
+SMALL_TUPLE_EXT = 104
+LARGE_TUPLE_EXT = 105
+NIL_EXT = 106
+STRING_EXT = 107
+LIST_EXT = 108
+BINARY_EXT = 109
+SMALL_BIG_EXT = 110
+LARGE_BIG_EXT = 111
+SMALL_ATOM_EXT = 115
+MAP_EXT = 116
+ATOM_UTF8_EXT = 118
+SMALL_ATOM_UTF8_EXT = 119
+
+_int32 = struct.Struct(">i")
+_uint32 = struct.Struct(">I")
+_uint16 = struct.Struct(">H")
+_float64 = struct.Struct(">d")
+
+_ATOMS = {
+    b"nil": None,
+    b"true": True,
+    b"false": False,
+}
+
+
+class ETFDecodeError(ValueError):
+    """
+    Raised when a payload is not a valid term.
+    """
+
+
+class ETFEncodeError(ValueError):
+    """
+    Raised when an object cannot be encoded as a term.
+    """
+
+
+def _decode_term(data: bytes, pos: int, atom_cache: dict, key_cache: dict) \
+        -> typing.Tuple[typing.Any, int]:
+    """
+    Decodes the term starting at ``pos``.
+
+    Maps and lists decode their scalar items inline rather than recursing, as the function calls
+    are most of the cost of decoding a large payload.
+
+    :return: A tuple of (term, position of the next term).
+    """
+    tag = data[pos]
+    pos += 1
+
+    # ordered by how often each tag shows up in gateway payloads
+    if tag == MAP_EXT:
+        arity = _uint32.unpack_from(data, pos)[0]
+        pos += 4
+        result = {}
+        for _ in range(arity):
+            # keys are nearly always short binaries or atoms, and the same few keys repeat
+            # thousands of times in a GUILD_CREATE, so cache the decoded strings
+            key_tag = data[pos]
+            if key_tag == BINARY_EXT:
+                end = pos + 5 + _uint32.unpack_from(data, pos + 1)[0]
+            elif key_tag == SMALL_ATOM_UTF8_EXT or key_tag == SMALL_ATOM_EXT:
+                end = pos + 2 + data[pos + 1]
+            elif key_tag == ATOM_UTF8_EXT or key_tag == ATOM_EXT:
+                end = pos + 3 + _uint16.unpack_from(data, pos + 1)[0]
+            else:
+                end = None
+
+            if end is not None:
+                raw = data[pos:end]
+                try:
+                    key = key_cache[raw]
+                except KeyError:
+                    key = key_cache[raw] = _decode_term(data, pos, atom_cache, key_cache)[0]
+                pos = end
+            else:
+                key, pos = _decode_term(data, pos, atom_cache, key_cache)
+
+            value_tag = data[pos]
+            if value_tag == BINARY_EXT:
+                start = pos + 5
+                pos = start + _uint32.unpack_from(data, pos + 1)[0]
+                result[key] = data[start:pos].decode("utf-8")
+            elif value_tag == SMALL_BIG_EXT:
+                start = pos + 3
+                end = start + data[pos + 1]
+                value = int.from_bytes(data[start:end], "little")
+                result[key] = -value if data[pos + 2] else value
+                pos = end
+            elif value_tag == SMALL_INTEGER_EXT:
+                result[key] = data[pos + 1]
+                pos += 2
+            elif value_tag == SMALL_ATOM_UTF8_EXT:
+                end = pos + 2 + data[pos + 1]
+                raw = data[pos + 2:end]
+                try:
+                    result[key] = atom_cache[raw]
+                except KeyError:
+                    result[key] = atom_cache[raw] = raw.decode("utf-8")
+                pos = end
+            else:
+                result[key], pos = _decode_term(data, pos, atom_cache, key_cache)
+
+        return result, pos
+
+    if tag == BINARY_EXT:
+        length = _uint32.unpack_from(data, pos)[0]
+        pos += 4
+        return data[pos:pos + length].decode("utf-8"), pos + length
+
+    if tag == SMALL_INTEGER_EXT:
+        return data[pos], pos + 1
+
+    if tag == SMALL_ATOM_UTF8_EXT or tag == SMALL_ATOM_EXT:
+        length = data[pos]
+        pos += 1
+        raw = data[pos:pos + length]
+        try:
+            return atom_cache[raw], pos + length
+        except KeyError:
+            atom = atom_cache[raw] = raw.decode("utf-8")
+            return atom, pos + length
+
+    if tag == SMALL_BIG_EXT:
+        # snowflakes
+        length = data[pos]
+        sign = data[pos + 1]
+        pos += 2
+        value = int.from_bytes(data[pos:pos + length], "little")
+        return (-value if sign else value), pos + length
+
+    if tag == LIST_EXT:
+        length = _uint32.unpack_from(data, pos)[0]
+        pos += 4
+        result = []
+        append = result.append
+        for _ in range(length):
+            item_tag = data[pos]
+            if item_tag == SMALL_BIG_EXT:
+                # lists of snowflakes, such as role IDs
+                start = pos + 3
+                end = start + data[pos + 1]
+                value = int.from_bytes(data[start:end], "little")
+                append(-value if data[pos + 2] else value)
+                pos = end
+            elif item_tag == BINARY_EXT:
+                start = pos + 5
+                pos = start + _uint32.unpack_from(data, pos + 1)[0]
+                append(data[start:pos].decode("utf-8"))
+            else:
+                item, pos = _decode_term(data, pos, atom_cache, key_cache)
+                append(item)
+
+        # proper lists end with a NIL_EXT tail
+        if data[pos] != NIL_EXT:
+            raise ETFDecodeError("Improper lists are not supported")
+
+        return result, pos + 1
+
+    if tag == NIL_EXT:
+        return [], pos
+
+    if tag == INTEGER_EXT:
+        return _int32.unpack_from(data, pos)[0], pos + 4
+
+    if tag == NEW_FLOAT_EXT:
+        return _float64.unpack_from(data, pos)[0], pos + 8
+
+    if tag == ATOM_UTF8_EXT or tag == ATOM_EXT:
+        length = _uint16.unpack_from(data, pos)[0]
+        pos += 2
+        raw = data[pos:pos + length]
+        try:
+            return atom_cache[raw], pos + length
+        except KeyError:
+            atom = atom_cache[raw] = raw.decode("utf-8")
+            return atom, pos + length
+
+    if tag == STRING_EXT:
+        length = _uint16.unpack_from(data, pos)[0]
+        pos += 2
+        return data[pos:pos + length].decode("latin-1"), pos + length
+
+    if tag == SMALL_TUPLE_EXT or tag == LARGE_TUPLE_EXT:
+        if tag == SMALL_TUPLE_EXT:
+            arity = data[pos]
+            pos += 1
+        else:
+            arity = _uint32.unpack_from(data, pos)[0]
+            pos += 4
+
+        result = []
+        for _ in range(arity):
+            item, pos = _decode_term(data, pos, atom_cache, key_cache)
+            result.append(item)
+
+        return result, pos
+
+    if tag == LARGE_BIG_EXT:
+        length = _uint32.unpack_from(data, pos)[0]
+        sign = data[pos + 4]
+        pos += 5
+        value = int.from_bytes(data[pos:pos + length], "little")
+        return (-value if sign else value), pos + length
+
+    if tag == FLOAT_EXT:
+        return float(data[pos:pos + 31].split(b"\x00", 1)[0]), pos + 31
+
+    raise ETFDecodeError("Unsupported term tag {}".format(tag))
+
+
+def decode(data: typing.Union[bytes, bytearray, memoryview]) -> typing.Any:
+    """
+    Decodes a term.
+
+    :param data: The encoded term, starting with the format version byte.
+    :return: The decoded object.
+    """
+    data = bytes(data)
+    if not data or data[0] != FORMAT_VERSION:
+        raise ETFDecodeError("Unknown format version")
+
+    try:
+        if data[1] == COMPRESSED:
+            size = _uint32.unpack_from(data, 2)[0]
+            data = bytes([FORMAT_VERSION]) + zlib.decompress(data[6:])
+            if len(data) - 1 != size:
+                raise ETFDecodeError("Compressed term has the wrong size")
+
+        # the atom cache is seeded with the special atoms, so they decode straight away
+        term, pos = _decode_term(data, 1, dict(_ATOMS), {})
+    except (IndexError, struct.error, UnicodeDecodeError, zlib.error) as e:
+        raise ETFDecodeError("Truncated or corrupt term") from e
+
+    if pos != len(data):
+        raise ETFDecodeError("Trailing data after term")
+
+    return term
+
+
+def _encode_term(obj: typing.Any, out: bytearray) -> None:
+    if isinstance(obj, str):
+        encoded = obj.encode("utf-8")
+        out.append(BINARY_EXT)
+        out += _uint32.pack(len(encoded))
+        out += encoded
+
+    elif obj is None:
+        out += b"\x77\x03nil"
+
+    elif obj is True:
+        out += b"\x77\x04true"
+
+    elif obj is False:
+        out += b"\x77\x05false"
+
+    elif isinstance(obj, int):
+        if 0 <= obj <= 255:
+            out.append(SMALL_INTEGER_EXT)
+            out.append(obj)
+        elif -2 ** 31 <= obj < 2 ** 31:
+            out.append(INTEGER_EXT)
+            out += _int32.pack(obj)
+        else:
+            magnitude = abs(obj)
+            encoded = magnitude.to_bytes((magnitude.bit_length() + 7) // 8, "little")
+            if len(encoded) > 255:
+                raise ETFEncodeError("Integer is too large to encode")
+
+            out.append(SMALL_BIG_EXT)
+            out.append(len(encoded))
+            out.append(1 if obj < 0 else 0)
+            out += encoded
+
+    elif isinstance(obj, float):
+        out.append(NEW_FLOAT_EXT)
+        out += _float64.pack(obj)
+
+    elif isinstance(obj, dict):
+        out.append(MAP_EXT)
+        out += _uint32.pack(len(obj))
+        for key, value in obj.items():
+            _encode_term(key, out)
+            _encode_term(value, out)
+
+    elif isinstance(obj, (list, tuple)):
+        if not obj:
+            out.append(NIL_EXT)
+            return
+
+        out.append(LIST_EXT)
+        out += _uint32.pack(len(obj))
+        for item in obj:
+            _encode_term(item, out)
+
+        out.append(NIL_EXT)
+
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        out.append(BINARY_EXT)
+        out += _uint32.pack(len(obj))
+        out += obj
+
+    else:
+        raise ETFEncodeError("Cannot encode object of type {}".format(type(obj).__name__))
+
+
+def encode(obj: typing.Any) -> bytes:
+    """
+    Encodes an object as a term.
+
+    :param obj: The object to encode.
+    :return: The encoded term, starting with the format version byte.
+    """
+    out = bytearray([FORMAT_VERSION])
+    _encode_term(obj, out)
+    return bytes(out)
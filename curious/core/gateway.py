@@ -18,21 +18,25 @@ Websocket gateway code.
 
 .. currentmodule:: curious.core.gateway
 """
+import re
 import sys
 import time
 import zlib
 from collections import Counter
 
 import enum
-import json
 import logging
 import multio
 from async_generator import asynccontextmanager
 from dataclasses import dataclass  # use a 3.6 backport if available
 from lomond.errors import WebSocketClosed, WebSocketClosing, WebSocketUnavailable
 from lomond.events import Binary, Closed, Connected, Connecting, Text
-from typing import Any, AsyncContextManager, AsyncGenerator, List, Union
+from typing import Any, AsyncContextManager, AsyncGenerator, Iterable, List, Optional, Tuple, \
+    Union
 
+from curious.core import etf
+from curious.core.jsoncodec import JSONCodec, get_codec
+from curious.core.ratelimit import Priority, TokenBucket
 from curious.core._ws_wrapper import BasicWebsocketWrapper
 from curious.util import safe_generator
 
@@ -56,6 +60,73 @@ class GatewayOp(enum.IntEnum):
     GUILD_SYNC = 12
 
 
+#: The dispatches that can never be ignored, as the gateway needs them to track its session.
+REQUIRED_DISPATCHES = frozenset({"READY", "RESUMED"})
+
+#: Matches the header of a dispatch in the order and compact form that Discord sends it.
+_DISPATCH_HEADER = re.compile(r'\{"t":"(\w+)","s":(\d+|null),"op":0,')
+_DISPATCH_HEADER_BYTES = re.compile(_DISPATCH_HEADER.pattern.encode("ascii"))
+
+#: Matches one leading top-level field with a scalar value, such as ``"t":"TYPING_START",``.
+_HEADER_FIELD = re.compile(r'\s*"(\w+)"\s*:\s*(null|-?\d+|"[^"\\]*")\s*,')
+
+#: The number of characters at the start of a frame that the header is looked for in.
+_HEADER_SIZE = 128
+
+
+def peek_dispatch(data: Union[str, bytes]) -> Optional[Tuple[str, Optional[int]]]:
+    """
+    Reads the event name and sequence of a JSON dispatch without decoding the rest of it.
+
+    This only looks at the scalar fields before the first non-scalar field, so it can never
+    mistake a field of the event data for one of the frame. Discord sends ``t``, ``s`` and ``op``
+    before ``d``; if a frame doesn't, it can't be peeked.
+
+    :param data: The decompressed JSON frame.
+    :return: A tuple of (event name, sequence), or None if the frame isn't a dispatch or couldn't
+        be peeked.
+    """
+    # fast path for the usual layout
+    if isinstance(data, str):
+        match = _DISPATCH_HEADER.match(data)
+    else:
+        match = _DISPATCH_HEADER_BYTES.match(data)
+
+    if match is not None:
+        event, sequence = match.group(1, 2)
+        if not isinstance(event, str):
+            event, sequence = event.decode("ascii"), sequence.decode("ascii")
+
+        return event, (None if sequence == "null" else int(sequence))
+
+    header = data[:_HEADER_SIZE]
+    if not isinstance(header, str):
+        # the header fields are all ASCII, and latin-1 can't fail on a split character
+        header = header.decode("latin-1")
+
+    if not header.startswith("{"):
+        return None
+
+    pos = 1
+    fields = {}
+    while len(fields) < 3:
+        match = _HEADER_FIELD.match(header, pos)
+        if match is None:
+            return None
+
+        key, value = match.group(1, 2)
+        if key in ("t", "s", "op"):
+            fields[key] = value
+
+        pos = match.end()
+
+    if fields["op"] != "0" or fields["t"] == "null":
+        return None
+
+    sequence = None if fields["s"] == "null" else int(fields["s"])
+    return fields["t"][1:-1], sequence
+
+
 @dataclass
 class _GatewayState:
     """
@@ -79,6 +150,9 @@ class _GatewayState:
     #: The current sequence.
     sequence: int = 0
 
+    #: The payload encoding for this gateway, either ``json`` or ``etf``.
+    encoding: str = "json"
+
 
 @dataclass
 class HeartbeatStats:
@@ -105,6 +179,143 @@ class HeartbeatStats:
         return self.last_ack_time - self.last_heartbeat_time
 
 
+@dataclass
+class TransferStats:
+    """
+    Represents the statistics for the data received by a gateway, for sizing buffers.
+    """
+    #: The number of payloads received.
+    payloads: int = 0
+
+    #: The number of bytes received, before decompression.
+    compressed_bytes: int = 0
+
+    #: The number of bytes received, after decompression.
+    decompressed_bytes: int = 0
+
+    #: The size of the largest payload received, before decompression.
+    largest_compressed: int = 0
+
+    #: The size of the largest payload received, after decompression.
+    largest_decompressed: int = 0
+
+    @property
+    def compression_ratio(self) -> float:
+        """
+        :return: The ratio of decompressed bytes to compressed bytes.
+        """
+        if not self.compressed_bytes:
+            return 1.0
+
+        return self.decompressed_bytes / self.compressed_bytes
+
+    def record(self, compressed: int, decompressed: int) -> None:
+        """
+        Records a received payload.
+
+        :param compressed: The size of the payload before decompression.
+        :param decompressed: The size of the payload after decompression.
+        """
+        self.payloads += 1
+        self.compressed_bytes += compressed
+        self.decompressed_bytes += decompressed
+        if compressed > self.largest_compressed:
+            self.largest_compressed = compressed
+
+        if decompressed > self.largest_decompressed:
+            self.largest_decompressed = decompressed
+
+
+@dataclass
+class SendStats:
+    """
+    Represents the statistics for the payloads sent by a gateway.
+    """
+    #: The number of payloads sent.
+    sends: int = 0
+
+    #: The number of payloads sent in the priority lane.
+    priority_sends: int = 0
+
+    #: The number of payloads that had to wait for the send limit.
+    delayed_sends: int = 0
+
+    #: The total time spent waiting for the send limit, in seconds.
+    total_wait: float = 0.0
+
+    #: The number of payloads currently waiting for the send limit.
+    queue_depth: int = 0
+
+    #: The highest number of payloads that have waited for the send limit at once.
+    max_queue_depth: int = 0
+
+
+class SendLimiter(object):
+    """
+    Smooths out the payloads sent on a gateway connection, so that bursts wait locally rather than
+    getting the connection closed.
+
+    Discord closes connections that send more than ``limit`` payloads in ``window`` seconds. Of
+    those, ``reserved`` are kept for the priority lane (heartbeats, IDENTIFY and RESUME), which
+    never waits. Everything else goes through a token bucket holding ``burst`` tokens, refilled so
+    that no ``window`` seconds can ever contain more than ``limit - reserved`` of them.
+    """
+    #: The opcodes sent in the priority lane.
+    PRIORITY_OPCODES = frozenset({GatewayOp.HEARTBEAT, GatewayOp.IDENTIFY, GatewayOp.RESUME})
+
+    def __init__(self, limit: int = 120, window: float = 60.0, *,
+                 reserved: int = 5, burst: int = 10):
+        """
+        :param limit: The number of payloads allowed per window.
+        :param window: The length of the window, in seconds.
+        :param reserved: The number of payloads per window kept for the priority lane.
+        :param burst: The number of payloads that can be sent at once, without waiting.
+        """
+        if reserved + burst >= limit:
+            raise ValueError("The reserved and burst sends must leave room in the limit")
+
+        #: The :class:`.TokenBucket` that the payloads outside the priority lane wait on.
+        self.bucket = TokenBucket((limit - reserved - burst) / window, capacity=burst)
+
+        #: The :class:`.SendStats` for this limiter.
+        self.stats = SendStats()
+
+    def __repr__(self) -> str:
+        return "<SendLimiter queue_depth={} bucket={!r}>".format(self.stats.queue_depth,
+                                                                 self.bucket)
+
+    async def acquire(self, opcode: int, priority: int = Priority.NORMAL) -> float:
+        """
+        Waits until a payload can be sent.
+
+        :param opcode: The :class:`.GatewayOp` of the payload.
+        :param priority: The :class:`.Priority` of the payload, relative to the other payloads
+            waiting.
+        :return: The number of seconds spent waiting.
+        """
+        stats = self.stats
+        if opcode in self.PRIORITY_OPCODES:
+            stats.sends += 1
+            stats.priority_sends += 1
+            return 0.0
+
+        stats.queue_depth += 1
+        if stats.queue_depth > stats.max_queue_depth:
+            stats.max_queue_depth = stats.queue_depth
+
+        try:
+            waited = await self.bucket.acquire(priority)
+        finally:
+            stats.queue_depth -= 1
+
+        stats.sends += 1
+        if waited:
+            stats.delayed_sends += 1
+            stats.total_wait += waited
+
+        return waited
+
+
 class GatewayHandler(object):
     """
     Represents a gateway handler - something that is connected to Discord's websocket and handles
@@ -122,10 +333,22 @@ class GatewayHandler(object):
     GATEWAY_VERSION = 6
     ZLIB_FLUSH_SUFFIX = b'\x00\x00\xff\xff'
 
-    def __init__(self, gw_state: _GatewayState):
+    def __init__(self, gw_state: _GatewayState, json_codec: Union[str, JSONCodec] = None,
+                 ignored_dispatches: Iterable[str] = (), send_limiter: SendLimiter = None):
         #: The current state being used for this gateway.
         self.gw_state = gw_state
 
+        #: The set of dispatch names (such as ``PRESENCE_UPDATE``) to drop without handling.
+        #: With the ``json`` encoding, these are dropped before the frame is decoded. The
+        #: dispatches in :data:`.REQUIRED_DISPATCHES` are never dropped.
+        self.ignored_dispatches = set(ignored_dispatches) - REQUIRED_DISPATCHES
+
+        #: The :class:`.JSONCodec` used for payloads with the ``json`` encoding.
+        self.json_codec = get_codec(json_codec)
+
+        #: The :class:`.SendLimiter` that outgoing payloads wait on.
+        self.send_limiter = send_limiter if send_limiter is not None else SendLimiter()
+
         #: The current heartbeat stats being used for this gateway.
         self.heartbeat_stats = HeartbeatStats()
 
@@ -139,8 +362,14 @@ class GatewayHandler(object):
         self._stop_heartbeating = multio.Event()
         self._dispatches_handled = Counter()
 
+        #: The statistics for the data received by this gateway.
+        self.transfer_stats = TransferStats()
+
         # used for zlib-streaming
+        # payloads split over several binary frames are collected in _databuffer, which is
+        # overwritten in place and only ever grows, and _buffered is how much of it is in use
         self._databuffer = bytearray()
+        self._buffered = 0
         self._decompressor = zlib.decompressobj()
 
     @property
@@ -177,14 +406,43 @@ class GatewayHandler(object):
             self.heartbeat_stats.heartbeats = 0
             self.heartbeat_stats.heartbeat_acks = 0
 
+    def _is_ignored(self, event: str) -> bool:
+        """
+        :return: If the dispatch with this name should be dropped.
+        """
+        return event in self.ignored_dispatches and event not in REQUIRED_DISPATCHES
+
     # send commands
-    async def send(self, data: dict) -> None:
+    async def send(self, data: dict, *, priority: int = Priority.NORMAL) -> None:
         """
-        Sends data down the websocket.
+        Sends data down the websocket, waiting for the :attr:`.send_limiter` first.
+
+        :param data: The payload to send.
+        :param priority: The :class:`.Priority` of the payload, relative to the other payloads
+            waiting to be sent. Heartbeats, IDENTIFY and RESUME never wait.
         """
-        dumped = json.dumps(data)
+        waited = await self.send_limiter.acquire(data.get("op"), priority)
+        if waited:
+            self.logger.debug("Waited %.2f seconds to send opcode %s", waited, data.get("op"))
+
+        if self.gw_state.encoding == "etf":
+            return await self.websocket.send_binary(etf.encode(data))
+
+        dumped = self.json_codec.dumps(data)
         return await self.websocket.send_text(dumped)
 
+    def decode(self, data: Union[str, bytes]) -> dict:
+        """
+        Decodes a payload received from the websocket.
+
+        :param data: The decompressed payload.
+        :return: The decoded payload.
+        """
+        if self.gw_state.encoding == "etf" and not isinstance(data, str):
+            return etf.decode(data)
+
+        return self.json_codec.loads(data)
+
     async def send_identify(self) -> None:
         """
         Sends an IDENTIFY to Discord.
@@ -259,7 +517,7 @@ class GatewayHandler(object):
             }
         }
 
-        return await self.send(payload)
+        return await self.send(payload, priority=Priority.BULK)
 
     async def send_status(self, *, status: int = None, name: str = None, url: str = None,
                           type_: int = None,
@@ -315,8 +573,7 @@ class GatewayHandler(object):
         self.logger.info("Using %s for the gateway", Wrapper.__name__)
 
         # new websocket means zlib starts from scratch
-        self._databuffer.clear()
-        self._decompressor = zlib.decompressobj()
+        self._reset_decompressor()
 
         self.websocket = await ws_open(self.gw_state.gateway_url)
 
@@ -333,8 +590,7 @@ class GatewayHandler(object):
             elif isinstance(event, Connecting):
                 self.logger.info("The websocket is opening...")
                 # we need to reset the data buffer and zlib inflater
-                self._databuffer.clear()
-                self._decompressor = zlib.decompressobj()
+                self._reset_decompressor()
                 yield "websocket_opened",
 
             elif isinstance(event, Connected):
@@ -381,25 +637,70 @@ class GatewayHandler(object):
         self.heartbeat_stats.heartbeats = 0
         self.heartbeat_stats.heartbeat_acks = 0
 
+    def _reset_decompressor(self) -> None:
+        """
+        Resets the zlib-stream state, for a new connection.
+        """
+        self._buffered = 0
+        self._decompressor = zlib.decompressobj()
+
+    def _inflate(self, frame: bytes) -> Optional[bytes]:
+        """
+        Feeds a binary frame to the zlib-stream decompressor.
+
+        :param frame: The data of the frame.
+        :return: The decompressed payload, or None if the payload continues in the next frame.
+        """
+        complete = frame.endswith(self.ZLIB_FLUSH_SUFFIX)
+
+        if complete and not self._buffered:
+            # the usual case: the whole payload is in this frame, so skip the buffer entirely
+            compressed = len(frame)
+            data = self._decompressor.decompress(frame)
+        else:
+            end = self._buffered + len(frame)
+            # overwrites in place if the buffer is big enough, and grows it if it isn't
+            self._databuffer[self._buffered:end] = frame
+            self._buffered = end
+            if not complete:
+                return None
+
+            compressed = self._buffered
+            self._buffered = 0
+            with memoryview(self._databuffer) as view, view[:compressed] as payload:
+                data = self._decompressor.decompress(payload)
+
+        self.transfer_stats.record(compressed, len(data))
+        return data
+
     async def handle_data_event(self, evt: Union[Text, Binary]):
         """
         Handles a data event.
         """
         if evt.name == "binary":
-            self._databuffer.extend(evt.data)
-            if not evt.data.endswith(self.ZLIB_FLUSH_SUFFIX):
+            data = self._inflate(evt.data)
+            if data is None:
                 return
-            else:
-                data = self._decompressor.decompress(self._databuffer).decode('utf-8')
-                self._databuffer.clear()
         else:
             data = evt.text
+            self.transfer_stats.record(len(data), len(data))
 
         # empty payloads
         if not data:
             return
 
-        decoded = json.loads(data)
+        # drop ignored dispatches before paying for a full decode
+        if self.ignored_dispatches and self.gw_state.encoding == "json":
+            peeked = peek_dispatch(data)
+            if peeked is not None and self._is_ignored(peeked[0]):
+                event, sequence = peeked
+                if sequence is not None:
+                    self.gw_state.sequence = sequence
+
+                self._dispatches_handled[event] += 1
+                return
+
+        decoded = self.decode(data)
         opcode = decoded.get('op')
         sequence = decoded.get('s')
         event_data = decoded.get('d', {})
@@ -445,7 +746,7 @@ class GatewayHandler(object):
         elif opcode == GatewayOp.INVALIDATE_SESSION:
             # the data sent is if we should resume
             # if it's non-existent, we assume it's False.
-            should_resume = data or False
+            should_resume = event_data or False
 
             if should_resume is True:
                 self.logger.debug("Sending RESUME again")
@@ -468,6 +769,9 @@ class GatewayHandler(object):
                 self.gw_state.session_id = event_data["session_id"]
 
             self._dispatches_handled[event] += 1
+            if self.ignored_dispatches and self._is_ignored(event):
+                return
+
             yield ("gateway_dispatch_received", event, event_data,)
 
         elif opcode == GatewayOp.RECONNECT:
@@ -485,7 +789,10 @@ class GatewayHandler(object):
 @asynccontextmanager
 @safe_generator
 async def open_websocket(token: str, url: str, *,
-                         shard_id: int = 0, shard_count: int = 1) \
+                         shard_id: int = 0, shard_count: int = 1,
+                         encoding: str = "json", json_codec: Union[str, JSONCodec] = None,
+                         ignored_dispatches: Iterable[str] = (),
+                         send_limiter: SendLimiter = None) \
         -> AsyncContextManager[GatewayHandler]:
     """
     Opens a new connection to Discord.
@@ -508,12 +815,25 @@ async def open_websocket(token: str, url: str, *,
     :param url: The gateway URL to connect with.
     :param shard_id: The shard ID to connect with. Defaults to 0.
     :param shard_count: The number of shards to boot with.
+    :param encoding: The payload encoding to use, either ``json`` or ``etf``. With ``etf``, \
+        snowflakes are received as ints rather than strings.
+    :param json_codec: The :class:`.JSONCodec` (or the name of one) to use with the ``json`` \
+        encoding. Defaults to the fastest installed codec.
+    :param ignored_dispatches: The names of dispatches to drop without handling. See \
+        :attr:`.GatewayHandler.ignored_dispatches`.
+    :param send_limiter: The :class:`.SendLimiter` for outgoing payloads. Defaults to one using \
+        Discord's limit of 120 payloads a minute.
     :return: An async context manager that yields a :class:`.GatewayHandler`.
     """
-    params = f"/?v={GatewayHandler.GATEWAY_VERSION}&encoding=json&compress=zlib-stream"
+    if encoding not in ("json", "etf"):
+        raise ValueError("Unknown gateway encoding: {}".format(encoding))
+
+    params = f"/?v={GatewayHandler.GATEWAY_VERSION}&encoding={encoding}&compress=zlib-stream"
     url = url + params
-    state = _GatewayState(token=token, gateway_url=url, shard_id=shard_id, shard_count=shard_count)
-    gw = GatewayHandler(gw_state=state)
+    state = _GatewayState(token=token, gateway_url=url, shard_id=shard_id, shard_count=shard_count,
+                          encoding=encoding)
+    gw = GatewayHandler(gw_state=state, json_codec=json_codec,
+                        ignored_dispatches=ignored_dispatches, send_limiter=send_limiter)
 
     logger = logging.getLogger(f"curious.gateway:shard-{shard_id}")
 
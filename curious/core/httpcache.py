@@ -0,0 +1,254 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An opt-in response cache for read-mostly REST endpoints.
+
+.. currentmodule:: curious.core.httpcache
+"""
+import collections
+import copy
+import logging
+import time
+import typing
+
+logger = logging.getLogger("curious.http.cache")
+
+
+class CacheEntry(object):
+    """
+    A single cached response.
+    """
+
+    __slots__ = "route", "data", "size", "expires_at", "etag", "last_modified"
+
+    def __init__(self, route: str, data: typing.Any, size: int, expires_at: float,
+                 etag: str = None, last_modified: str = None):
+        #: The route template this response was for.
+        self.route = route
+
+        #: The decoded response data.
+        self.data = data
+
+        #: The approximate size of this entry, in bytes.
+        self.size = size
+
+        #: The monotonic time this entry expires at.
+        self.expires_at = expires_at
+
+        #: The ETag of the response, if any.
+        self.etag = etag
+
+        #: The Last-Modified date of the response, if any.
+        self.last_modified = last_modified
+
+    @property
+    def fresh(self) -> bool:
+        """
+        :return: If this entry can be used without asking Discord again.
+        """
+        return time.monotonic() < self.expires_at
+
+    def validators(self) -> typing.Dict[str, str]:
+        """
+        :return: The headers to send to make a conditional request for this entry.
+        """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+
+        return headers
+
+
+class ResponseCache(object):
+    """
+    A TTL and ETag-aware response cache, evicting least recently used entries once it grows past
+    its memory budget.
+
+    Only routes with a TTL are cached. Once an entry expires, it is kept around so that the next
+    request can be made conditionally, if the original response had an ``ETag`` or
+    ``Last-Modified`` header.
+
+    .. code-block:: python3
+
+        cache = ResponseCache({Endpoints.INVITE_GET: 60}, max_bytes=4 * 1024 * 1024)
+        client = Client(token)
+        client.http.response_cache = cache
+    """
+
+    def __init__(self, ttls: typing.Mapping[str, float], *,
+                 max_bytes: int = 8 * 1024 * 1024):
+        """
+        :param ttls: A mapping of route template -> TTL in seconds.
+        :param max_bytes: The approximate memory budget of this cache, in bytes.
+        """
+        #: The mapping of route template -> TTL in seconds.
+        self.ttls = dict(ttls)
+
+        #: The approximate memory budget of this cache, in bytes.
+        self.max_bytes = max_bytes
+
+        #: The approximate number of bytes currently cached.
+        self.current_bytes = 0
+
+        #: The number of requests served from the cache.
+        self.hits = 0
+
+        #: The number of requests that could not be served from the cache.
+        self.misses = 0
+
+        #: The number of stale entries that were confirmed unchanged by a conditional request.
+        self.revalidations = 0
+
+        #: The number of entries evicted to stay under the memory budget.
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()  # type: typing.Dict[tuple, CacheEntry]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return "<ResponseCache entries={} bytes={}/{}>".format(len(self._entries),
+                                                               self.current_bytes, self.max_bytes)
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        """
+        :return: A dict of statistics about this cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+        }
+
+    def ttl_for(self, route: str) -> typing.Union[float, None]:
+        """
+        :param route: The route template.
+        :return: The TTL for the route, or None if it is not cached.
+        """
+        return self.ttls.get(route)
+
+    def lookup(self, key: tuple) -> typing.Union[CacheEntry, None]:
+        """
+        Looks up an entry, fresh or stale.
+
+        :param key: The cache key.
+        :return: The :class:`.CacheEntry`, or None if nothing is cached.
+        """
+        entry = self._entries.get(key)
+        if entry is None or not entry.fresh:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        if entry is not None:
+            self._entries.move_to_end(key)
+
+        return entry
+
+    def peek(self, key: tuple) -> typing.Union[CacheEntry, None]:
+        """
+        Looks up an entry without counting it towards the statistics.
+
+        :param key: The cache key.
+        :return: The :class:`.CacheEntry`, or None if nothing is cached.
+        """
+        return self._entries.get(key)
+
+    def store(self, key: tuple, route: str, data: typing.Any, size: int,
+              headers: typing.Mapping[str, str]) -> None:
+        """
+        Stores a response.
+
+        :param key: The cache key.
+        :param route: The route template of the request.
+        :param data: The decoded response data.
+        :param size: The size of the response body, in bytes.
+        :param headers: The response headers.
+        """
+        ttl = self.ttl_for(route)
+        if ttl is None:
+            return
+
+        cache_control = headers.get("Cache-Control", "")
+        if "no-store" in cache_control:
+            return
+
+        self._remove(key)
+        if size > self.max_bytes:
+            return
+
+        entry = CacheEntry(route, copy.deepcopy(data), size, time.monotonic() + ttl,
+                           etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"))
+        self._entries[key] = entry
+        self.current_bytes += size
+
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.size
+            self.evictions += 1
+
+    def revalidated(self, key: tuple) -> typing.Union[CacheEntry, None]:
+        """
+        Marks an entry as confirmed unchanged by a ``304 Not Modified``, renewing its TTL.
+
+        :param key: The cache key.
+        :return: The renewed :class:`.CacheEntry`, if it still exists.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        entry.expires_at = time.monotonic() + self.ttls.get(entry.route, 0)
+        self.revalidations += 1
+        return entry
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+
+    def invalidate(self, path: str) -> None:
+        """
+        Drops every entry for a path, regardless of its query parameters.
+
+        :param path: The formatted request path.
+        """
+        for key in [key for key in self._entries if key[0] == path]:
+            self._remove(key)
+
+    def invalidate_route(self, route: str) -> None:
+        """
+        Drops every entry for a route template.
+
+        :param route: The route template.
+        """
+        for key in [key for key, entry in self._entries.items() if entry.route == route]:
+            self._remove(key)
+
+    def clear(self) -> None:
+        """
+        Drops every entry in this cache.
+        """
+        self._entries.clear()
+        self.current_bytes = 0
@@ -18,6 +18,7 @@ The main Discord HTTP interface.
 
 .. currentmodule:: curious.core.httpclient
 """
+import copy
 import datetime
 import json
 import logging
@@ -26,9 +27,7 @@ import random
 import string
 import time
 import typing
-import weakref
 from email.utils import parsedate
-from math import ceil, floor
 from urllib.parse import quote
 
 import asks
@@ -38,18 +37,13 @@ from asks.errors import ConnectivityError
 from asks.response_objects import Response
 from h11 import RemoteProtocolError
 
-try:
-    # try and load a C impl of LRU first
-    from lru import LRU as c_lru
-
-    lru = c_lru
-except ImportError:
-    # fall back to a pure-python (the default) version
-    from pylru import lrucache as py_lru
-
-    lru = py_lru
-
 import curious
+from curious.core.httpcache import ResponseCache
+from curious.core.httpstats import HTTPInstrumentation, RequestRecord, route_template
+from curious.core.jsoncodec import JSONCodec, get_codec
+from curious.core.multipart import FileContent, MultipartEncoder, StreamingRequest
+from curious.core.ratelimit import BucketLimiter, LocalRatelimitBackend, Priority, \
+    RatelimitBackend, RatelimitClock
 from curious.exc import Forbidden, HTTPException, NotFound, Unauthorized
 
 logger = logging.getLogger("curious.http")
@@ -148,6 +142,120 @@ def encode_multipart(fields, files, boundary=None):
     return body, headers
 
 
+class PooledSession(asks.Session):
+    """
+    An :class:`asks.Session` that keeps track of its keep-alive connection pool.
+
+    Connections are re-used between requests, with at most ``connections`` open at once.
+    Connections that have sat idle in the pool for longer than ``idle_timeout`` seconds are closed
+    rather than re-used, as the remote end has likely dropped them already.
+
+    :param idle_timeout: The number of seconds a connection may sit idle before being evicted.
+    """
+
+    def __init__(self, *args, idle_timeout: float = 60.0, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        #: The number of seconds a pooled connection may sit idle before being evicted.
+        self.idle_timeout = idle_timeout
+
+        #: The number of requests that re-used a pooled connection.
+        self.pool_hits = 0
+
+        #: The number of requests that had to open a new connection.
+        self.pool_misses = 0
+
+        #: The number of idle connections that have been evicted from the pool.
+        self.pool_evictions = 0
+
+    async def _evict_idle_connections(self) -> None:
+        """
+        Closes and removes any pooled connections that have been idle for too long.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        for sock in list(self._conn_pool):
+            if getattr(sock, "_curious_last_used", 0) >= cutoff:
+                continue
+
+            self._conn_pool.remove(sock)
+            self.pool_evictions += 1
+            try:
+                await sock.close()
+            except OSError:
+                pass
+
+    async def _grab_connection(self, url):
+        await self._evict_idle_connections()
+        return await super()._grab_connection(url)
+
+    def _checkout_connection(self, host_loc):
+        sock = super()._checkout_connection(host_loc)
+        if sock is None:
+            self.pool_misses += 1
+        else:
+            self.pool_hits += 1
+
+        return sock
+
+    async def _replace_connection(self, sock):
+        sock._curious_last_used = time.monotonic()
+        await super()._replace_connection(sock)
+
+    async def request(self, method, url=None, *, path='', **kwargs):
+        # this mirrors asks.Session.request, but builds a StreamingRequest so that
+        # MultipartEncoder bodies are streamed from their sources rather than joined in memory
+        async with self.sema:
+            timeout = kwargs.pop('timeout', None)
+            req_headers = kwargs.pop('headers', None)
+
+            if url is None:
+                url = self._make_url() + path
+
+            sock = await self._grab_connection(url)
+            port = sock.port
+
+            if self.headers is not None:
+                headers = copy.copy(self.headers)
+                if req_headers is not None:
+                    headers.update(req_headers)
+                req_headers = headers
+
+            req_obj = StreamingRequest(self, method, url, port,
+                                       headers=req_headers,
+                                       encoding=self.encoding,
+                                       sock=sock,
+                                       persist_cookies=self._cookie_tracker_obj,
+                                       **kwargs)
+
+            if timeout is None:
+                sock, r = await req_obj.make_request()
+            else:
+                sock, r = await self.timeout_manager(timeout, req_obj)
+
+            if sock is not None:
+                try:
+                    if r.headers['connection'].lower() == 'close':
+                        sock._active = False
+                except KeyError:
+                    pass
+                await self._replace_connection(sock)
+
+        return r
+
+    @property
+    def pool_stats(self) -> typing.Dict[str, int]:
+        """
+        :return: A dict of statistics about this session's connection pool.
+        """
+        return {
+            "hits": self.pool_hits,
+            "misses": self.pool_misses,
+            "evictions": self.pool_evictions,
+            "idle": len(self._conn_pool),
+            "checked_out": len(self._checked_out_sockets),
+        }
+
+
 # more of a namespace
 class Endpoints:
     API_BASE = "/api/v7"
@@ -237,53 +345,117 @@ class HTTPClient(object):
     :param token: The token to use for all HTTP requests.
     :param bot: Is this client a bot?
     :param max_connections: The max connections for this HTTP client.
+    :param idle_timeout: The number of seconds a keep-alive connection can sit idle before it is
+        closed.
+    :param global_rate: The maximum number of requests per second to send, across all buckets.
+        Requests over this rate are delayed locally rather than being sent and hitting the global
+        ratelimit. If None, requests are only limited once Discord reports a global ratelimit.
+        Ignored if a ``ratelimit_backend`` is passed, as the backend applies its own global limit;
+        pass the rate to the :class:`.LocalRatelimitBackend` or :class:`.RatelimitCoordinator`
+        instead.
+    :param coalesce_gets: If identical concurrent GET requests should share a single request.
+    :param response_cache: The :class:`.ResponseCache` to cache read-mostly GET responses in.
+        :attr:`.HTTPClient.DEFAULT_CACHE_TTLS` is a reasonable set of TTLs to build one with.
+        If None, no responses are cached.
+    :param ratelimit_backend: The :class:`.RatelimitBackend` that stores ratelimit state. Pass a
+        :class:`.SharedRatelimitBackend` to share ratelimits between processes.
+        If None, a :class:`.LocalRatelimitBackend` limited to ``global_rate`` is used.
+    :param json_codec: The :class:`.JSONCodec` (or the name of one) used for request and response
+        bodies. Defaults to the fastest installed codec.
     """
 
+    #: The default TTLs (in seconds) for routes that are safe to cache.
+    DEFAULT_CACHE_TTLS = {
+        Endpoints.INVITE_GET: 60,
+        Endpoints.GUILD_WIDGET: 60,
+        Endpoints.GUILD_EMBED: 300,
+        Endpoints.GUILD_EMOJIS: 300,
+        Endpoints.GUILD_WEBHOOKS: 60,
+        Endpoints.GUILD_VANITY_URL: 300,
+        Endpoints.OAUTH2_AUTHORIZE: 3600,
+        Endpoints.OAUTH2_APPLICATION_ME: 3600,
+    }
+
     def __init__(self, token: str, *,
                  bot: bool = True,
-                 max_connections: int = 10):
+                 max_connections: int = 10,
+                 idle_timeout: float = 60.0,
+                 global_rate: float = 50.0,
+                 coalesce_gets: bool = True,
+                 response_cache: ResponseCache = None,
+                 ratelimit_backend: RatelimitBackend = None,
+                 json_codec: typing.Union[str, JSONCodec] = None):
         #: The token used for all requests.
         self.token = token
 
         # Calculated headers
         headers = {
             "User-Agent": curious.USER_AGENT,
-            "Authorization": "{}{}".format("Bot " if bot else "", self.token)
+            "Authorization": "{}{}".format("Bot " if bot else "", self.token),
+            # ask for fractional ratelimit resets
+            "X-RateLimit-Precision": "millisecond",
         }
 
         self.endpoints = Endpoints()
-        self.session = asks.Session(base_location=self.endpoints.BASE, endpoint=Endpoints.API_BASE,
-                                    connections=max_connections)
+        self.session = PooledSession(base_location=self.endpoints.BASE,
+                                     endpoint=Endpoints.API_BASE,
+                                     connections=max_connections,
+                                     idle_timeout=idle_timeout)
         self.headers = headers
 
-        #: The global ratelimit lock.
-        self.global_lock = multio.Lock()
+        #: The clock used to turn ratelimit headers into deadlines.
+        self.clock = RatelimitClock()
+
+        # global_rate only configures the default backend; a passed backend has its own limit
+        if ratelimit_backend is None:
+            ratelimit_backend = LocalRatelimitBackend(global_rate=global_rate)
+
+        #: The :class:`.RatelimitBackend` that stores ratelimit state.
+        self.ratelimit_backend = ratelimit_backend
+
+        #: If identical concurrent GET requests should share a single request.
+        self.coalesce_gets = coalesce_gets
+
+        #: The number of GET requests that were served by joining an identical in-flight request.
+        self.coalesced_requests = 0
+
+        #: The mapping of (path, bucket, params, priority) -> promise for GET requests in flight.
+        self._inflight_gets = {}  # type: typing.Dict[tuple, multio.Promise]
 
-        self._rate_limits = weakref.WeakValueDictionary()
-        self._ratelimit_remaining = lru(1024)
+        #: The :class:`.ResponseCache` used for read-mostly GET requests, if any.
+        self.response_cache = response_cache
+
+        #: The :class:`.HTTPInstrumentation` that collects per-bucket and per-route statistics.
+        self.instrumentation = HTTPInstrumentation()
         self._is_bot = bot
 
-    def get_ratelimit_lock(self, bucket: object) -> 'multio.Lock':
+        #: The :class:`.JSONCodec` used to encode request bodies and decode responses.
+        self.json_codec = get_codec(json_codec)
+
+    def get_ratelimit_limiter(self, bucket: object) -> BucketLimiter:
         """
-        Gets a ratelimit lock from the dict if it exists, otherwise creates a new one.
+        Gets the ratelimit limiter for a bucket, creating one if it doesn't exist.
+
+        This only works with a :class:`.LocalRatelimitBackend`.
         """
-        try:
-            return self._rate_limits[bucket]
-        except KeyError:
-            lock = multio.Lock()
-            self._rate_limits[bucket] = lock
-            return lock
+        return self.ratelimit_backend.ratelimits.get(bucket)
+
+    @property
+    def pool_stats(self) -> typing.Dict[str, int]:
+        """
+        :return: A dict of statistics about the connection pool used by this client.
+        """
+        return self.session.pool_stats
 
     # Special wrapper functions
-    @staticmethod
-    def get_response_data(response: Response) -> typing.Union[str, dict]:
+    def get_response_data(self, response: Response) -> typing.Union[str, dict]:
         """
         Return either the text of a request or the JSON.
 
         :param response: The response to use.
         """
         if response.headers.get("Content-Type", None) == "application/json":
-            return response.json()
+            return self.json_codec.loads(response.content)
 
         return response.content
 
@@ -301,22 +473,45 @@ class HTTPClient(object):
             headers = self.headers.copy()
 
         # update reason header
-        if "reason" in kwargs:
-            headers["X-Audit-Log-Reason"] = quote(kwargs["reason"])
+        reason = kwargs.pop("reason", None)
+        if reason is not None:
+            headers["X-Audit-Log-Reason"] = quote(reason)
 
         # ensure path is escaped
-        path = kwargs["path"]
-        path = quote(path)
-        kwargs["path"] = path
+        path = quote(kwargs.pop("path"))
 
-        # temporary
-        # return await self.session.request(*args, headers=headers, timeout=5, **kwargs)
         if 'uri' not in kwargs:
-            kwargs["uri"] = self.endpoints.BASE + Endpoints.API_BASE + kwargs["path"]
+            url = self.endpoints.BASE + Endpoints.API_BASE + path
         else:
-            kwargs.pop("path", None)
+            url = kwargs.pop("uri")
+
+        method = kwargs.pop("method")
+        # go through the session so that keep-alive connections are pooled
+        return await self.session.request(method, *args, url=url, headers=headers, timeout=5,
+                                          **kwargs)
+
+    @staticmethod
+    def _bucket_name(bucket: object) -> str:
+        """
+        :return: The human-readable name of a bucket, for instrumentation.
+        """
+        if isinstance(bucket, tuple):
+            return " ".join(str(part) for part in bucket)
+
+        return str(bucket)
 
-        return await asks.request(*args, headers=headers, timeout=5, **kwargs)
+    @staticmethod
+    def _body_size(body: typing.Any) -> int:
+        """
+        :return: The size of a request or response body, in bytes.
+        """
+        if body is None or isinstance(body, dict):
+            return 0
+
+        try:
+            return len(body)
+        except TypeError:
+            return 0
 
     async def request(self, bucket: object, *args, **kwargs):
         """
@@ -325,56 +520,66 @@ class HTTPClient(object):
         This will respect Discord's X-Ratelimit-Limit headers to make requests.
 
         :param bucket: The bucket this request falls under.
+        :param raw_response: If True, a tuple of (response, data) is returned, and a
+            ``304 Not Modified`` counts as a success.
+        :param priority: The :class:`.Priority` of this request. Requests waiting on the same
+            bucket, or on the global limiter, are let through in priority order.
         """
-        # Okay, an English explaination of how this works.
-        # First, it loads the curio-based lock from the defaultdict of lock, keyed by bucket.
-        # Then, it tries to acquire the lock. This is held by one request at a time, naturally.
-
-        # Normally, the lock is immediately released upon a request finishing, which allows the
-        # next request to handle it. However, once X-Ratelimit-Remaining is 0, we don't want any
-        # more requests to be made until the time limit is over. So the request sleeps for
-        # (X-RateLimit-Reset - time.time()) seconds, then unlocks the lock.
+        raw_response = kwargs.pop("raw_response", False)
+        priority = kwargs.pop("priority", Priority.NORMAL)
 
-        lock = self.get_ratelimit_lock(bucket)
-        # If we're being globally ratelimited, this will block until the global lock is finished.
-        await self.global_lock.acquire()
-        # Immediately release it because we're no longer being globally ratelimited.
-        await self.global_lock.release()
-
-        await lock.acquire()
+        # Okay, an English explaination of how this works.
+        # First, it loads the limiter for this bucket, keyed by bucket.
+        # Then, it tries to acquire a slot in the limiter. Up to X-Ratelimit-Remaining requests
+        # can hold a slot at once; before the first response, only one request can.
+
+        # Once X-Ratelimit-Remaining is 0, we don't want any more requests to be made until the
+        # time limit is over. So any further requests are parked in the limiter until
+        # X-RateLimit-Reset, and the count is corrected from the headers of every response.
+
+        # Encode JSON bodies once rather than on every try, so that their size is known.
+        if kwargs.get("json") is not None:
+            headers = kwargs.get("headers") or {}
+            headers["Content-Type"] = "application/json"
+            kwargs["headers"] = headers
+            kwargs["data"] = self.json_codec.dumpb(kwargs.pop("json"))
+
+        method = kwargs.get("method", "???")
+        path = kwargs.get("path", "???")
+        bucket_name = self._bucket_name(bucket)
+        route = route_template(path)
+        bytes_out = self._body_size(kwargs.get("data"))
+
+        ratelimits = self.ratelimit_backend
+        ticket = await ratelimits.acquire(bucket, priority)
+        global_wait, bucket_wait = ticket.global_wait, ticket.bucket_wait
         try:
-
-            if bucket in self._ratelimit_remaining:
-                # Make sure we have enough tries left.
-                tries, reset_time = self._ratelimit_remaining[bucket]
-
-                if tries <= 0:
-                    # We need to sleep for a bit before we can start making another request.
-                    sleep_time = ceil(reset_time - time.time())
-                    if sleep_time >= 0:
-                        logger.debug("Sleeping with lock open for {} seconds.".format(sleep_time))
-                        await multio.asynclib.sleep(sleep_time)
-
             for tries in range(0, 5):
-                method = kwargs.get("method", "???")
-                path = kwargs.get("path", "???")
                 logger.debug(f"{method} {path} => (pending) (try {tries + 1})")
 
+                sent_at = self.clock.now()
                 try:
                     response = await self._make_request(*args, **kwargs)
-                except OSError:
-                    # discord forcefully disconnected or similar
-                    continue
-                except ConnectivityError:
-                    # discord deadlocked for whatever reason
-                    continue
-                except RemoteProtocolError:
-                    # discord broke
+                except (OSError, ConnectivityError, RemoteProtocolError):
+                    # discord forcefully disconnected, deadlocked, or otherwise broke
+                    response = None
+
+                record = RequestRecord(bucket_name, route, method,
+                                       None if response is None else response.status_code,
+                                       self.clock.now() - sent_at,
+                                       bucket_wait=bucket_wait, global_wait=global_wait,
+                                       bytes_out=bytes_out)
+                bucket_wait = global_wait = 0.0
+
+                if response is None:
+                    self.instrumentation.record(record)
                     continue
 
+                record.bytes_in = self._body_size(getattr(response, "body", None))
                 logger.debug(f"{method} {path} => {response.status_code} (try {tries + 1})")
 
                 if response.status_code in range(500, 600):
+                    self.instrumentation.record(record)
                     # 502 means that we can retry without worrying about ratelimits.
                     # Perform exponential backoff to prevent spamming discord.
                     sleep_time = 1 + (tries * 2)
@@ -382,71 +587,75 @@ class HTTPClient(object):
                     continue
 
                 if response.status_code == 429:
+                    self.instrumentation.record(record)
                     # This is bad!
                     # But it's okay, we can handle it.
                     logger.warning("Hit a 429 in bucket {}. Check your clock!".format(bucket))
-                    sleep_time = ceil(int(response.headers["Retry-After"]) / 1000)
+                    self.clock.observe(response.headers)
+                    sleep_time = self.clock.retry_after(response.headers)
+                    if sleep_time is None:
+                        sleep_time = 1 + (tries * 2)
+
+                    await ratelimits.exhaust(ticket, self.clock.now() + sleep_time)
+                    # the next try is queued behind the bucket until then
+                    bucket_wait = sleep_time
                     await multio.asynclib.sleep(sleep_time)
                     continue
 
                 # Extract ratelimit headers.
-                remaining = int(response.headers.get("X-Ratelimit-Remaining", 1))
-                reset = int(response.headers.get("X-Ratelimit-Reset", 1))
+                self.clock.observe(response.headers)
+                if "X-Ratelimit-Remaining" in response.headers:
+                    remaining = int(response.headers["X-Ratelimit-Remaining"])
+                    reset = self.clock.reset_deadline(response.headers)
+                    if reset is None:
+                        reset = self.clock.now() + 1
 
-                # Update the ratelimit headers.
-                self._ratelimit_remaining[bucket] = remaining, reset
+                    limit = response.headers.get("X-Ratelimit-Limit")
+                    if limit is not None:
+                        limit = int(limit)
+
+                    await ratelimits.update(ticket, remaining, reset, limit=limit,
+                                            bucket_hash=response.headers.get("X-Ratelimit-Bucket"))
 
                 # Next, check if we need to sleep.
-                # Check if we need to sleep.
-                # This is signaled by Ratelimit-Remaining being 0 or Ratelimit-Global being True.
+                # This is signaled by Ratelimit-Global being True; an exhausted bucket is handled
+                # by the limiter parking the next requests.
                 is_global = response.headers.get("X-Ratelimit-Global", None) is not None
-                should_sleep = remaining == 0 or is_global
-
-                if should_sleep:
-                    # The time until the reset is given by X-Ratelimit-Reset.
-                    # Failing that, it's also given by the Retry-After header, which is in ms.
-                    reset = response.headers.get("X-Ratelimit-Reset")
-                    # Parse Discord's Date header to use their time rather than local time.
-                    parsed_time = parse_date_header(response.headers.get("Date")).timestamp()
-                    if reset:
-                        sleep_time = int(reset) - parsed_time
-                    else:
-                        retry_after = response.headers.get("Retry-After")
-                        if retry_after is not None:
-                            sleep_time = ceil(int(response.headers.get("Retry-After")) / 1000)
-                        else:
+
+                if is_global:
+                    # The time until the reset is given by X-Ratelimit-Reset-After (or
+                    # X-Ratelimit-Reset, corrected for clock skew).
+                    # Failing that, it's also given by the Retry-After header.
+                    deadline = self.clock.reset_deadline(response.headers)
+                    if deadline is None:
+                        retry_after = self.clock.retry_after(response.headers)
+                        if retry_after is None:
                             # fallback in case we get some really bad response
-                            sleep_time = 1 + (tries * 2)
-
-                    before_time = time.monotonic()
-                    if is_global:
-                        logger.debug("Reached the global ratelimit, acquiring global lock.")
-                        await self.global_lock.acquire()
-                    try:
-                        after_time = int(floor(time.monotonic() - before_time))
-                        if after_time != 0:
-                            # subtract the time we spent waiting for the global lock to be acquired
-                            sleep_time -= after_time
-
-                        logger.debug(
-                            "Being ratelimited under bucket %s, waking in %s seconds",
-                            bucket, sleep_time
-                        )
-
-                        # Sleep that amount of time.
-                        if sleep_time >= 0:
-                            await multio.asynclib.sleep(sleep_time)
-                    finally:
-                        # If the global lock is acquired, unlock it now
-                        if is_global:
-                            await self.global_lock.release()
+                            retry_after = 1 + (tries * 2)
+
+                        deadline = self.clock.now() + retry_after
+
+                    logger.debug(
+                        "Being ratelimited under bucket %s, waking in %.3f seconds",
+                        bucket, deadline - self.clock.now()
+                    )
+                    waiting_since = self.clock.now()
+                    await ratelimits.hold_global(deadline)
+
+                    record.global_wait += self.clock.now() - waiting_since
+
+                self.instrumentation.record(record)
 
                 # Now, we have that nuisance out of the way, we can try and get the result from
                 # the request.
                 result = self.get_response_data(response)
 
                 # Status codes between 200 and 300 mean success, so we return the data directly.
-                if 200 <= response.status_code < 300:
+                if 200 <= response.status_code < 300 \
+                        or (raw_response and response.status_code == 304):
+                    if raw_response:
+                        return response, result
+
                     return result
 
                 # Status codes between 400 and 600 are BAD!
@@ -467,17 +676,145 @@ class HTTPClient(object):
                 raise RuntimeError("Failed to get response after 5 tries.")
 
         finally:
-            await lock.release()
+            await ratelimits.release(ticket)
+
+    @staticmethod
+    def _coalesce_key(url: str, bucket: str, kwargs: dict) -> typing.Union[tuple, None]:
+        """
+        Gets the key identical GET requests are coalesced under.
+
+        :return: The key, or None if this request cannot be coalesced.
+        """
+        if set(kwargs) - {"params", "priority"}:
+            return None
+
+        params = kwargs.get("params") or {}
+        try:
+            params = tuple(sorted(params.items()))
+            key = (url, bucket, params)
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
+    async def _get(self, url: str, bucket: str, route: str, cache_key: tuple,
+                   *args, **kwargs):
+        """
+        Makes a GET request, storing the response in the response cache if applicable.
+
+        If a stale response is cached, this makes a conditional request for it.
+        """
+        if cache_key is None:
+            return await self.request(("GET", bucket), method="GET", path=url, *args, **kwargs)
+
+        cache = self.response_cache
+        entry = cache.peek(cache_key)
+        headers = entry.validators() if entry is not None else {}
+
+        response, result = await self.request(("GET", bucket), method="GET", path=url,
+                                              headers=headers, raw_response=True, **kwargs)
+
+        if response.status_code == 304:
+            entry = cache.revalidated(cache_key)
+            if entry is not None:
+                return copy.deepcopy(entry.data)
+
+            # evicted whilst we were waiting, so ask again without the validators
+            return await self.request(("GET", bucket), method="GET", path=url, **kwargs)
+
+        body = response.content
+        size = len(body) if isinstance(body, (bytes, str)) else 0
+        cache.store(cache_key, route, result, size, response.headers)
+        return result
+
+    def invalidate_cache(self, path: str = None, *, route: str = None) -> None:
+        """
+        Drops cached responses after a mutating request.
+
+        :param path: The formatted path to drop all cached responses for.
+        :param route: The route template to drop all cached responses for.
+        """
+        if self.response_cache is None:
+            return
+
+        if path is not None:
+            self.response_cache.invalidate(path)
+
+        if route is not None:
+            self.response_cache.invalidate_route(route)
 
     async def get(self, url: str, bucket: str,
-                  *args, **kwargs):
+                  *args, route: str = None, **kwargs):
         """
         Makes a GET request.
 
+        If another identical GET request is already in flight, this will wait for and share its
+        result rather than making a new request.
+
         :param url: The URL to request.
         :param bucket: The ratelimit bucket to file this request under.
-        """
-        return await self.request(("GET", bucket), method="GET", path=url, *args, **kwargs)
+        :param route: The route template of this request, used to look up the TTL in the
+            response cache.
+        """
+        cache = self.response_cache
+        cache_key = None
+        if cache is not None and route is not None and not args \
+                and cache.ttl_for(route) is not None:
+            cache_key = self._coalesce_key(url, bucket, kwargs)
+            if cache_key is not None:
+                entry = cache.lookup(cache_key)
+                if entry is not None and entry.fresh:
+                    return copy.deepcopy(entry.data)
+
+        key = None
+        if self.coalesce_gets and not args:
+            key = self._coalesce_key(url, bucket, kwargs)
+
+        if key is None:
+            return await self._get(url, bucket, route, cache_key, *args, **kwargs)
+
+        # only join a request in flight at the same or a higher priority, as joining a lower
+        # priority one would mean waiting behind its place in the ratelimit queues
+        priority = kwargs.get("priority", Priority.NORMAL)
+        promise = None
+        for joinable in Priority:
+            if joinable > priority:
+                break
+
+            promise = self._inflight_gets.get(key + (joinable,))
+            if promise is not None:
+                break
+
+        key += (priority,)
+        if promise is not None:
+            self.coalesced_requests += 1
+            success, result = await promise.wait()
+            if success is None:
+                # the original request was cancelled, so make our own
+                return await self.get(url, bucket, route=route, **kwargs)
+
+            if not success:
+                raise result
+
+            # callers are free to mutate the data they get, so they each need their own copy
+            return copy.deepcopy(result)
+
+        promise = multio.Promise()
+        self._inflight_gets[key] = promise
+        try:
+            result = await self._get(url, bucket, route, cache_key, **kwargs)
+        except Exception as e:
+            await promise.set((False, e))
+            raise
+        except BaseException:
+            await promise.set((None, None))
+            raise
+        else:
+            await promise.set((True, result))
+            return result
+        finally:
+            self._inflight_gets.pop(key, None)
 
     async def post(self, url: str, bucket: str,
                    *args, **kwargs):
@@ -602,7 +939,8 @@ class HTTPClient(object):
         if after is not None:
             params["after"] = after
 
-        data = await self.get(url, bucket="guild:{}".format(guild_id), params=params)
+        data = await self.get(url, bucket="guild:{}".format(guild_id), params=params,
+                              priority=Priority.BULK)
         return data
 
     async def get_guild_member(self, guild_id: int, member_id: int):
@@ -634,7 +972,10 @@ class HTTPClient(object):
 
         :param guild_id: The guild ID to get the vanity URL of.
         """
-        data = await self.get(Endpoints.GUILD_VANITY_URL, bucket="guild:{}".format(guild_id))
+        url = Endpoints.GUILD_VANITY_URL.format(guild_id=guild_id)
+
+        data = await self.get(url, bucket="guild:{}".format(guild_id),
+                              route=Endpoints.GUILD_VANITY_URL)
         return data
 
     async def edit_vanity_url(self, guild_id: int, code: str):
@@ -648,8 +989,10 @@ class HTTPClient(object):
             "code": code,
         }
 
-        data = await self.patch(Endpoints.GUILD_VANITY_URL, bucket="guild:{}".format(guild_id),
-                                json=payload)
+        url = Endpoints.GUILD_VANITY_URL.format(guild_id=guild_id)
+
+        data = await self.patch(url, bucket="guild:{}".format(guild_id), json=payload)
+        self.invalidate_cache(url)
         return data
 
     async def send_typing(self, channel_id: str):
@@ -664,7 +1007,7 @@ class HTTPClient(object):
         return data
 
     async def send_message(self, channel_id: int, content: str, tts: bool = False,
-                           embed: dict = None):
+                           embed: dict = None, *, priority: Priority = Priority.INTERACTIVE):
         """
         Sends a message to a channel.
 
@@ -672,6 +1015,7 @@ class HTTPClient(object):
         :param content: The content of the message.
         :param tts: Is this message a text to speech message?
         :param embed: The embed dict to send with this message.
+        :param priority: The :class:`.Priority` of this request.
         """
         url = Endpoints.CHANNEL_MESSAGES.format(channel_id=channel_id)
         payload = {
@@ -684,20 +1028,24 @@ class HTTPClient(object):
         if embed is not None:
             payload["embed"] = embed
 
-        data = await self.post(url, "messages:{}".format(channel_id), json=payload)
+        data = await self.post(url, "messages:{}".format(channel_id), json=payload,
+                               priority=priority)
         return data
 
-    async def send_file(self, channel_id: int, file_content: bytes, *,
-                        filename: str = None, content: str = None, embed: dict = None):
+    async def send_file(self, channel_id: int, file_content: FileContent, *,
+                        filename: str = None, content: str = None, embed: dict = None,
+                        priority: Priority = Priority.INTERACTIVE):
         """
         Uploads a file to the current channel.
 
-        This will encode the data as multipart/form-data.
+        This will stream the data as multipart/form-data.
 
         :param channel_id: The channel ID to upload to.
-        :param file_content: The content of the file being uploaded.
+        :param file_content: The content of the file being uploaded. This can be bytes, a \
+            memoryview, a path, or a binary file object.
         :param filename: The filename of the file being uploaded.
         :param content: Any optional message content to send with this file.
+        :param priority: The :class:`.Priority` of this request.
         """
         url = Endpoints.CHANNEL_MESSAGES.format(channel_id=channel_id)
         payload_json = {}
@@ -719,12 +1067,13 @@ class HTTPClient(object):
         # in the future, we give it explicitly)
         payload = {"payload_json": json.dumps(payload_json, ensure_ascii=True, separators=(',', ':'))}
 
-        body, headers = encode_multipart(payload, files)
-        data = await self.post(url, "messages:{}".format(channel_id),
-                               data=body, headers=headers)
+        body = MultipartEncoder(payload, files)
+        data = await self.post(url, "messages:{}".format(channel_id), data=body,
+                               priority=priority)
         return data
 
-    async def delete_message(self, channel_id: int, message_id: int):
+    async def delete_message(self, channel_id: int, message_id: int, *,
+                             priority: Priority = Priority.NORMAL):
         """
         Deletes a message.
 
@@ -732,10 +1081,11 @@ class HTTPClient(object):
 
         :param channel_id: The channel ID that the message is in.
         :param message_id: The message ID of the message.
+        :param priority: The :class:`.Priority` of this request.
         """
         url = Endpoints.CHANNEL_MESSAGE.format(channel_id=channel_id, message_id=message_id)
 
-        data = await self.delete(url, "messages:{}".format(channel_id))
+        data = await self.delete(url, "messages:{}".format(channel_id), priority=priority)
         return data
 
     async def edit_message(self, channel_id: int, message_id: int, content: str = None,
@@ -869,7 +1219,7 @@ class HTTPClient(object):
 
     async def get_message_history(self, channel_id: int, *,
                                   before: int = None, after: int = None, around: int = None,
-                                  limit: int = 100):
+                                  limit: int = 100, priority: Priority = Priority.NORMAL):
         """
         Gets a list of messages from a channel.
 
@@ -880,6 +1230,7 @@ class HTTPClient(object):
         :param after: Get messages after this snowflake.
         :param around: Get messages around this snowflake.
         :param limit: The maximum number of messages to return.
+        :param priority: The :class:`.Priority` of this request.
         :return: A list of message dictionaries.
         """
         url = Endpoints.CHANNEL_MESSAGES.format(channel_id=channel_id)
@@ -896,7 +1247,8 @@ class HTTPClient(object):
         if around:
             payload["around"] = str(around)
 
-        data = await self.get(url, bucket="messages:{}".format(channel_id), params=payload)
+        data = await self.get(url, bucket="messages:{}".format(channel_id), params=payload,
+                              priority=priority)
         return data
 
     async def get_pins(self, channel_id: int):
@@ -927,7 +1279,7 @@ class HTTPClient(object):
         }
 
         data = await self.post(url, bucket="messages:bulk_delete:{}".format(channel_id),
-                               json=payload)
+                               json=payload, priority=Priority.BULK)
         return data
 
     # Profile endpoints
@@ -1265,7 +1617,8 @@ class HTTPClient(object):
         data = await self.delete(url, bucket="channels:{}".format(channel_id))
         return data
 
-    async def add_member_role(self, guild_id: int, member_id: int, role_id: int):
+    async def add_member_role(self, guild_id: int, member_id: int, role_id: int, *,
+                              priority: Priority = Priority.NORMAL):
         """
         Adds a single role to a member.
 
@@ -1274,22 +1627,27 @@ class HTTPClient(object):
         :param guild_id: The guild ID that contains the objects.
         :param member_id: The member ID to add the role to.
         :param role_id: The role ID to add to the member.
+        :param priority: The :class:`.Priority` of this request. Use :attr:`.Priority.BULK` when
+            editing the roles of many members at once.
         """
         url = Endpoints.GUILD_MEMBER_ROLE.format(guild_id=guild_id,
                                                  member_id=member_id,
                                                  role_id=role_id)
 
-        data = await self.put(url, bucket="member_edit:{}".format(guild_id))
+        data = await self.put(url, bucket="member_edit:{}".format(guild_id), priority=priority)
         return data
 
     async def edit_member_roles(self, guild_id: int, member_id: int,
-                                role_ids: typing.Iterable[int]):
+                                role_ids: typing.Iterable[int], *,
+                                priority: Priority = Priority.NORMAL):
         """
         Modifies the roles that a member object contains.
 
         :param guild_id: The guild ID that contains the objects.
         :param member_id: The member ID to add the role to.
         :param role_ids: The role IDs to add to the member.
+        :param priority: The :class:`.Priority` of this request. Use :attr:`.Priority.BULK` when
+            editing the roles of many members at once.
         """
         url = Endpoints.GUILD_MEMBER.format(guild_id=guild_id,
                                             member_id=member_id)
@@ -1297,7 +1655,8 @@ class HTTPClient(object):
             "roles": [str(id) for id in role_ids]
         }
 
-        data = await self.patch(url, bucket="member_edit:{}".format(guild_id), json=payload)
+        data = await self.patch(url, bucket="member_edit:{}".format(guild_id), json=payload,
+                                priority=priority)
         return data
 
     async def edit_role_positions(self, guild_id: int,
@@ -1408,7 +1767,8 @@ class HTTPClient(object):
         """
         url = Endpoints.GUILD_EMBED.format(guild_id=guild_id)
 
-        data = await self.get(url, bucket="widget:{}".format(guild_id))
+        data = await self.get(url, bucket="widget:{}".format(guild_id),
+                              route=Endpoints.GUILD_EMBED)
         return data
 
     async def get_widget_data(self, guild_id: int):
@@ -1419,7 +1779,8 @@ class HTTPClient(object):
         """
         url = Endpoints.GUILD_WIDGET.format(guild_id=guild_id)
 
-        data = await self.get(url, bucket="widget:{}".format(guild_id))
+        data = await self.get(url, bucket="widget:{}".format(guild_id),
+                              route=Endpoints.GUILD_WIDGET)
         return data
 
     async def edit_widget(self, guild_id: int,
@@ -1442,6 +1803,8 @@ class HTTPClient(object):
             payload["channel_id"] = channel_id
 
         data = await self.patch(url, bucket="widget:{}".format(guild_id), json=payload)
+        self.invalidate_cache(url)
+        self.invalidate_cache(Endpoints.GUILD_WIDGET.format(guild_id=guild_id))
         return data
 
     async def get_audit_logs(self, guild_id: int,
@@ -1467,7 +1830,8 @@ class HTTPClient(object):
         if action_type is not None:
             payload["action_type"] = action_type
 
-        data = await self.get(url, bucket="guild:{}:audit-logs".format(guild_id), params=payload)
+        data = await self.get(url, bucket="guild:{}:audit-logs".format(guild_id), params=payload,
+                              priority=Priority.BULK)
         return data
 
     # Emojis
@@ -1479,7 +1843,7 @@ class HTTPClient(object):
         """
         url = Endpoints.GUILD_EMOJIS.format(guild_id=guild_id)
 
-        data = await self.get(url, bucket=f"emojis:{guild_id}")
+        data = await self.get(url, bucket=f"emojis:{guild_id}", route=Endpoints.GUILD_EMOJIS)
         return data
 
     async def get_guild_emoji(self, guild_id: int, emoji_id: int):
@@ -1514,6 +1878,7 @@ class HTTPClient(object):
             params["roles"] = [str(r) for r in roles]
 
         data = await self.post(url, bucket=f"emojis:{guild_id}", params=params)
+        self.invalidate_cache(Endpoints.GUILD_EMOJIS.format(guild_id=guild_id))
         return data
 
     async def edit_guild_emoji(self, guild_id: int, emoji_id: int, *,
@@ -1536,6 +1901,7 @@ class HTTPClient(object):
             params["roles"] = [str(r) for r in roles]
 
         data = await self.patch(url, bucket=f"emojis:{guild_id}", params=params)
+        self.invalidate_cache(Endpoints.GUILD_EMOJIS.format(guild_id=guild_id))
         return data
 
     async def delete_guild_emoji(self, guild_id: int, emoji_id: int):
@@ -1548,6 +1914,7 @@ class HTTPClient(object):
         url = Endpoints.GUILD_EMOJI.format(guild_id=guild_id, emoji_id=emoji_id)
 
         data = await self.delete(url, bucket=f"emojis:{guild_id}")
+        self.invalidate_cache(Endpoints.GUILD_EMOJIS.format(guild_id=guild_id))
         return data
 
     # Webhooks
@@ -1570,7 +1937,8 @@ class HTTPClient(object):
         """
         url = Endpoints.GUILD_WEBHOOKS.format(guild_id=guild_id)
 
-        data = await self.get(url, bucket="webhooks:{}".format(guild_id))
+        data = await self.get(url, bucket="webhooks:{}".format(guild_id),
+                              route=Endpoints.GUILD_WEBHOOKS)
         return data
 
     async def get_webhooks_for_channel(self, channel_id: int):
@@ -1600,6 +1968,8 @@ class HTTPClient(object):
             payload["avatar"] = avatar
 
         data = await self.post(url, bucket="webhooks:{}".format(channel_id), json=payload)
+        # we don't know the guild of the channel here, so drop every guild's webhooks
+        self.invalidate_cache(route=Endpoints.GUILD_WEBHOOKS)
         return data
 
     async def edit_webhook(self, webhook_id: int, *,
@@ -1621,6 +1991,7 @@ class HTTPClient(object):
             payload["name"] = name
 
         data = await self.patch(url, bucket="webhooks", json=payload)
+        self.invalidate_cache(route=Endpoints.GUILD_WEBHOOKS)
         return data
 
     async def edit_webhook_with_token(self, webhook_id: int, token: str, *,
@@ -1644,6 +2015,7 @@ class HTTPClient(object):
             payload["name"] = name
 
         data = await self.patch(url, bucket="webhooks", json=payload)
+        self.invalidate_cache(route=Endpoints.GUILD_WEBHOOKS)
         return data
 
     async def delete_webhook(self, webhook_id: int):
@@ -1655,6 +2027,7 @@ class HTTPClient(object):
         url = Endpoints.WEBHOOKS_GET.format(webhook_id=webhook_id)
 
         data = await self.delete(url, bucket="webhooks")
+        self.invalidate_cache(route=Endpoints.GUILD_WEBHOOKS)
         return data
 
     async def delete_webhook_with_token(self, webhook_id: int, token: str):
@@ -1668,15 +2041,20 @@ class HTTPClient(object):
                                               token=token)
 
         data = await self.delete(url, bucket="webhooks")
+        self.invalidate_cache(route=Endpoints.GUILD_WEBHOOKS)
         return data
 
     async def execute_webhook(self, webhook_id: int, webhook_token: str, *,
                               content: str = None, embeds: typing.List[typing.Dict] = None,
                               username: str = None, avatar_url: str = None,
-                              wait: bool = False):
+                              wait: bool = False, file_content: FileContent = None,
+                              filename: str = None):
         """
         Executes a webhook.
 
+        If ``file_content`` is passed, the file is streamed alongside the message as
+        multipart/form-data.
+
         :param webhook_id: The ID of the webhook to execute.
         :param webhook_token: The token of this webhook.
         :param content: Any message content to send.
@@ -1684,6 +2062,9 @@ class HTTPClient(object):
         :param username: The username to override with.
         :param avatar_url: The avatar URL to send.
         :param wait: If we should wait for the message to send.
+        :param file_content: The content of a file to upload. This can be bytes, a memoryview, \
+            a path, or a binary file object.
+        :param filename: The filename of the file being uploaded.
         """
         url = Endpoints.WEBHOOKS_TOKEN.format(webhook_id=webhook_id, token=webhook_token)
         payload = {}
@@ -1702,7 +2083,19 @@ class HTTPClient(object):
 
         # URL params, not payload
         params = {"wait": str(wait)}
-        data = await self.post(url, bucket="webhooks", json=payload, params=params)
+        if file_content is None:
+            data = await self.post(url, bucket="webhooks", json=payload, params=params)
+        else:
+            files = {
+                "file": {
+                    "filename": filename or "unknown.bin",
+                    "content": file_content
+                }
+            }
+            payload = {"payload_json": json.dumps(payload, ensure_ascii=True,
+                                                  separators=(',', ':'))}
+            body = MultipartEncoder(payload, files)
+            data = await self.post(url, bucket="webhooks", data=body, params=params)
 
         return data
 
@@ -1715,12 +2108,12 @@ class HTTPClient(object):
         :param invite_code: The invite to get.
         :param with_counts: Should the estimated total and online members be included?
         """
-        url = Endpoints.INVITES_BASE.format(invite_code=invite_code)
+        url = Endpoints.INVITE_GET.format(invite_code=invite_code)
         params = {
             "with_counts": "true" if with_counts else "false"
         }
 
-        data = await self.get(url, bucket="invites", params=params)
+        data = await self.get(url, bucket="invites", params=params, route=Endpoints.INVITE_GET)
         return data
 
     async def get_invites_for(self, guild_id: int):
@@ -1773,6 +2166,7 @@ class HTTPClient(object):
         url = Endpoints.INVITE_GET.format(invite_code=invite_code)
 
         data = await self.delete(url, bucket="invites")
+        self.invalidate_cache(url)
         return data
 
     async def search_channel(self, channel_id: int, params: dict):
@@ -1833,12 +2227,14 @@ class HTTPClient(object):
 
         try:
             data = await self.get(url, bucket="oauth2",
-                                  params={"client_id": application_id, "scope": "bot"})
+                                  params={"client_id": application_id, "scope": "bot"},
+                                  route=Endpoints.OAUTH2_AUTHORIZE)
         except HTTPException as e:
             if e.error_code != 50010:
                 raise
 
-            data = await self.get(url, bucket="oauth2", params={"client_id": application_id})
+            data = await self.get(url, bucket="oauth2", params={"client_id": application_id},
+                                  route=Endpoints.OAUTH2_AUTHORIZE)
         return data
 
     async def _get_app_info_me(self):
@@ -1847,7 +2243,7 @@ class HTTPClient(object):
         """
         url = Endpoints.OAUTH2_APPLICATION_ME
 
-        data = await self.get(url, "oauth2")
+        data = await self.get(url, "oauth2", route=Endpoints.OAUTH2_APPLICATION_ME)
         # httpclient is meant to be a "pure" wrapper, but add this anyway.
         me = await self.get_this_user()
 
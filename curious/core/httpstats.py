@@ -0,0 +1,355 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-bucket and per-route instrumentation for the :class:`.HTTPClient`.
+
+.. currentmodule:: curious.core.httpstats
+"""
+import bisect
+import collections
+import logging
+import re
+import typing
+
+logger = logging.getLogger("curious.http.stats")
+
+#: The default upper bounds of the latency histogram buckets, in seconds.
+DEFAULT_LATENCY_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (pattern, replacement) pairs used to turn a request path into a route template
+_ROUTE_PATTERNS = [
+    (re.compile(r"/webhooks/\d+/[^/]+"), "/webhooks/{id}/{token}"),
+    (re.compile(r"/invites/[^/]+"), "/invites/{code}"),
+    (re.compile(r"/reactions/[^/]+"), "/reactions/{emoji}"),
+    (re.compile(r"/\d+(?=/|$)"), "/{id}"),
+]
+
+
+def route_template(path: str) -> str:
+    """
+    Turns a request path into a route template, by replacing IDs and other per-object parts.
+
+    >>> route_template("/channels/381870553235193857/messages/381870553235193858")
+    '/channels/{id}/messages/{id}'
+
+    :param path: The request path.
+    :return: The route template.
+    """
+    for pattern, replacement in _ROUTE_PATTERNS:
+        path = pattern.sub(replacement, path)
+
+    return path
+
+
+class LatencyHistogram(object):
+    """
+    A fixed-bucket histogram of request latencies.
+    """
+
+    __slots__ = "bounds", "counts", "count", "total", "max"
+
+    def __init__(self, bounds: typing.Sequence[float] = DEFAULT_LATENCY_BOUNDS):
+        #: The upper bounds of each bucket, in seconds.
+        self.bounds = tuple(bounds)
+
+        #: The number of observations in each bucket. The last bucket has no upper bound.
+        self.counts = [0] * (len(self.bounds) + 1)
+
+        #: The total number of observations.
+        self.count = 0
+
+        #: The sum of all observations, in seconds.
+        self.total = 0.0
+
+        #: The largest observation, in seconds.
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Records an observation.
+
+        :param seconds: The latency, in seconds.
+        """
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile from the histogram, as the upper bound of the bucket it falls in.
+
+        :param q: The quantile, between 0 and 1.
+        :return: The estimated latency, in seconds.
+        """
+        if self.count == 0:
+            return 0.0
+
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+
+        return self.max
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        """
+        :return: A dict representation of this histogram.
+        """
+        buckets = collections.OrderedDict(zip(self.bounds, self.counts))
+        buckets[float("inf")] = self.counts[-1]
+        return {
+            "buckets": buckets,
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class RequestRecord(object):
+    """
+    Represents a single HTTP request made by the :class:`.HTTPClient`.
+
+    A ratelimited request that is retried produces one record per try.
+    """
+
+    __slots__ = ("bucket", "route", "method", "status_code", "latency", "bucket_wait",
+                 "global_wait", "bytes_in", "bytes_out")
+
+    def __init__(self, bucket: str, route: str, method: str, status_code: typing.Optional[int],
+                 latency: float, bucket_wait: float = 0.0, global_wait: float = 0.0,
+                 bytes_in: int = 0, bytes_out: int = 0):
+        #: The ratelimit bucket of the request.
+        self.bucket = bucket
+
+        #: The route template of the request.
+        self.route = route
+
+        #: The HTTP method of the request.
+        self.method = method
+
+        #: The status code of the response, or None if the connection failed.
+        self.status_code = status_code
+
+        #: The time between sending the request and receiving the response, in seconds.
+        self.latency = latency
+
+        #: The time spent waiting on the bucket before this try, in seconds.
+        self.bucket_wait = bucket_wait
+
+        #: The time spent waiting on the global ratelimit for this try, in seconds.
+        self.global_wait = global_wait
+
+        #: The size of the response body, in bytes.
+        self.bytes_in = bytes_in
+
+        #: The size of the request body, in bytes.
+        self.bytes_out = bytes_out
+
+    def __repr__(self) -> str:
+        return "<RequestRecord method={} route={} status={} latency={:.3f}>".format(
+            self.method, self.route, self.status_code, self.latency
+        )
+
+
+class RequestStats(object):
+    """
+    Aggregated statistics for the requests in a bucket or to a route.
+    """
+
+    __slots__ = ("requests", "latency", "bucket_wait", "global_wait", "ratelimited",
+                 "server_errors", "failures", "bytes_in", "bytes_out")
+
+    def __init__(self, latency_bounds: typing.Sequence[float] = DEFAULT_LATENCY_BOUNDS):
+        #: The number of requests made.
+        self.requests = 0
+
+        #: The :class:`.LatencyHistogram` of the requests made.
+        self.latency = LatencyHistogram(latency_bounds)
+
+        #: The total time spent waiting on the bucket, in seconds.
+        self.bucket_wait = 0.0
+
+        #: The total time spent waiting on the global ratelimit, in seconds.
+        self.global_wait = 0.0
+
+        #: The number of 429 responses.
+        self.ratelimited = 0
+
+        #: The number of 5xx responses, which are retried.
+        self.server_errors = 0
+
+        #: The number of requests that failed to get a response at all.
+        self.failures = 0
+
+        #: The total size of the response bodies, in bytes.
+        self.bytes_in = 0
+
+        #: The total size of the request bodies, in bytes.
+        self.bytes_out = 0
+
+    def add(self, record: RequestRecord) -> None:
+        """
+        Adds a request to these statistics.
+        """
+        self.requests += 1
+        self.bucket_wait += record.bucket_wait
+        self.global_wait += record.global_wait
+        self.bytes_in += record.bytes_in
+        self.bytes_out += record.bytes_out
+
+        if record.status_code is None:
+            self.failures += 1
+            return
+
+        self.latency.observe(record.latency)
+        if record.status_code == 429:
+            self.ratelimited += 1
+        elif 500 <= record.status_code < 600:
+            self.server_errors += 1
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        """
+        :return: A dict representation of these statistics.
+        """
+        return {
+            "requests": self.requests,
+            "latency": self.latency.snapshot(),
+            "bucket_wait": self.bucket_wait,
+            "global_wait": self.global_wait,
+            "ratelimited": self.ratelimited,
+            "server_errors": self.server_errors,
+            "failures": self.failures,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+class HTTPInstrumentation(object):
+    """
+    Collects :class:`.RequestStats` per ratelimit bucket and per route template, and pushes every
+    :class:`.RequestRecord` to any registered listeners.
+
+    .. code-block:: python3
+
+        def on_request(record: RequestRecord):
+            if record.bucket_wait > 1:
+                logger.info("Queued for %.2fs on %s", record.bucket_wait, record.route)
+
+        client.http.instrumentation.add_listener(on_request)
+        ...
+        print(client.http.instrumentation.snapshot()["routes"])
+    """
+
+    def __init__(self, max_keys: int = 1024,
+                 latency_bounds: typing.Sequence[float] = DEFAULT_LATENCY_BOUNDS):
+        """
+        :param max_keys: The maximum number of buckets (and routes) to keep statistics for. The
+            least recently used ones are dropped past this.
+        :param latency_bounds: The upper bounds of the latency histogram buckets, in seconds.
+        """
+        self.max_keys = max_keys
+        self.latency_bounds = tuple(latency_bounds)
+
+        #: The :class:`.RequestStats` for every request made.
+        self.total = RequestStats(self.latency_bounds)
+
+        self._buckets = collections.OrderedDict()  # type: typing.Dict[str, RequestStats]
+        self._routes = collections.OrderedDict()  # type: typing.Dict[str, RequestStats]
+        self._listeners = []
+
+    def __repr__(self) -> str:
+        return "<HTTPInstrumentation requests={} buckets={} routes={}>".format(
+            self.total.requests, len(self._buckets), len(self._routes)
+        )
+
+    def add_listener(self, listener: typing.Callable[[RequestRecord], typing.Any]) -> None:
+        """
+        Adds a listener, which is called with every :class:`.RequestRecord`.
+
+        Listeners are called synchronously from inside the request, so they should be cheap; spawn
+        a task from the listener for anything that needs to do I/O.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: typing.Callable[[RequestRecord], typing.Any]) -> None:
+        """
+        Removes a listener added with :meth:`.add_listener`.
+        """
+        self._listeners.remove(listener)
+
+    def _stats_for(self, mapping: 'collections.OrderedDict', key: str) -> RequestStats:
+        try:
+            stats = mapping[key]
+        except KeyError:
+            stats = mapping[key] = RequestStats(self.latency_bounds)
+            if len(mapping) > self.max_keys:
+                mapping.popitem(last=False)
+        else:
+            mapping.move_to_end(key)
+
+        return stats
+
+    def record(self, record: RequestRecord) -> None:
+        """
+        Records a request, and pushes it to the listeners.
+        """
+        self.total.add(record)
+        self._stats_for(self._buckets, record.bucket).add(record)
+        self._stats_for(self._routes, record.route).add(record)
+
+        for listener in self._listeners:
+            try:
+                listener(record)
+            except Exception:
+                logger.exception("Unhandled exception in request listener {}".format(listener))
+
+    def bucket(self, bucket: str) -> typing.Union[RequestStats, None]:
+        """
+        :param bucket: The name of the bucket.
+        :return: The :class:`.RequestStats` for the bucket, if any requests have been made in it.
+        """
+        return self._buckets.get(bucket)
+
+    def route(self, route: str) -> typing.Union[RequestStats, None]:
+        """
+        :param route: The route template.
+        :return: The :class:`.RequestStats` for the route, if any requests have been made to it.
+        """
+        return self._routes.get(route)
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        """
+        :return: A dict of the total, per-bucket and per-route statistics.
+        """
+        return {
+            "total": self.total.snapshot(),
+            "buckets": {key: stats.snapshot() for key, stats in self._buckets.items()},
+            "routes": {key: stats.snapshot() for key, stats in self._routes.items()},
+        }
+
+    def reset(self) -> None:
+        """
+        Clears all statistics.
+        """
+        self.total = RequestStats(self.latency_bounds)
+        self._buckets.clear()
+        self._routes.clear()
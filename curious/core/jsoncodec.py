@@ -0,0 +1,189 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pluggable JSON codecs, used by the gateway, the HTTP client and IPC.
+
+If an accelerated JSON library (``orjson``, ``rapidjson`` or ``ujson``) is installed, it is used
+by default; otherwise, the stdlib :mod:`json` module is used. A specific codec can be picked per
+client:
+
+.. code-block:: python3
+
+    client = Client("token", json_codec="stdlib")
+
+.. currentmodule:: curious.core.jsoncodec
+"""
+import json
+import typing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONCodec(object):
+    """
+    The base class for a JSON codec.
+
+    Subclasses must override :meth:`.dumps` and :meth:`.loads`, and should override
+    :meth:`.dumpb` if the library can produce bytes directly.
+    """
+    #: The name this codec is selected by.
+    name = None  # type: str
+
+    def __repr__(self) -> str:
+        return "<{} name={}>".format(type(self).__name__, self.name)
+
+    def dumps(self, obj: typing.Any) -> str:
+        """
+        Encodes an object as compact JSON.
+
+        :param obj: The object to encode.
+        :return: The encoded JSON, as a :class:`str`.
+        """
+        raise NotImplementedError
+
+    def dumpb(self, obj: typing.Any) -> bytes:
+        """
+        Encodes an object as compact JSON.
+
+        :param obj: The object to encode.
+        :return: The encoded JSON, as UTF-8 :class:`bytes`.
+        """
+        return self.dumps(obj).encode("utf-8")
+
+    def loads(self, data: typing.Union[str, bytes]) -> typing.Any:
+        """
+        Decodes JSON.
+
+        :param data: The JSON to decode, as a :class:`str` or UTF-8 :class:`bytes`.
+        :return: The decoded object.
+        """
+        raise NotImplementedError
+
+
+class StdlibJSONCodec(JSONCodec):
+    """
+    A codec using the stdlib :mod:`json` module. This is always available.
+    """
+    name = "stdlib"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+        self._decoder = json.JSONDecoder()
+
+    def dumps(self, obj: typing.Any) -> str:
+        return self._encoder.encode(obj)
+
+    def loads(self, data: typing.Union[str, bytes]) -> typing.Any:
+        if not isinstance(data, str):
+            data = bytes(data).decode("utf-8")
+
+        return self._decoder.decode(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """
+    A codec using ``orjson``.
+    """
+    name = "orjson"
+
+    def dumps(self, obj: typing.Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    def dumpb(self, obj: typing.Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data: typing.Union[str, bytes]) -> typing.Any:
+        return orjson.loads(data)
+
+
+class RapidJSONCodec(JSONCodec):
+    """
+    A codec using ``python-rapidjson``.
+    """
+    name = "rapidjson"
+
+    def dumps(self, obj: typing.Any) -> str:
+        return rapidjson.dumps(obj, ensure_ascii=False)
+
+    def loads(self, data: typing.Union[str, bytes]) -> typing.Any:
+        return rapidjson.loads(data)
+
+
+class UJSONCodec(JSONCodec):
+    """
+    A codec using ``ujson``.
+    """
+    name = "ujson"
+
+    def dumps(self, obj: typing.Any) -> str:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+    def loads(self, data: typing.Union[str, bytes]) -> typing.Any:
+        return ujson.loads(data)
+
+
+#: The mapping of codec name -> (codec class, if its library is installed), fastest first.
+CODECS = {
+    OrjsonCodec.name: (OrjsonCodec, orjson is not None),
+    RapidJSONCodec.name: (RapidJSONCodec, rapidjson is not None),
+    UJSONCodec.name: (UJSONCodec, ujson is not None),
+    StdlibJSONCodec.name: (StdlibJSONCodec, True),
+}
+
+
+def available_codecs() -> typing.List[str]:
+    """
+    :return: The names of the codecs whose library is installed, fastest first.
+    """
+    return [name for name, (klass, installed) in CODECS.items() if installed]
+
+
+def get_codec(codec: typing.Union[str, JSONCodec] = None) -> JSONCodec:
+    """
+    Gets a JSON codec.
+
+    :param codec: The name of the codec, or a :class:`.JSONCodec` to use as-is. If None, the
+        fastest installed codec is used.
+    :return: The :class:`.JSONCodec`.
+    """
+    if isinstance(codec, JSONCodec):
+        return codec
+
+    if codec is None:
+        codec = available_codecs()[0]
+
+    try:
+        klass, installed = CODECS[codec]
+    except KeyError:
+        raise ValueError("Unknown JSON codec: {}".format(codec)) from None
+
+    if not installed:
+        raise ValueError("The library for the {} JSON codec is not installed".format(codec))
+
+    return klass()
@@ -0,0 +1,233 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Streaming multipart/form-data request bodies.
+
+.. currentmodule:: curious.core.multipart
+"""
+import io
+import mimetypes
+import os
+import random
+import string
+import typing
+
+import h11
+from asks.request_object import Request
+from multio import asynclib
+
+#: The types that can be uploaded as the content of a file.
+FileContent = typing.Union[bytes, bytearray, memoryview, str, os.PathLike, typing.BinaryIO]
+
+_BOUNDARY_CHARS = string.ascii_letters + string.digits
+
+
+def _escape_quote(s: bytes) -> bytes:
+    return s.replace(b'"', b'\\"')
+
+
+class _FileSource(object):
+    """
+    A re-readable source of file content with a known size.
+    """
+
+    __slots__ = "kind", "obj", "start", "size"
+
+    def __init__(self, content: FileContent):
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            self.kind = "buffer"
+            self.obj = memoryview(content).cast("B")
+            self.start = 0
+            self.size = self.obj.nbytes
+        elif isinstance(content, (str, os.PathLike)):
+            self.kind = "path"
+            self.obj = os.fspath(content)
+            self.start = 0
+            self.size = os.stat(self.obj).st_size
+        elif hasattr(content, "read"):
+            seekable = getattr(content, "seekable", lambda: False)()
+            if seekable and not isinstance(content, io.TextIOBase):
+                self.kind = "file"
+                self.obj = content
+                self.start = content.tell()
+                self.size = content.seek(0, io.SEEK_END) - self.start
+                content.seek(self.start)
+            else:
+                # we can't know the size of this up front, or read it twice, so buffer it
+                data = content.read()
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+
+                self.kind = "buffer"
+                self.obj = memoryview(data)
+                self.start = 0
+                self.size = len(data)
+        else:
+            raise TypeError("Got unknown type for file content: {}".format(type(content)))
+
+    def _read_file(self, fp: typing.BinaryIO, chunk_size: int):
+        remaining = self.size
+        while remaining > 0:
+            chunk = fp.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+
+            remaining -= len(chunk)
+            yield chunk
+
+        if remaining != 0:
+            raise ValueError("File changed size whilst being uploaded")
+
+    def chunks(self, chunk_size: int):
+        """
+        Reads this source from the start, in chunks of at most ``chunk_size`` bytes.
+        """
+        if self.kind == "buffer":
+            for offset in range(0, self.size, chunk_size):
+                yield self.obj[offset:offset + chunk_size]
+
+        elif self.kind == "path":
+            with open(self.obj, "rb") as fp:
+                yield from self._read_file(fp, chunk_size)
+
+        else:
+            self.obj.seek(self.start)
+            yield from self._read_file(self.obj, chunk_size)
+
+
+class MultipartEncoder(object):
+    """
+    A multipart/form-data body that is streamed from its sources rather than built in memory.
+
+    File content may be bytes, a memoryview, a path, or a binary file object. Paths are opened,
+    and file objects are seeked back to where they started, every time the body is streamed, so
+    a request can be retried without keeping the file in memory. The total length is known up
+    front, for the ``Content-Length`` header.
+
+    .. code-block:: python3
+
+        with open("big.png", "rb") as f:
+            body = MultipartEncoder({"payload_json": "{}"},
+                                    {"file": {"filename": "big.png", "content": f}})
+            await session.post(url, data=body)
+    """
+
+    #: The maximum number of bytes yielded at once whilst streaming.
+    chunk_size = 64 * 1024
+
+    def __init__(self, fields: typing.Mapping[str, typing.Any],
+                 files: typing.Mapping[str, typing.Mapping[str, typing.Any]],
+                 boundary: bytes = None):
+        """
+        :param fields: A mapping of form field name -> value.
+        :param files: A mapping of form field name -> file dict. Each file dict has the required
+            keys ``filename`` and ``content``, and optionally ``mimetype``.
+        :param boundary: The multipart boundary to use. If None, one is randomly generated.
+        """
+        if boundary is None:
+            boundary = b''.join(random.choice(_BOUNDARY_CHARS).encode() for i in range(30))
+
+        #: The multipart boundary of this body.
+        self.boundary = boundary
+
+        self._parts = []  # type: typing.List[typing.Tuple[bytes, _FileSource]]
+
+        for name, value in fields.items():
+            name = name.encode() if isinstance(name, str) else str(name).encode()
+            value = value.encode() if isinstance(value, str) else str(value).encode()
+
+            header = b'--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n' % (
+                boundary, _escape_quote(name)
+            )
+            self._parts.append((header, _FileSource(value)))
+
+        for name, value in files.items():
+            filename = value['filename']
+            if 'mimetype' in value:
+                mimetype = value['mimetype']
+            else:
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+            header = b'--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n' \
+                     b'Content-Type: %s\r\n\r\n' % (
+                         boundary, _escape_quote(name.encode()), _escape_quote(filename.encode()),
+                         mimetype.encode()
+                     )
+            self._parts.append((header, _FileSource(value['content'])))
+
+        self._trailer = b'--%s--\r\n' % boundary
+        self._length = len(self._trailer) + sum(len(header) + source.size + 2
+                                                for header, source in self._parts)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> typing.Iterator[typing.Union[bytes, memoryview]]:
+        for header, source in self._parts:
+            yield header
+            yield from source.chunks(self.chunk_size)
+            yield b'\r\n'
+
+        yield self._trailer
+
+    def __repr__(self) -> str:
+        return "<MultipartEncoder parts={} length={}>".format(len(self._parts), self._length)
+
+    @property
+    def content_type(self) -> str:
+        """
+        :return: The ``Content-Type`` header for this body.
+        """
+        return 'multipart/form-data; boundary=%s' % self.boundary.decode()
+
+    @property
+    def headers(self) -> typing.Dict[str, str]:
+        """
+        :return: The ``Content-Type`` and ``Content-Length`` headers for this body.
+        """
+        return {
+            'Content-Type': self.content_type,
+            'Content-Length': str(self._length),
+        }
+
+    def read(self) -> bytes:
+        """
+        Reads the entire body into memory. Only useful for debugging.
+        """
+        return b''.join(self)
+
+
+class StreamingRequest(Request):
+    """
+    An asks request that streams a :class:`.MultipartEncoder` body onto the socket chunk by chunk.
+    """
+
+    async def _formulate_body(self):
+        if isinstance(self.data, MultipartEncoder):
+            # the body is sent in _send, so there's no body for make_request to send
+            return self.data.content_type, str(len(self.data)), b''
+
+        return await super()._formulate_body()
+
+    async def _send(self, request_bytes, body_bytes, hconnection):
+        if not isinstance(self.data, MultipartEncoder):
+            return await super()._send(request_bytes, body_bytes, hconnection)
+
+        await asynclib.sendall(self.sock, hconnection.send(request_bytes))
+        for chunk in self.data:
+            await asynclib.sendall(self.sock, hconnection.send(h11.Data(data=chunk)))
+
+        await asynclib.sendall(self.sock, hconnection.send(h11.EndOfMessage()))
@@ -0,0 +1,798 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Ratelimiting primitives used by the :class:`.HTTPClient`.
+
+.. currentmodule:: curious.core.ratelimit
+"""
+import collections
+import enum
+import heapq
+import itertools
+import logging
+import time
+import typing
+from email.utils import parsedate_to_datetime
+
+import multio
+
+try:
+    # try and load a C impl of LRU first
+    from lru import LRU as c_lru
+
+    lru = c_lru
+except ImportError:
+    # fall back to a pure-python (the default) version
+    from pylru import lrucache as py_lru
+
+    lru = py_lru
+
+logger = logging.getLogger("curious.http.ratelimit")
+
+
+class Priority(enum.IntEnum):
+    """
+    The priority classes of requests. Requests waiting on the same bucket, or on the global
+    limiter, are let through in priority order, and in arrival order within a priority.
+    """
+    #: User-facing requests, such as command replies.
+    INTERACTIVE = 0
+
+    #: Everything else.
+    NORMAL = 1
+
+    #: Background jobs, such as purges and member downloads.
+    BULK = 2
+
+
+# shared between limiters, so that the order of waiters survives limiters being merged
+_waiter_sequence = itertools.count()
+
+
+class _Waiter(object):
+    """
+    A request parked in a priority queue.
+    """
+
+    __slots__ = "priority", "sequence", "event", "granted"
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.sequence = next(_waiter_sequence)
+        self.event = None  # type: multio.Event
+        self.granted = False
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class RatelimitClock(object):
+    """
+    Converts ratelimit headers into precise deadlines on the local monotonic clock.
+
+    ``X-RateLimit-Reset-After`` and ``Retry-After`` are relative, so they are used directly where
+    possible. Absolute timestamps (``X-RateLimit-Reset``) are corrected by the skew between
+    Discord's clock and ours, which is re-measured from every response that has both headers.
+    """
+
+    def __init__(self):
+        #: The observed skew between Discord's clock and the local clock, in seconds.
+        #: Positive values mean Discord's clock is ahead of ours.
+        self.skew = 0.0
+
+        #: If :attr:`.skew` has been measured precisely, rather than from the ``Date`` header.
+        self.precise_skew = False
+
+    @staticmethod
+    def now() -> float:
+        """
+        :return: The current time on the clock deadlines are measured against.
+        """
+        return time.monotonic()
+
+    def observe(self, headers: typing.Mapping[str, str]) -> None:
+        """
+        Records the clock skew from the headers of a response.
+
+        :param headers: The response headers.
+        """
+        reset = headers.get("X-Ratelimit-Reset")
+        reset_after = headers.get("X-Ratelimit-Reset-After")
+        if reset is not None and reset_after is not None:
+            # reset - reset_after is Discord's idea of the current time, to the millisecond
+            self.skew = (float(reset) - float(reset_after)) - time.time()
+            self.precise_skew = True
+            return
+
+        if not self.precise_skew:
+            date = headers.get("Date")
+            if date is not None:
+                try:
+                    self.skew = parsedate_to_datetime(date).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    pass
+
+    def deadline_from_timestamp(self, timestamp: float) -> float:
+        """
+        Converts a Discord UNIX timestamp into a local deadline.
+
+        :param timestamp: The UNIX timestamp, according to Discord's clock.
+        :return: The deadline on this clock.
+        """
+        return self.now() + (timestamp - (time.time() + self.skew))
+
+    def reset_deadline(self, headers: typing.Mapping[str, str]) -> typing.Union[float, None]:
+        """
+        Gets the deadline a bucket resets at from the headers of a response.
+
+        :param headers: The response headers.
+        :return: The deadline on this clock, or None if the headers do not say.
+        """
+        reset_after = headers.get("X-Ratelimit-Reset-After")
+        if reset_after is not None:
+            return self.now() + float(reset_after)
+
+        reset = headers.get("X-Ratelimit-Reset")
+        if reset is not None:
+            return self.deadline_from_timestamp(float(reset))
+
+        return None
+
+    @staticmethod
+    def retry_after(headers: typing.Mapping[str, str]) -> typing.Union[float, None]:
+        """
+        Gets the number of seconds to wait before retrying from the headers of a response.
+
+        :param headers: The response headers.
+        :return: The number of seconds to wait, or None if the headers do not say.
+        """
+        retry_after = headers.get("Retry-After")
+        if retry_after is None:
+            return None
+
+        # Retry-After is in milliseconds
+        return float(retry_after) / 1000
+
+
+class BucketLimiter(object):
+    """
+    A counting limiter for a single ratelimit bucket.
+
+    Unlike a plain lock, this admits up to ``remaining`` requests concurrently, parks any further
+    requests until the bucket resets, and corrects its count from the ratelimit headers of each
+    response.
+
+    Until the first response in a bucket arrives the limit is unknown, so only one request is let
+    through to learn it.
+
+    Parked requests are let through in :class:`.Priority` order.
+    """
+
+    def __init__(self, bucket: object, remaining: int = None, reset_at: float = None):
+        """
+        :param bucket: The bucket this limiter is for.
+        :param remaining: The number of requests known to be remaining, if any.
+        :param reset_at: The :class:`.RatelimitClock` deadline the bucket resets at, if known.
+        """
+        #: The bucket this limiter is for.
+        self.bucket = bucket
+
+        #: The maximum number of requests in a single window, if known.
+        self.limit = None  # type: int
+
+        #: The number of requests that can still be started in the current window.
+        #: This is None if the remaining count is unknown.
+        self.remaining = remaining  # type: int
+
+        #: The :class:`.RatelimitClock` deadline the current window resets at.
+        self.reset_at = reset_at  # type: float
+
+        #: The number of requests currently in flight.
+        self.in_flight = 0
+
+        #: The limiter this limiter has been merged into, if any.
+        #: This happens when two routes turn out to share a single Discord bucket.
+        self.merged_into = None  # type: BucketLimiter
+
+        #: The heap of parked requests.
+        self._waiters = []  # type: typing.List[_Waiter]
+
+    def __repr__(self) -> str:
+        return "<BucketLimiter bucket={!r} remaining={} in_flight={}>".format(
+            self.bucket, self.remaining, self.in_flight
+        )
+
+    @property
+    def idle(self) -> bool:
+        """
+        :return: If this limiter has no requests in flight or waiting, and no active window.
+        """
+        if self.in_flight > 0 or self._waiters:
+            return False
+
+        return self.reset_at is None or RatelimitClock.now() >= self.reset_at
+
+    def merge(self, other: 'BucketLimiter') -> None:
+        """
+        Merges the state of another limiter into this one.
+
+        The other limiter forwards all future calls to this limiter.
+
+        :param other: The :class:`.BucketLimiter` to merge into this one.
+        """
+        if other is self:
+            return
+
+        if self.limit is None:
+            self.limit = other.limit
+
+        # be conservative: the fewest remaining requests and the latest reset wins
+        if other.remaining is not None:
+            if self.remaining is None:
+                self.remaining = other.remaining
+            else:
+                self.remaining = min(self.remaining, other.remaining)
+
+        if other.reset_at is not None:
+            if self.reset_at is None:
+                self.reset_at = other.reset_at
+            else:
+                self.reset_at = max(self.reset_at, other.reset_at)
+
+        self.in_flight += other.in_flight
+        self._waiters.extend(other._waiters)
+        heapq.heapify(self._waiters)
+
+        other.in_flight = 0
+        other._waiters = []
+        other.merged_into = self
+
+    def _maybe_reset(self) -> None:
+        """
+        Refills the bucket if its window has passed.
+        """
+        if self.reset_at is not None and RatelimitClock.now() >= self.reset_at:
+            self.reset_at = None
+            # if we don't know the limit, we need to probe again
+            self.remaining = self.limit
+
+    def _root(self) -> 'BucketLimiter':
+        """
+        :return: The limiter that this limiter has (transitively) been merged into, or itself.
+        """
+        limiter = self
+        while limiter.merged_into is not None:
+            limiter = limiter.merged_into
+
+        return limiter
+
+    def _try_take(self) -> bool:
+        """
+        Takes a slot in this bucket, if one is available.
+        """
+        self._maybe_reset()
+
+        if self.remaining is None:
+            # unknown limit, only allow a single probe request
+            if self.in_flight == 0:
+                self.in_flight += 1
+                return True
+        elif self.remaining > 0:
+            self.remaining -= 1
+            self.in_flight += 1
+            return True
+
+        return False
+
+    async def _dispatch(self) -> None:
+        """
+        Hands out any available slots to the parked requests, in priority order.
+
+        If requests are still parked afterwards, the one at the head of the queue is woken so that
+        it can wait for the bucket to reset.
+        """
+        while self._waiters and self._try_take():
+            waiter = heapq.heappop(self._waiters)
+            waiter.granted = True
+            await waiter.event.set()
+
+        if self._waiters:
+            await self._waiters[0].event.set()
+
+    async def _give_back(self) -> None:
+        """
+        Returns a slot that was granted to a request that never got to use it.
+        """
+        self.in_flight -= 1
+        if self.remaining is not None:
+            self.remaining += 1
+
+        await self._dispatch()
+
+    async def acquire(self, priority: int = Priority.NORMAL) -> None:
+        """
+        Acquires a slot in this bucket, waiting until one is available.
+
+        :param priority: The :class:`.Priority` of the request.
+        """
+        if self.merged_into is not None:
+            return await self._root().acquire(priority)
+
+        # don't jump ahead of anything parked with the same or a higher priority
+        if (not self._waiters or self._waiters[0].priority > priority) and self._try_take():
+            return
+
+        waiter = _Waiter(priority)
+        heapq.heappush(self._waiters, waiter)
+
+        try:
+            while not waiter.granted:
+                # the limiter may have been merged into another whilst we were parked
+                limiter = self._root()
+                waiter.event = multio.Event()
+
+                if limiter._waiters[0] is waiter and limiter.remaining is not None \
+                        and limiter.reset_at is not None:
+                    # exhausted until the reset, at which point the head of the queue hands out
+                    # the new window
+                    sleep_time = max(0, limiter.reset_at - RatelimitClock.now())
+                    logger.debug("Bucket %s is exhausted, parking for %.3f seconds",
+                                 limiter.bucket, sleep_time)
+                    try:
+                        async with multio.timeout_after(sleep_time):
+                            await waiter.event.wait()
+                    except multio.asynclib.TaskTimeout:
+                        await limiter._dispatch()
+                else:
+                    # wait for a slot to be handed to us, or to become the head of the queue
+                    await waiter.event.wait()
+        except BaseException:
+            limiter = self._root()
+            if waiter.granted:
+                await limiter._give_back()
+            else:
+                was_head = limiter._waiters[0] is waiter
+                limiter._waiters.remove(waiter)
+                heapq.heapify(limiter._waiters)
+                if was_head and limiter._waiters:
+                    await limiter._waiters[0].event.set()
+
+            raise
+
+    async def release(self) -> None:
+        """
+        Releases a slot in this bucket.
+        """
+        if self.merged_into is not None:
+            return await self._root().release()
+
+        self.in_flight -= 1
+        await self._dispatch()
+
+    def update(self, remaining: int, reset_at: float, limit: int = None) -> None:
+        """
+        Corrects this bucket from the ratelimit headers of a response.
+
+        :param remaining: The X-Ratelimit-Remaining of the response.
+        :param reset_at: The :class:`.RatelimitClock` deadline the bucket resets at.
+        :param limit: The X-Ratelimit-Limit of the response, if any.
+        """
+        if self.merged_into is not None:
+            return self.merged_into.update(remaining, reset_at, limit=limit)
+
+        if limit is not None:
+            self.limit = limit
+
+        # requests still in flight may not have been counted by the server yet
+        available = max(0, remaining - max(0, self.in_flight - 1))
+
+        if self.reset_at is not None and self.remaining is not None \
+                and abs(reset_at - self.reset_at) < 0.5:
+            # same window, so never trust a stale (higher) count from a re-ordered response
+            self.remaining = min(self.remaining, available)
+        else:
+            self.remaining = available
+
+        self.reset_at = reset_at
+
+    def exhaust(self, reset_at: float) -> None:
+        """
+        Marks this bucket as having no requests remaining until ``reset_at``.
+
+        :param reset_at: The :class:`.RatelimitClock` deadline the bucket resets at.
+        """
+        if self.merged_into is not None:
+            return self.merged_into.exhaust(reset_at)
+
+        self.remaining = 0
+        self.reset_at = reset_at
+
+
+def _major_parameter(route: object) -> typing.Union[str, None]:
+    """
+    Extracts the major parameter (channel, guild or webhook ID) from a route key.
+
+    Route keys are ``(method, bucket)`` tuples, with buckets such as ``"messages:{channel_id}"``.
+    Discord ratelimits are per bucket *and* major parameter, so the ID is kept alongside the
+    learned bucket.
+    """
+    if isinstance(route, tuple):
+        route = route[-1]
+
+    for part in str(route).split(":"):
+        if part.isdigit():
+            return part
+
+    return None
+
+
+class BucketRegistry(object):
+    """
+    Maps request routes onto :class:`.BucketLimiter` objects.
+
+    Routes start out with a limiter of their own, keyed by the route. Once a response reports the
+    real Discord bucket in ``X-RateLimit-Bucket``, the route is re-keyed onto that bucket; if
+    another route already uses the same bucket, their limiters are merged.
+
+    The number of limiters is bounded by ``max_limiters``, but only idle limiters (no requests in
+    flight or waiting, and no active window) are ever evicted, so real ratelimit state is never
+    forgotten.
+    """
+
+    def __init__(self, max_limiters: int = 4096, max_routes: int = 16384):
+        """
+        :param max_limiters: The soft maximum number of limiters to keep.
+        :param max_routes: The maximum number of learned route -> bucket mappings to keep.
+        """
+        #: The soft maximum number of limiters to keep.
+        self.max_limiters = max_limiters
+
+        #: The learned mapping of route -> bucket key.
+        self._routes = lru(max_routes)
+
+        #: The mapping of bucket key -> limiter, in least recently used order.
+        self._limiters = collections.OrderedDict()  # type: typing.Dict[object, BucketLimiter]
+
+    def __len__(self) -> int:
+        return len(self._limiters)
+
+    def __repr__(self) -> str:
+        return "<BucketRegistry limiters={} routes={}>".format(len(self._limiters),
+                                                               len(self._routes))
+
+    def _key_for(self, route: object) -> object:
+        try:
+            return self._routes[route]
+        except KeyError:
+            return route
+
+    def get(self, route: object) -> BucketLimiter:
+        """
+        Gets the limiter for a route, creating one if needed.
+
+        :param route: The route key.
+        :return: The :class:`.BucketLimiter` for the route.
+        """
+        key = self._key_for(route)
+        try:
+            limiter = self._limiters[key]
+        except KeyError:
+            limiter = BucketLimiter(key)
+            self._limiters[key] = limiter
+            self._evict()
+        else:
+            self._limiters.move_to_end(key)
+
+        return limiter
+
+    def learn(self, route: object, bucket_hash: str) -> BucketLimiter:
+        """
+        Records the Discord bucket a route belongs to.
+
+        :param route: The route key.
+        :param bucket_hash: The contents of the ``X-RateLimit-Bucket`` header.
+        :return: The :class:`.BucketLimiter` now used for the route.
+        """
+        key = ("bucket", bucket_hash, _major_parameter(route))
+        old_key = self._key_for(route)
+        if old_key == key:
+            return self.get(route)
+
+        self._routes[route] = key
+        old = self._limiters.pop(old_key, None)
+        shared = self._limiters.get(key)
+
+        if shared is None:
+            if old is None:
+                return self.get(route)
+
+            # first route seen in this bucket, so just re-key the limiter
+            old.bucket = key
+            self._limiters[key] = old
+            return old
+
+        if old is not None:
+            logger.debug("Route %s shares bucket %s, merging limiters", route, bucket_hash)
+            shared.merge(old)
+
+        self._limiters.move_to_end(key)
+        return shared
+
+    def _evict(self) -> None:
+        """
+        Evicts idle limiters until the registry is back under its size bound.
+        """
+        to_check = len(self._limiters) - self.max_limiters
+        while to_check > 0 and len(self._limiters) > self.max_limiters:
+            key, limiter = self._limiters.popitem(last=False)
+            if not limiter.idle:
+                # still holds real state, keep it around
+                self._limiters[key] = limiter
+
+            to_check -= 1
+
+
+class TokenBucket(object):
+    """
+    A token bucket used to proactively limit the rate of requests.
+
+    Tokens are refilled continuously at ``rate`` per second, up to ``capacity``. Waiters are served
+    in :class:`.Priority` order, and in the order they arrived within a priority.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        :param rate: The number of tokens refilled per second.
+        :param capacity: The maximum number of tokens that can be banked. Defaults to ``rate``.
+        """
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive")
+
+        #: The number of tokens refilled per second.
+        self.rate = rate
+
+        #: The maximum number of tokens that can be banked.
+        self.capacity = capacity if capacity is not None else rate
+
+        #: The number of tokens currently available.
+        self.tokens = self.capacity
+
+        self._last_refill = RatelimitClock.now()
+
+        #: The heap of waiting requests. Only the head of the heap waits for a token.
+        self._waiters = []  # type: typing.List[_Waiter]
+
+    def __repr__(self) -> str:
+        return "<TokenBucket rate={} tokens={:.2f}>".format(self.rate, self.tokens)
+
+    def _refill(self) -> None:
+        """
+        Refills tokens for the time elapsed since the last refill.
+        """
+        now = RatelimitClock.now()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def _wake_head(self) -> None:
+        """
+        Wakes the waiter at the head of the queue, if it is parked.
+        """
+        if self._waiters and self._waiters[0].event is not None:
+            await self._waiters[0].event.set()
+
+    async def acquire(self, priority: int = Priority.NORMAL) -> float:
+        """
+        Takes a token from this bucket, waiting until one is available.
+
+        :param priority: The :class:`.Priority` of the request.
+        :return: The number of seconds spent waiting.
+        """
+        start = RatelimitClock.now()
+
+        # fast path, with nobody waiting ahead of us
+        if not self._waiters:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+
+        waiter = _Waiter(priority)
+        heapq.heappush(self._waiters, waiter)
+        try:
+            while True:
+                if self._waiters[0] is waiter:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+
+                    # a higher priority request may arrive whilst we sleep and take our place
+                    await multio.asynclib.sleep((1 - self.tokens) / self.rate)
+                else:
+                    waiter.event = multio.Event()
+                    await waiter.event.wait()
+                    waiter.event = None
+        finally:
+            was_head = self._waiters[0] is waiter
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            if was_head:
+                await self._wake_head()
+
+        return RatelimitClock.now() - start
+
+
+class RatelimitTicket(object):
+    """
+    A slot in a ratelimit bucket, handed out by a :class:`.RatelimitBackend`.
+    """
+
+    __slots__ = "route", "handle", "global_wait", "bucket_wait"
+
+    def __init__(self, route: object, handle: object,
+                 global_wait: float = 0.0, bucket_wait: float = 0.0):
+        #: The route the slot was acquired for.
+        self.route = route
+
+        #: The backend-specific handle for the slot.
+        self.handle = handle
+
+        #: The time spent waiting on the global ratelimit, in seconds.
+        self.global_wait = global_wait
+
+        #: The time spent waiting on the bucket, in seconds.
+        self.bucket_wait = bucket_wait
+
+    def __repr__(self) -> str:
+        return "<RatelimitTicket route={!r}>".format(self.route)
+
+
+class RatelimitBackend(object):
+    """
+    The base class for the stores of ratelimit state used by the :class:`.HTTPClient`.
+
+    All deadlines are on the :class:`.RatelimitClock`.
+    """
+
+    async def acquire(self, route: object,
+                      priority: int = Priority.NORMAL) -> RatelimitTicket:
+        """
+        Waits for the global ratelimit, and then for a slot in the bucket of a route.
+
+        :param route: The route key.
+        :param priority: The :class:`.Priority` of the request.
+        :return: A :class:`.RatelimitTicket` for the slot, which must be released.
+        """
+        raise NotImplementedError
+
+    async def release(self, ticket: RatelimitTicket) -> None:
+        """
+        Releases a slot acquired with :meth:`.acquire`.
+        """
+        raise NotImplementedError
+
+    async def update(self, ticket: RatelimitTicket, remaining: int, reset_at: float,
+                     limit: int = None, bucket_hash: str = None) -> None:
+        """
+        Corrects the bucket of a slot from the ratelimit headers of a response.
+
+        :param ticket: The :class:`.RatelimitTicket` the request was made with.
+        :param remaining: The X-Ratelimit-Remaining of the response.
+        :param reset_at: The deadline the bucket resets at.
+        :param limit: The X-Ratelimit-Limit of the response, if any.
+        :param bucket_hash: The X-Ratelimit-Bucket of the response, if any.
+        """
+        raise NotImplementedError
+
+    async def exhaust(self, ticket: RatelimitTicket, reset_at: float) -> None:
+        """
+        Marks the bucket of a slot as having no requests remaining until ``reset_at``.
+        """
+        raise NotImplementedError
+
+    async def hold_global(self, deadline: float) -> None:
+        """
+        Holds every request back until ``deadline``, and waits until then.
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """
+        Closes this backend.
+        """
+
+
+class LocalRatelimitBackend(RatelimitBackend):
+    """
+    The default :class:`.RatelimitBackend`, which keeps ratelimit state in this process.
+    """
+
+    def __init__(self, global_rate: float = 50.0, global_burst: float = 5,
+                 global_window: float = 1.0):
+        """
+        :param global_rate: The maximum number of requests per second to send, across all
+            buckets. If None, requests are only limited once Discord reports a global ratelimit.
+        :param global_burst: The number of requests that can be sent at once, without waiting.
+            This is taken out of the limit, so that no ``global_window`` seconds can ever contain
+            more than ``global_rate * global_window`` requests. It is capped at half of that.
+        :param global_window: The length of the window the global ratelimit is counted over, in
+            seconds.
+        """
+        #: The global ratelimit lock.
+        self.global_lock = multio.Lock()
+
+        #: The proactive global request limiter, if any.
+        self.global_limiter = None  # type: TokenBucket
+
+        if global_rate:
+            # a full bucket plus a window of refills must fit in the limit, or a burst on top of
+            # steady traffic gets the whole process globally ratelimited
+            global_burst = min(global_burst, global_rate * global_window / 2)
+            self.global_limiter = TokenBucket(global_rate - global_burst / global_window,
+                                              capacity=global_burst)
+
+        #: The registry of route -> ratelimit limiter.
+        self.ratelimits = BucketRegistry()
+
+    def __repr__(self) -> str:
+        return "<LocalRatelimitBackend ratelimits={!r}>".format(self.ratelimits)
+
+    async def acquire(self, route: object,
+                      priority: int = Priority.NORMAL) -> RatelimitTicket:
+        waiting_since = RatelimitClock.now()
+        # If we're being globally ratelimited, this will block until the global lock is finished.
+        await self.global_lock.acquire()
+        # Immediately release it because we're no longer being globally ratelimited.
+        await self.global_lock.release()
+
+        # Smooth out bursts locally, so that we don't find out about the global limit from 429s.
+        if self.global_limiter is not None:
+            await self.global_limiter.acquire(priority)
+
+        global_wait = RatelimitClock.now() - waiting_since
+
+        limiter = self.ratelimits.get(route)
+        waiting_since = RatelimitClock.now()
+        await limiter.acquire(priority)
+
+        return RatelimitTicket(route, limiter, global_wait=global_wait,
+                               bucket_wait=RatelimitClock.now() - waiting_since)
+
+    async def release(self, ticket: RatelimitTicket) -> None:
+        await ticket.handle.release()
+
+    async def update(self, ticket: RatelimitTicket, remaining: int, reset_at: float,
+                     limit: int = None, bucket_hash: str = None) -> None:
+        # Learn the real bucket, which may be shared with other routes.
+        if bucket_hash is not None:
+            self.ratelimits.learn(ticket.route, bucket_hash)
+
+        # Update the limiter, which wakes or parks the other requests in this bucket.
+        ticket.handle.update(remaining, reset_at, limit=limit)
+
+    async def exhaust(self, ticket: RatelimitTicket, reset_at: float) -> None:
+        ticket.handle.exhaust(reset_at)
+
+    async def hold_global(self, deadline: float) -> None:
+        await self.global_lock.acquire()
+        try:
+            # measured from the deadline, so any time spent waiting for the global lock to be
+            # acquired is already accounted for
+            sleep_time = deadline - RatelimitClock.now()
+            if sleep_time > 0:
+                await multio.asynclib.sleep(sleep_time)
+        finally:
+            await self.global_lock.release()
@@ -0,0 +1,457 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Ratelimit state shared between processes on the same host, for bots that run their shards in
+several processes.
+
+One process runs a :class:`.RatelimitCoordinator`, which owns the buckets and the global limits,
+and every :class:`.HTTPClient` is given a :class:`.SharedRatelimitBackend` connected to it over a
+unix socket.
+
+.. code-block:: python3
+
+    # coordinator process
+    multio.init("curio")
+    multio.run(RatelimitCoordinator("/run/mybot/ratelimit.sock").serve)
+
+    # bot processes
+    client = Client(token, ratelimit_backend=SharedRatelimitBackend("/run/mybot/ratelimit.sock"))
+
+Deadlines are sent as absolute times on the :class:`.RatelimitClock`, which is system-wide, so
+the coordinator and its clients must run on the same host.
+
+.. currentmodule:: curious.core.sharedratelimit
+"""
+import itertools
+import json
+import logging
+import os
+import socket
+import stat
+import typing
+
+import multio
+
+from curious.core.ratelimit import LocalRatelimitBackend, Priority, RatelimitBackend, \
+    RatelimitClock, RatelimitTicket
+
+logger = logging.getLogger("curious.http.ratelimit.shared")
+
+
+def _as_route(obj: typing.Any) -> typing.Any:
+    """
+    Turns the lists that JSON made of a route tuple back into tuples, so the route is hashable.
+    """
+    if isinstance(obj, list):
+        return tuple(_as_route(item) for item in obj)
+
+    return obj
+
+
+class _LineConnection(object):
+    """
+    A connection that sends and receives newline-delimited JSON messages over a non-blocking
+    socket.
+
+    Outgoing messages are appended whole to a buffer that is flushed from the front, so messages
+    from different tasks never interleave, and a message can be queued without waiting.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.closed = False
+
+        self._inbox = bytearray()
+        self._outbox = bytearray()
+
+    def _flush(self) -> None:
+        while self._outbox:
+            try:
+                sent = self.sock.send(self._outbox)
+            except (BlockingIOError, InterruptedError):
+                return
+
+            del self._outbox[:sent]
+
+    def send_nowait(self, message: dict) -> None:
+        """
+        Queues a message, sending as much of it as the socket accepts without blocking.
+        """
+        if self.closed:
+            return
+
+        self._outbox += json.dumps(message).encode() + b"\n"
+        try:
+            self._flush()
+        except OSError:
+            self.close()
+
+    async def send(self, message: dict) -> None:
+        """
+        Sends a message.
+        """
+        self.send_nowait(message)
+        try:
+            while self._outbox and not self.closed:
+                await multio.asynclib.wait_write(self.sock)
+                self._flush()
+        except OSError:
+            self.close()
+
+    async def recv(self) -> typing.Union[dict, None]:
+        """
+        Receives a message.
+
+        :return: The message, or None if the connection is closed.
+        """
+        while True:
+            index = self._inbox.find(b"\n")
+            if index != -1:
+                line = bytes(self._inbox[:index])
+                del self._inbox[:index + 1]
+                return json.loads(line.decode())
+
+            if self.closed:
+                return None
+
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                await multio.asynclib.wait_read(self.sock)
+                continue
+            except OSError:
+                data = b""
+
+            if not data:
+                self.close()
+                return None
+
+            self._inbox += data
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
+
+
+class _CoordinatorConnection(_LineConnection):
+    """
+    A client connected to a :class:`.RatelimitCoordinator`.
+    """
+
+    def __init__(self, sock: socket.socket):
+        super().__init__(sock)
+
+        #: The mapping of request ID -> granted ticket.
+        self.grants = {}  # type: typing.Dict[int, RatelimitTicket]
+
+        #: The IDs of requests that were cancelled before being granted.
+        self.cancelled = set()  # type: typing.Set[int]
+
+
+class RatelimitCoordinator(object):
+    """
+    Owns the ratelimit state for every :class:`.SharedRatelimitBackend` connected to it, so that
+    bucket reservations and global ratelimits hold across processes.
+
+    Slots held by a client that disconnects are released.
+    """
+
+    def __init__(self, path: str, *, global_rate: float = 50.0):
+        """
+        :param path: The path of the unix socket to listen on.
+        :param global_rate: The maximum number of requests per second to let through, across all
+            clients and buckets.
+        """
+        #: The path of the unix socket.
+        self.path = path
+
+        #: The :class:`.LocalRatelimitBackend` that holds the shared state.
+        self.backend = LocalRatelimitBackend(global_rate=global_rate)
+
+        self._task_group = None
+        self._connections = set()  # type: typing.Set[_CoordinatorConnection]
+
+    def __repr__(self) -> str:
+        return "<RatelimitCoordinator path={!r} clients={}>".format(self.path,
+                                                                   len(self._connections))
+
+    def _bind(self) -> socket.socket:
+        # clean up the socket of a previous coordinator, but never anything else
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.path)
+            sock.listen(128)
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+
+        return sock
+
+    async def serve(self) -> None:
+        """
+        Listens for clients until cancelled.
+        """
+        sock = self._bind()
+        logger.info("Ratelimit coordinator listening on %s", self.path)
+
+        try:
+            async with multio.asynclib.task_manager() as tg:
+                self._task_group = tg
+                while True:
+                    try:
+                        client, _ = sock.accept()
+                    except (BlockingIOError, InterruptedError):
+                        await multio.asynclib.wait_read(sock)
+                        continue
+
+                    client.setblocking(False)
+                    await multio.asynclib.spawn(tg, self._handle, _CoordinatorConnection(client))
+        finally:
+            self._task_group = None
+            sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    async def _handle(self, conn: _CoordinatorConnection) -> None:
+        self._connections.add(conn)
+        try:
+            while True:
+                message = await conn.recv()
+                if message is None:
+                    return
+
+                try:
+                    await self._dispatch(conn, message)
+                except Exception:
+                    logger.exception("Bad message from ratelimit client: {}".format(message))
+        finally:
+            self._connections.discard(conn)
+            conn.close()
+            # anything still granted to this client would otherwise be held forever
+            grants, conn.grants = conn.grants, {}
+            for ticket in grants.values():
+                await self.backend.release(ticket)
+
+    async def _dispatch(self, conn: _CoordinatorConnection, message: dict) -> None:
+        op = message["op"]
+
+        if op == "acquire":
+            await multio.asynclib.spawn(self._task_group, self._acquire, conn, message)
+
+        elif op == "hold_global":
+            await multio.asynclib.spawn(self._task_group, self.backend.hold_global,
+                                        message["deadline"])
+
+        elif op == "cancel":
+            ticket = conn.grants.pop(message["id"], None)
+            if ticket is None:
+                conn.cancelled.add(message["id"])
+            else:
+                await self.backend.release(ticket)
+
+        elif op == "release":
+            ticket = conn.grants.pop(message["id"], None)
+            if ticket is not None:
+                await self.backend.release(ticket)
+
+        elif op == "update":
+            ticket = conn.grants.get(message["id"])
+            if ticket is not None:
+                await self.backend.update(ticket, message["remaining"], message["reset_at"],
+                                          limit=message.get("limit"),
+                                          bucket_hash=message.get("bucket_hash"))
+
+        elif op == "exhaust":
+            ticket = conn.grants.get(message["id"])
+            if ticket is not None:
+                await self.backend.exhaust(ticket, message["reset_at"])
+
+        else:
+            logger.warning("Unknown ratelimit op {}".format(op))
+
+    async def _acquire(self, conn: _CoordinatorConnection, message: dict) -> None:
+        request_id = message["id"]
+        ticket = await self.backend.acquire(_as_route(message["route"]),
+                                            message.get("priority", Priority.NORMAL))
+
+        # the client gave up whilst this was waiting, so hand the slot straight back
+        if conn.closed or request_id in conn.cancelled:
+            conn.cancelled.discard(request_id)
+            await self.backend.release(ticket)
+            return
+
+        conn.grants[request_id] = ticket
+        await conn.send({
+            "id": request_id,
+            "global_wait": ticket.global_wait,
+            "bucket_wait": ticket.bucket_wait
+        })
+
+
+class SharedRatelimitBackend(RatelimitBackend):
+    """
+    A :class:`.RatelimitBackend` that keeps its state in a :class:`.RatelimitCoordinator`.
+
+    The connection is opened on the first request, and re-opened if it is lost. Slots acquired
+    over a lost connection are released by the coordinator.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The path of the unix socket the coordinator listens on.
+        """
+        #: The path of the unix socket.
+        self.path = path
+
+        self._conn = None  # type: _LineConnection
+        self._ids = itertools.count()
+
+        # whether a task is currently reading replies for everybody
+        self._reading = False
+        # request ID -> event set when the reply arrives, or when it's that task's turn to read
+        self._waiting = {}  # type: typing.Dict[int, multio.Event]
+        self._replies = {}  # type: typing.Dict[int, dict]
+
+    def __repr__(self) -> str:
+        return "<SharedRatelimitBackend path={!r} waiting={}>".format(self.path,
+                                                                     len(self._waiting))
+
+    async def _connection(self) -> _LineConnection:
+        if self._conn is not None and not self._conn.closed:
+            return self._conn
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            sock.connect(self.path)
+        except (BlockingIOError, InterruptedError):
+            await multio.asynclib.wait_write(sock)
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                sock.close()
+                raise ConnectionError(error, os.strerror(error))
+        except OSError:
+            sock.close()
+            raise
+
+        self._conn = _LineConnection(sock)
+        return self._conn
+
+    async def _wait_reply(self, conn: _LineConnection, request_id: int) -> dict:
+        """
+        Waits for the reply to a request.
+
+        Only one task reads from the connection at once; the others wait for it to hand them their
+        reply, or to hand over reading when it has its own.
+        """
+        while request_id not in self._replies:
+            if self._reading:
+                event = self._waiting[request_id] = multio.Event()
+                await event.wait()
+                continue
+
+            self._reading = True
+            try:
+                while request_id not in self._replies:
+                    message = await conn.recv()
+                    if message is None:
+                        raise ConnectionError("Lost connection to the ratelimit coordinator")
+
+                    reply_id = message["id"]
+                    if reply_id not in self._waiting:
+                        # the request was cancelled, and the coordinator told about it
+                        continue
+
+                    self._replies[reply_id] = message
+                    event = self._waiting[reply_id]
+                    if event is not None:
+                        await event.set()
+            finally:
+                self._reading = False
+                await self._hand_over(request_id)
+
+        return self._replies[request_id]
+
+    async def _hand_over(self, request_id: int) -> None:
+        """
+        Wakes up a task that is still waiting for its reply, so that it takes over reading.
+        """
+        for other_id, event in self._waiting.items():
+            if other_id != request_id and other_id not in self._replies and event is not None:
+                await event.set()
+                return
+
+    async def acquire(self, route: object,
+                      priority: int = Priority.NORMAL) -> RatelimitTicket:
+        conn = await self._connection()
+        request_id = next(self._ids)
+        self._waiting[request_id] = None
+
+        try:
+            await conn.send({"op": "acquire", "id": request_id, "route": route,
+                             "priority": int(priority)})
+            reply = await self._wait_reply(conn, request_id)
+        except BaseException:
+            # this is synchronous, so that it still gets sent when the task is being cancelled
+            conn.send_nowait({"op": "cancel", "id": request_id})
+            raise
+        finally:
+            self._waiting.pop(request_id, None)
+            self._replies.pop(request_id, None)
+            # this task may have been woken up to read, and then cancelled before it could
+            if not self._reading:
+                await self._hand_over(request_id)
+
+        return RatelimitTicket(route, (conn, request_id), global_wait=reply["global_wait"],
+                               bucket_wait=reply["bucket_wait"])
+
+    async def release(self, ticket: RatelimitTicket) -> None:
+        conn, request_id = ticket.handle
+        conn.send_nowait({"op": "release", "id": request_id})
+
+    async def update(self, ticket: RatelimitTicket, remaining: int, reset_at: float,
+                     limit: int = None, bucket_hash: str = None) -> None:
+        conn, request_id = ticket.handle
+        await conn.send({"op": "update", "id": request_id, "remaining": remaining,
+                         "reset_at": reset_at, "limit": limit, "bucket_hash": bucket_hash})
+
+    async def exhaust(self, ticket: RatelimitTicket, reset_at: float) -> None:
+        conn, request_id = ticket.handle
+        await conn.send({"op": "exhaust", "id": request_id, "reset_at": reset_at})
+
+    async def hold_global(self, deadline: float) -> None:
+        conn = await self._connection()
+        await conn.send({"op": "hold_global", "deadline": deadline})
+
+        # the coordinator holds back every other request, but this one still has to wait
+        sleep_time = deadline - RatelimitClock.now()
+        if sleep_time > 0:
+            await multio.asynclib.sleep(sleep_time)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -25,7 +25,6 @@ import logging
 import multio
 import typing
 from types import MappingProxyType
-from typing import Dict
 
 from curious.core import gateway
 from curious.dataclasses.channel import Channel, ChannelType
@@ -56,6 +55,95 @@ def int_or_none(val, default: typing.Any) -> typing.Union[int, None]:
     return int(val)
 
 
+class MessageCache(object):
+    """
+    A bounded, insertion-ordered cache of :class:`.Message` objects, indexed by message ID.
+
+    This behaves like a ``collections.deque`` with a ``maxlen`` for iteration purposes, but
+    lookups by ID are O(1).
+    """
+
+    def __init__(self, maxlen: int = 500):
+        #: The maximum number of messages that can be stored in this cache.
+        self.maxlen = maxlen
+
+        #: The mapping of message_id -> message, in insertion order.
+        self._messages = collections.OrderedDict()  # type: typing.MutableMapping[int, Message]
+
+    def __repr__(self) -> str:
+        return "<MessageCache messages={} maxlen={}>".format(len(self._messages), self.maxlen)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> typing.Iterator[Message]:
+        return iter(self._messages.values())
+
+    def __reversed__(self) -> typing.Iterator[Message]:
+        return reversed(self._messages.values())
+
+    def __contains__(self, item: typing.Union[int, Message]) -> bool:
+        if isinstance(item, int):
+            return item in self._messages
+
+        return getattr(item, "id", None) in self._messages
+
+    def get(self, message_id: int, default=None) -> typing.Union[Message, None]:
+        """
+        Gets a message from this cache by ID.
+
+        :param message_id: The ID of the message to get.
+        :param default: The default value to return if the message is not cached.
+        :return: The :class:`.Message` found, or the default.
+        """
+        return self._messages.get(message_id, default)
+
+    def append(self, message: Message) -> None:
+        """
+        Appends a message to this cache, evicting the oldest message if the cache is full.
+
+        If the message is already in the cache, it is replaced and moved to the end.
+
+        :param message: The :class:`.Message` to append.
+        """
+        if self.maxlen is not None and self.maxlen <= 0:
+            return
+
+        self._messages.pop(message.id, None)
+        self._messages[message.id] = message
+
+        if self.maxlen is not None:
+            while len(self._messages) > self.maxlen:
+                self._messages.popitem(last=False)
+
+    def remove(self, message: Message) -> None:
+        """
+        Removes a message from this cache.
+
+        :param message: The :class:`.Message` to remove.
+        :raises ValueError: If the message is not in this cache.
+        """
+        try:
+            del self._messages[message.id]
+        except KeyError:
+            raise ValueError("{!r} is not in the message cache".format(message)) from None
+
+    def discard(self, message_id: int) -> typing.Union[Message, None]:
+        """
+        Removes a message from this cache by ID, if it exists.
+
+        :param message_id: The ID of the message to remove.
+        :return: The :class:`.Message` removed, or None if it was not cached.
+        """
+        return self._messages.pop(message_id, None)
+
+    def clear(self) -> None:
+        """
+        Clears this cache.
+        """
+        self._messages.clear()
+
+
 class State(object):
     """
     This represents the state of the Client - in other libraries, the cache.
@@ -75,14 +163,40 @@ class State(object):
         self._private_channels = {}
 
         #: The guilds the bot can see.
-        self._guilds = {}  # type: Dict[int, Guild]
+        self._guilds = {}  # type: typing.Dict[int, Guild]
+
+        #: The mapping of guild_id -> shard_id for every guild in :attr:`._shard_guilds`.
+        self._guild_shards = {}  # type: typing.Dict[int, int]
+
+        #: The mapping of shard_id -> guild IDs on that shard.
+        self._shard_guilds = collections.defaultdict(set)
+
+        #: The mapping of shard_id -> IDs of guilds on that shard that are unavailable.
+        self._shard_unavailable = collections.defaultdict(set)
+
+        #: The mapping of shard_id -> IDs of available guilds on that shard that haven't finished
+        #: chunking.
+        self._shard_unchunked = collections.defaultdict(set)
+
+        #: The mapping of shard_id -> IDs of available large guilds on that shard that haven't
+        #: finished chunking.
+        self._shard_unchunked_large = collections.defaultdict(set)
+
+        #: The guild channels the bot can see, indexed by ID.
+        #: This is kept in sync with each guild's channels so lookups don't scan every guild.
+        self._channels = {}  # type: typing.Dict[int, Channel]
 
         #: The current user cache.
         self._users = {}
 
-        #: The deque of messages.
+        #: The user reference registry.
+        #: This is a mapping of user_id -> set of guild IDs and private channel IDs that hold a
+        #: reference to the user, used to decide when a user can be decached.
+        self._user_refs = {}  # type: typing.Dict[int, typing.Set[int]]
+
+        #: The cache of messages.
         #: This is bounded to prevent the message cache from growing infinitely.
-        self.messages = collections.deque(maxlen=max_messages)
+        self.messages = MessageCache(maxlen=max_messages)
 
         self.__shards_is_ready = collections.defaultdict(lambda: False)
         self.__voice_state_crap = collections.defaultdict(
@@ -106,6 +220,7 @@ class State(object):
 
         for guild in self.guilds_for_shard(shard_id):
             guild._finished_chunking.clear()
+            self._index_guild(guild)
 
     @property
     def guilds(self) -> typing.Mapping[int, Guild]:
@@ -127,18 +242,79 @@ class State(object):
 
         :param shard_id: The shard ID to check.
         """
-        if any(guild.unavailable is True for guild in self.guilds.values()):
+        if self._shard_unavailable.get(shard_id):
             return False
 
-        return all(guild._finished_chunking.is_set()
-                   for guild in self.guilds.values()
-                   if guild.shard_id == shard_id and guild.unavailable is False)
+        return not self._shard_unchunked.get(shard_id)
 
     def guilds_for_shard(self, shard_id: int):
         """
         Gets all the guilds for a particular shard.
         """
-        return [guild for guild in self.guilds.values() if guild.shard_id == shard_id]
+        return [self._guilds[guild_id] for guild_id in self._shard_guilds.get(shard_id, ())]
+
+    def unavailable_count(self, shard_id: int) -> int:
+        """
+        :param shard_id: The shard ID to check.
+        :return: The number of unavailable guilds on the specified shard.
+        """
+        return len(self._shard_unavailable.get(shard_id, ()))
+
+    def unchunked_large_count(self, shard_id: int) -> int:
+        """
+        :param shard_id: The shard ID to check.
+        :return: The number of large guilds on the specified shard still waiting on chunks.
+        """
+        return len(self._shard_unchunked_large.get(shard_id, ()))
+
+    def _index_guild(self, guild: Guild):
+        """
+        Updates the per-shard indexes for a guild.
+
+        This must be called whenever a guild's shard ID, availability, size or chunking status
+        changes.
+
+        :param guild: The :class:`.Guild` to index.
+        """
+        old_shard = self._guild_shards.get(guild.id, guild.shard_id)
+        if old_shard != guild.shard_id:
+            self._unindex_guild(guild.id)
+
+        shard_id = guild.shard_id
+        self._guild_shards[guild.id] = shard_id
+        self._shard_guilds[shard_id].add(guild.id)
+
+        if guild.unavailable is True:
+            self._shard_unavailable[shard_id].add(guild.id)
+            self._shard_unchunked[shard_id].discard(guild.id)
+            self._shard_unchunked_large[shard_id].discard(guild.id)
+            return
+
+        self._shard_unavailable[shard_id].discard(guild.id)
+        if guild._finished_chunking.is_set():
+            self._shard_unchunked[shard_id].discard(guild.id)
+            self._shard_unchunked_large[shard_id].discard(guild.id)
+        else:
+            self._shard_unchunked[shard_id].add(guild.id)
+            if guild.large:
+                self._shard_unchunked_large[shard_id].add(guild.id)
+            else:
+                self._shard_unchunked_large[shard_id].discard(guild.id)
+
+    def _unindex_guild(self, guild_id: int):
+        """
+        Removes a guild from the per-shard indexes.
+
+        :param guild_id: The ID of the guild to remove.
+        """
+        try:
+            shard_id = self._guild_shards.pop(guild_id)
+        except KeyError:
+            return
+
+        for index in (self._shard_guilds, self._shard_unavailable, self._shard_unchunked,
+                      self._shard_unchunked_large):
+            index[shard_id].discard(guild_id)
 
     # get_all_* methods
     def get_all_channels(self) -> typing.Generator[Channel, None, None]:
@@ -172,12 +348,15 @@ class State(object):
         :param user_id: The user ID to find.
         :return: The :class:`.Member` or :class:`.User` found, if any.
         """
-        for guild in self.guilds.values():
-            try:
-                return guild.members[user_id]
-            except KeyError:
+        for holder_id in self._user_refs.get(user_id, ()):
+            guild = self._guilds.get(holder_id)
+            if guild is None:
                 continue
 
+            member = guild._members.get(user_id)
+            if member is not None:
+                return member
+
         return self._users.get(user_id)
 
     def find_channel(self, channel_id: int) -> typing.Union[Channel, None]:
@@ -188,20 +367,10 @@ class State(object):
         :param channel_id: The ID of the channel to find.
         :return: A :class:`.Channel` that represents the channel, or None if no channel was found.
         """
-        # default channel_id == guild id
-        # for old guilds with a default channel
-        if channel_id in self._guilds:
-            try:
-                return self._guilds[channel_id].channels[channel_id]
-            except KeyError:
-                return None
-
         if channel_id in self._private_channels:
             return self._private_channels[channel_id]
 
-        for guild in self._guilds.values():
-            if channel_id in guild._channels:
-                return guild._channels[channel_id]
+        return self._channels.get(channel_id)
 
     def find_message(self, message_id: int) -> Message:
         """
@@ -210,15 +379,42 @@ class State(object):
         :param message_id: The message ID to find.
         :return: A :class:`.Message` to find, or None if it was not cached.
         """
-        for message in reversed(self.messages):
-            if message.id == message_id:
-                return message
+        return self.messages.get(message_id)
+
+    def _add_user_ref(self, user_id: int, holder_id: int):
+        """
+        Registers a reference to a user from a guild or a private channel.
+
+        :param user_id: The ID of the user being referenced.
+        :param holder_id: The ID of the guild or private channel holding the reference.
+        """
+        try:
+            self._user_refs[user_id].add(holder_id)
+        except KeyError:
+            self._user_refs[user_id] = {holder_id}
+
+    def _remove_user_ref(self, user_id: int, holder_id: int):
+        """
+        Removes a reference to a user from a guild or a private channel.
+
+        This does not decache the user; use :meth:`._check_decache_user` for that.
+
+        :param user_id: The ID of the user being referenced.
+        :param holder_id: The ID of the guild or private channel holding the reference.
+        """
+        refs = self._user_refs.get(user_id)
+        if refs is None:
+            return
+
+        refs.discard(holder_id)
+        if not refs:
+            del self._user_refs[user_id]
 
     def _check_decache_user(self, id: int):
         """
         Checks if we should decache a user.
 
-        This will check if there is any guild with a reference to the user.
+        This will check if there is any guild or private channel with a reference to the user.
         """
         # don't check if its not there
         if id not in self._users:
@@ -228,15 +424,9 @@ class State(object):
         if self._users[id] == self._user:
             return
 
-        # check if its in a private channel
-        for channel in self._private_channels.values():
-            if id in channel.recipients:
-                return
-
-        # check if it's any guilds
-        for guild in self._guilds.values():
-            if id in guild.members:
-                return
+        # check if any guild or private channel holds it
+        if id in self._user_refs:
+            return
 
         # didn't return, so no references
         self._users.pop(id, None)
@@ -296,6 +486,8 @@ class State(object):
         """
         channel = Channel(self.client, **channel_data)
         self._private_channels[channel.id] = channel
+        for user_id in channel._recipients:
+            self._add_user_ref(user_id, channel.id)
 
         return channel
 
@@ -329,10 +521,10 @@ class State(object):
         """
         message = Message(self.client, **event_data)
 
-        if message in self.messages:
+        cached = self.messages.get(message.id)
+        if cached is not None:
             # don't bother re-caching
-            i = self.messages.index(message)
-            return self.messages[i]
+            return cached
 
         # discord won't give us the Guild id
         # so we have to search it from the channels
@@ -376,7 +568,7 @@ class State(object):
             reaction.emoji = emoji_obb
             message.reactions.append(reaction)
 
-        if cache and message not in self.messages:
+        if cache:
             self.messages.append(message)
 
         return message
@@ -402,9 +594,15 @@ class State(object):
         # Create all of the guilds.
         for guild in event_data.get("guilds", []):
             new_guild = Guild(self.client, **guild)
+            old_guild = self._guilds.get(new_guild.id)
+            if old_guild is not None:
+                for member_id in old_guild._members:
+                    self._remove_user_ref(member_id, old_guild.id)
+
             self._guilds[new_guild.id] = new_guild
             new_guild.from_guild_create(**guild)
             new_guild.shard_id = gw.gw_state.shard_id
+            self._index_guild(new_guild)
 
         logger.info("Ready processed for shard {}. Delaying until all guilds are chunked."
                     .format(gw.gw_state.shard_id))
@@ -524,6 +722,7 @@ class State(object):
         if guild._chunks_left <= 0:
             # Set the finished chunking event.
             await guild._finished_chunking.set()
+            self._index_guild(guild)
 
     async def handle_guild_create(self, gw: 'gateway.GatewayHandler', event_data: dict):
         """
@@ -542,6 +741,7 @@ class State(object):
             guild.from_guild_create(**event_data)
 
         guild.shard_id = gw.gw_state.shard_id
+        self._index_guild(guild)
         # TODO: Need to do this
         # try:
         #    guild.me.presence.game = gw.game
@@ -613,6 +813,7 @@ class State(object):
         guild.afk_channel_id = int_or_none(event_data.get("afk_channel"), guild.afk_channel_id)
         guild.afk_timeout = event_data.get("afk_timeout", guild.afk_timeout)
         guild.owner_id = int_or_none(event_data.get("owner_id"), guild.owner_id)
+        self._index_guild(guild)
 
         yield "guild_update", old_guild, guild,
 
@@ -629,16 +830,24 @@ class State(object):
             guild = self._guilds.get(guild_id)
             if guild:
                 guild.unavailable = True
+                self._index_guild(guild)
                 yield "guild_unavailable", guild,
 
         else:
             # We've left this guild - clear it from our dictionary of guilds.
             guild = self._guilds.pop(guild_id, None)
             if guild:
+                self._unindex_guild(guild.id)
+                for channel_id in guild._channels:
+                    self._channels.pop(channel_id, None)
+
+                for member_id in guild._members:
+                    self._remove_user_ref(member_id, guild.id)
+
                 yield "guild_leave", guild,
-                for member in guild._members.values():
+                for member_id in guild._members:
                     # use member.id to avoid user lookup
-                    self._check_decache_user(member.id)
+                    self._check_decache_user(member_id)
 
     async def handle_guild_emojis_update(self, gw: 'gateway.GatewayHandler', event_data: dict):
         """
@@ -860,7 +1069,9 @@ class State(object):
         member.guild_id = guild.id
 
         guild._members[member.id] = member
+        self._add_user_ref(member.id, guild.id)
         guild.member_count += 1
+        self._index_guild(guild)
         yield "guild_member_add", member,
 
     async def handle_guild_member_remove(self, gw: 'gateway.GatewayHandler', event_data: dict):
@@ -873,10 +1084,14 @@ class State(object):
         if not guild:
             return
 
-        member = guild._members.pop(int(event_data["user"]["id"]), None)
+        member_id = int(event_data["user"]["id"])
+        member = guild._members.pop(member_id, None)
+        self._remove_user_ref(member_id, guild.id)
         guild.member_count -= 1
+        self._index_guild(guild)
         if not member:
             # We can't see the member, so don't fire an event for it.
+            self._check_decache_user(member_id)
             return
 
         yield "guild_member_remove", member,
@@ -961,6 +1176,8 @@ class State(object):
         channel = Channel(self.client, **event_data)
         if channel.private:
             self._private_channels[channel.id] = channel
+            for user_id in channel._recipients:
+                self._add_user_ref(user_id, channel.id)
         else:
             channel.guild_id = guild.id
             channel._update_overwrites((event_data.get("permission_overwrites", [])))
@@ -969,6 +1186,8 @@ class State(object):
             else:
                 channel = guild._channels[channel.id]
 
+            self._channels[channel.id] = channel
+
         yield "channel_create", channel,
 
     async def handle_channel_update(self, gw: 'gateway.GatewayHandler', event_data: dict):
@@ -992,6 +1211,9 @@ class State(object):
         channel.parent_id = int_or_none(event_data.get("parent_id"), channel.parent_id)
 
         channel._update_overwrites(event_data.get("permission_overwrites", []))
+        if not channel.private:
+            self._channels[channel.id] = channel
+
         yield "channel_update", old_channel, channel,
 
     async def handle_channel_delete(self, gw: 'gateway.GatewayHandler', event_data: dict):
@@ -1006,8 +1228,14 @@ class State(object):
 
         if channel.private:
             del self._private_channels[channel.id]
+            for user_id in channel._recipients:
+                self._remove_user_ref(user_id, channel.id)
+                self._check_decache_user(user_id)
         else:
-            del channel.guild._channels[channel.id]
+            self._channels.pop(channel.id, None)
+            guild = channel.guild
+            if guild is not None:
+                guild._channels.pop(channel.id, None)
 
         yield "channel_delete", channel,
 
@@ -1224,6 +1452,7 @@ class State(object):
             return
 
         channel._recipients[user.id] = user
+        self._add_user_ref(user.id, channel.id)
 
         yield "group_user_add", channel, user,
 
@@ -1241,4 +1470,6 @@ class State(object):
 
         if user in channel.recipients.values():
             channel._recipients.pop(user.id, None)
+            self._remove_user_ref(user.id, channel.id)
             yield "group_user_remove", channel, user,
+            self._check_decache_user(user.id)
@@ -23,6 +23,7 @@ from math import floor
 
 import collections
 import enum
+import inspect
 import multio
 import pathlib
 import typing as _typing
@@ -31,14 +32,20 @@ from os import PathLike
 from types import MappingProxyType
 from typing import AsyncIterator
 
+from curious.core.ratelimit import Priority
 from curious.dataclasses import guild as dt_guild, invite as dt_invite, member as dt_member, \
     message as dt_message, permissions as dt_permissions, role as dt_role, user as dt_user, \
     webhook as dt_webhook
 from curious.dataclasses.bases import Dataclass, IDObject
 from curious.dataclasses.embed import Embed
-from curious.exc import CuriousError, ErrorCode, Forbidden, HTTPException, PermissionsError
+from curious.exc import CuriousError, ErrorCode, Forbidden, HTTPException, NotFound, \
+    PermissionsError
 from curious.util import AsyncIteratorWrapper, base64ify, deprecated, safe_generator
 
+if _typing.TYPE_CHECKING:
+    # the state imports this module, so this is only imported for annotations
+    from curious.core.state import MessageCache
+
 
 class ChannelType(enum.IntEnum):
     """
@@ -83,18 +90,53 @@ class HistoryIterator(collections.AsyncIterator):
         await it.fill_messages()
         for message in it.messages:
             ...
+
+        # usage 3
+        async for batch in it.batches():
+            ...
             
     Note that usage 2 will only fill chunks of 100 messages at a time.
+
+    Messages are returned newest first, unless only ``after`` is passed, in which case they are
+    returned oldest first.
+
+    Backfills that read far more messages than the bot normally caches should pass
+    ``cache_messages=False``, so that they don't push the live messages out of the
+    :class:`.MessageCache` of the state. A separate, bounded :class:`.MessageCache` can be passed as
+    ``message_cache`` to keep the most recently iterated messages instead.
+
+    If ``prefetch`` is set and the iterator is used as an async context manager, the next pages are
+    fetched in the background whilst the current one is being consumed, so that reading a long
+    history isn't stalled by a round-trip at every page boundary:
+
+    .. code-block:: python3
+
+        async with channel.messages.get_history(limit=100000, prefetch=2) as history:
+            async for batch in history.batches():
+                ...
     """
 
+    #: The maximum number of messages Discord returns per request.
+    PAGE_SIZE = 100
+
     def __init__(self, channel: 'Channel',
                  max_messages: int = -1, *,
-                 before: int = None, after: int = None):
+                 before: int = None, after: int = None,
+                 priority: Priority = Priority.NORMAL,
+                 prefetch: int = 0,
+                 cache_messages: bool = True,
+                 message_cache: 'MessageCache' = None):
         """
         :param channel: The :class:`.Channel` to iterate over.
         :param max_messages: The maximum number of messages to return. <= 0 means infinite.
         :param before: The message ID to fetch before.
         :param after: The message ID to fetch after.
+        :param priority: The :class:`.Priority` of the history requests.
+        :param prefetch: The number of pages to fetch ahead of the consumer. Only used when this
+            iterator is used as an async context manager.
+        :param cache_messages: If the messages should be added to the message cache of the state.
+        :param message_cache: The :class:`.MessageCache` to add the messages to instead of the
+            message cache of the state, if any.
 
         .. versionchanged:: 0.7.0
 
@@ -106,7 +148,6 @@ class HistoryIterator(collections.AsyncIterator):
         self.messages = collections.deque()
 
         #: The current count of messages iterated over.
-        #: This is used to know when to automatically fill new messages.
         self.current_count = 0
 
         #: The maximum amount of messages to use.
@@ -123,12 +164,145 @@ class HistoryIterator(collections.AsyncIterator):
         if isinstance(self.after, IDObject):
             self.after = self.after.id
 
+        #: The :class:`.Priority` of the history requests.
+        self.priority = priority
+
+        #: The number of pages to fetch ahead of the consumer.
+        self.prefetch = prefetch
+
+        #: If the messages are added to the message cache of the state.
+        self.cache_messages = cache_messages and message_cache is None
+
+        #: The :class:`.MessageCache` the messages are added to instead, if any.
+        self.message_cache = message_cache
+
         #: The last message ID that we fetched.
         if self.before:
             self.last_message_id = self.before
         else:
             self.last_message_id = self.after
 
+        # if we're walking forwards from ``after``, rather than backwards from ``before``
+        self._forwards = self.after is not None and self.before is None
+        # the message ID the next page is fetched from
+        self._cursor = self.after if self._forwards else self.before
+        # the number of messages fetched, counted towards max_messages
+        self._fetched = 0
+        # if there are no more pages to fetch
+        self._exhausted = False
+        # if the consumer has seen the last page
+        self._drained = False
+
+        self._task_manager = None
+        self._task_group = None
+        self._pages = None  # type: multio.Queue
+
+    async def __aenter__(self) -> 'HistoryIterator':
+        if self.prefetch > 0:
+            self._task_manager = multio.asynclib.task_manager()
+            self._task_group = await self._task_manager.__aenter__()
+            self._pages = multio.Queue(self.prefetch)
+            await multio.asynclib.spawn(self._task_group, self._prefetcher)
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if self._task_group is not None:
+            await multio.asynclib.cancel_task_group(self._task_group)
+            try:
+                await self._task_manager.__aexit__(None, None, None)
+            finally:
+                self._task_manager = self._task_group = self._pages = None
+
+        return False
+
+    async def _fetch_page(self) -> '_typing.List[dt_message.Message]':
+        """
+        Fetches the next page of messages from Discord.
+        """
+        if self._exhausted:
+            return []
+
+        if self.max_messages <= 0:
+            to_get = self.PAGE_SIZE
+        else:
+            to_get = min(self.PAGE_SIZE, self.max_messages - self._fetched)
+
+        if to_get <= 0:
+            self._exhausted = True
+            return []
+
+        http = self.channel._bot.http
+        if self._forwards:
+            data = await http.get_message_history(self.channel.id, after=self._cursor,
+                                                  limit=to_get, priority=self.priority)
+            # discord returns the newest messages first
+            data.reverse()
+        else:
+            data = await http.get_message_history(self.channel.id, before=self._cursor,
+                                                  limit=to_get, priority=self.priority)
+
+        if len(data) < to_get:
+            self._exhausted = True
+
+        if data:
+            self._cursor = int(data[-1]["id"])
+
+        # stop at the other bound, if there is one
+        if self.before and self.after:
+            bounded = [datum for datum in data if int(datum["id"]) > self.after]
+            if len(bounded) < len(data):
+                self._exhausted = True
+
+            data = bounded
+
+        self._fetched += len(data)
+        make_message = self.channel._bot.state.make_message
+        messages = [make_message(datum, cache=self.cache_messages) for datum in data]
+
+        if self.message_cache is not None:
+            for message in messages:
+                if message is not None:
+                    self.message_cache.append(message)
+
+        return messages
+
+    async def _prefetcher(self) -> None:
+        """
+        Fetches pages into the page queue until the history is exhausted.
+        """
+        try:
+            while True:
+                page = await self._fetch_page()
+                await self._pages.put(page)
+                if not page:
+                    return
+        except multio.asynclib.Cancelled:
+            raise
+        except Exception as e:
+            # hand it to the consumer, who will raise it
+            await self._pages.put(e)
+
+    async def _next_page(self) -> '_typing.List[dt_message.Message]':
+        """
+        Gets the next page of messages, from the prefetcher if it is running.
+        """
+        if self._drained:
+            return []
+
+        if self._pages is not None:
+            page = await self._pages.get()
+            if isinstance(page, Exception):
+                self._drained = True
+                raise page
+        else:
+            page = await self._fetch_page()
+
+        if not page:
+            self._drained = True
+
+        return page
+
     async def fill_messages(self) -> None:
         """
         Called to fill the next <n> messages.
@@ -136,31 +310,27 @@ class HistoryIterator(collections.AsyncIterator):
         This is called automatically by :meth:`.__anext__`, but can be used to fill the messages
         anyway.
         """
-        if self.max_messages < 0:
-            to_get = 100
-        else:
-            to_get = self.max_messages - self.current_count
+        self.messages.extend(await self._next_page())
 
-        if to_get <= 0:
-            return
+    async def batches(self) -> '_typing.AsyncIterator[_typing.List[dt_message.Message]]':
+        """
+        Iterates over the history a page at a time, rather than a message at a time.
 
-        if self.before:
-            messages = await self.channel._bot.http.get_message_history(self.channel.id,
-                                                                        before=self.last_message_id,
-                                                                        limit=to_get)
+        :return: An async iterator of lists of at most :attr:`.PAGE_SIZE` :class:`.Message`.
+        """
+        if self.messages:
+            batch = list(self.messages)
+            self.messages.clear()
         else:
-            messages = await self.channel._bot.http.get_message_history(self.channel.id,
-                                                                        after=self.last_message_id)
-            messages = reversed(messages)
+            batch = await self._next_page()
 
-        for message in messages:
-            self.messages.append(self.channel._bot.state.make_message(message))
+        while batch:
+            self.current_count += len(batch)
+            self.last_message_id = batch[-1].id
+            yield batch
+            batch = await self._next_page()
 
     async def __anext__(self) -> 'dt_message.Message':
-        self.current_count += 1
-        if self.current_count == self.max_messages:
-            raise StopAsyncIteration
-
         if len(self.messages) <= 0:
             await self.fill_messages()
 
@@ -170,6 +340,8 @@ class HistoryIterator(collections.AsyncIterator):
             # No messages to fill, so self._fill_messages didn't return any
             # This signals the end of iteration.
             raise StopAsyncIteration
+
+        self.current_count += 1
         self.last_message_id = message.id
 
         return message
@@ -224,7 +396,11 @@ class ChannelMessageWrapper(object):
 
     def get_history(self, before: int = None,
                     after: int = None,
-                    limit: int = 100) -> HistoryIterator:
+                    limit: int = 100, *,
+                    priority: Priority = Priority.NORMAL,
+                    prefetch: int = 0,
+                    cache_messages: bool = True,
+                    message_cache: 'MessageCache' = None) -> HistoryIterator:
         """
         Gets history for this channel.
 
@@ -239,12 +415,21 @@ class ChannelMessageWrapper(object):
         :param limit: The maximum number of messages to get.
         :param before: The snowflake ID to get messages before.
         :param after: The snowflake ID to get messages after.
+        :param priority: The :class:`.Priority` of the history requests.
+        :param prefetch: The number of pages to fetch ahead of the consumer, when the iterator is
+            used as an async context manager.
+        :param cache_messages: If the messages should be added to the message cache of the state.
+            Pass False for large backfills, so they don't evict the live messages.
+        :param message_cache: The :class:`.MessageCache` to add the messages to instead of the
+            message cache of the state, if any.
         """
         if self.channel.guild:
             if not self.channel.permissions(self.channel.guild.me).read_message_history:
                 raise PermissionsError("read_message_history")
 
-        return HistoryIterator(self.channel, before=before, after=after, max_messages=limit)
+        return HistoryIterator(self.channel, before=before, after=after, max_messages=limit,
+                               priority=priority, prefetch=prefetch,
+                               cache_messages=cache_messages, message_cache=message_cache)
 
     async def send(self, content: str = None, *,
                    tts: bool = False, embed: 'Embed' = None) -> 'dt_message.Message':
@@ -294,7 +479,7 @@ class ChannelMessageWrapper(object):
 
         return obb
 
-    async def upload(self, fp: '_typing.Union[bytes, str, PathLike, _typing.IO]',
+    async def upload(self, fp: '_typing.Union[bytes, memoryview, str, PathLike, _typing.IO]',
                      *,
                      filename: str = None,
                      message_content: '_typing.Optional[str]' = None,
@@ -311,10 +496,10 @@ class ChannelMessageWrapper(object):
 
         :param fp: Variable.
 
-            - If passed a string or a :class:`os.PathLike`, will open and read the file and
-            upload it.
-            - If passed bytes, will use the bytes as the file content.
-            - If passed a file-like, will read and use the content to upload.
+            - If passed a string or a :class:`os.PathLike`, will open the file and stream it.
+            - If passed bytes or a memoryview, will use it as the file content.
+            - If passed a file-like, will stream the content from it. Seekable binary files are
+            re-read if the upload has to be retried; anything else is read into memory first.
 
         :param filename: The filename for the file uploaded. If a path-like or str is passed, \
             will use the filename from that if this is not specified.
@@ -333,24 +518,17 @@ class ChannelMessageWrapper(object):
             if not self.channel.permissions(self.channel.guild.me).attach_files:
                 raise PermissionsError("attach_files")
 
-        if isinstance(fp, bytes):
+        # the content is streamed from the source when uploading, so don't read it in here
+        if isinstance(fp, (bytes, bytearray, memoryview)):
             file_content = fp
-        elif isinstance(fp, pathlib.Path):
-            if filename is None:
-                filename = fp.parts[-1]
-
-            file_content = fp.read_bytes()
         elif isinstance(fp, (str, PathLike)):
             path = pathlib.Path(fp)
             if filename is None:
                 filename = path.parts[-1]
 
-            file_content = path.read_bytes()
+            file_content = path
         elif isinstance(fp, _typing.IO) or hasattr(fp, "read"):
-            file_content = fp.read()
-
-            if isinstance(file_content, str):
-                file_content = file_content.encode("utf-8")
+            file_content = fp
         else:
             raise ValueError("Got unknown type for upload")
 
@@ -402,16 +580,54 @@ class ChannelMessageWrapper(object):
 
         return len(ids)
 
+    async def _delete_each(self, messages: '_typing.List[dt_message.Message]',
+                           concurrency: int) -> int:
+        """
+        Deletes messages one by one, with up to ``concurrency`` requests in flight at once.
+
+        :return: The number of messages deleted.
+        """
+        http = self.channel._bot.http
+        pending = iter(messages)
+        deleted = 0
+
+        async def worker():
+            nonlocal deleted
+            # every worker pulls from the same iterator, so each message is deleted once
+            for message in pending:
+                try:
+                    await http.delete_message(self.channel.id, message.id,
+                                              priority=Priority.BULK)
+                except NotFound:
+                    # already deleted by somebody else
+                    continue
+
+                deleted += 1
+
+        try:
+            async with multio.asynclib.task_manager() as tg:
+                for _ in range(min(concurrency, len(messages))):
+                    await multio.asynclib.spawn(tg, worker)
+        except multio.asynclib.TaskGroupError as e:
+            raise multio.asynclib.unwrap_taskgrouperror(e)[0] from e
+
+        return deleted
+
     async def purge(self, limit: int = 100, *,
                     author: 'dt_member.Member' = None,
                     content: str = None,
                     predicate: '_typing.Callable[[dt_message.Message], bool]' = None,
-                    fallback_from_bulk: bool = False):
+                    fallback_from_bulk: bool = False,
+                    fallback_concurrency: int = 5,
+                    progress: '_typing.Callable[[int, int], _typing.Any]' = None):
         """
         Purges messages from a channel.
         This will attempt to use ``bulk-delete`` if possible, but otherwise will use the normal
         delete endpoint (which can get ratelimited severely!) if ``fallback_from_bulk`` is True.
 
+        Messages are deleted in chunks of 100 as soon as they are found, whilst the next pages of
+        history are still being fetched, so only one chunk is held in memory at a time.
+
         Example for deleting all messages owned by the bot:
 
         .. code-block:: python3
@@ -430,18 +646,34 @@ class ChannelMessageWrapper(object):
             await channel.messages.purge(limit=100,
                                          predicate=lambda message: 'i' in message.content)
 
+        Progress can be reported with a callback, which may be a coroutine function:
+
+        .. code-block:: python3
+
+            async def report(deleted: int, scanned: int):
+                await status.edit(f"Deleted {deleted} of {scanned} messages...")
+
+            await channel.messages.purge(limit=10000, progress=report)
+
         :param limit: The maximum amount of messages to delete. -1 for unbounded size.
         :param author: Only delete messages made by this author.
         :param content: Only delete messages that exactly match this content.
         :param predicate: A callable that determines if a message should be deleted.
         :param fallback_from_bulk: If this is True, messages will be regular deleted if they \
             cannot be bulk deleted.
+        :param fallback_concurrency: The maximum number of regular deletes in flight at once.
+        :param progress: A callable that is called with the number of messages deleted and the \
+            number of messages scanned so far, after every chunk is deleted.
         :return: The number of messages deleted.
         """
+        can_bulk_delete = True
         if self.channel.guild:
-            if not self.channel.permissions(self.channel.guild.me).manage_messages \
-                    and not fallback_from_bulk:
-                raise PermissionsError("manage_messages")
+            if not self.channel.permissions(self.channel.guild.me).manage_messages:
+                if not fallback_from_bulk:
+                    raise PermissionsError("manage_messages")
+
+                # don't bother asking for a bulk delete we know will be refused
+                can_bulk_delete = False
 
         checks = []
         if author:
@@ -453,32 +685,25 @@ class ChannelMessageWrapper(object):
         if predicate:
             checks.append(predicate)
 
-        to_delete = []
-        history = self.get_history(limit=limit)
-
-        async for message in history:
-            if all(check(message) for check in checks):
-                to_delete.append(message)
+        http = self.channel._bot.http
+        minimum_allowed = floor((time.time() - 14 * 24 * 60 * 60) * 1000.0 - 1420070400000) << 22
+        deleted = 0
+        scanned = 0
 
-        can_bulk_delete = True
+        async def delete_chunk(chunk: '_typing.List[dt_message.Message]'):
+            nonlocal can_bulk_delete, deleted
 
-        # Split into chunks of 100.
-        message_chunks = [to_delete[i:i + 100] for i in range(0, len(to_delete), 100)]
-        minimum_allowed = floor((time.time() - 14 * 24 * 60 * 60) * 1000.0 - 1420070400000) << 22
-        for chunk in message_chunks:
-            message_ids = []
             for message in chunk:
                 if message.id < minimum_allowed:
                     msg = f"Cannot delete message id {message.id} older than {minimum_allowed}"
                     raise CuriousError(msg)
 
-                message_ids.append(message.id)
-
             # First, try and bulk delete all the messages.
-            if can_bulk_delete:
+            # A bulk delete needs at least two messages.
+            if can_bulk_delete and len(chunk) > 1:
                 try:
-                    await self.channel._bot.http.delete_multiple_messages(self.channel.id,
-                                                                          message_ids)
+                    await http.delete_multiple_messages(self.channel.id,
+                                                        [message.id for message in chunk])
                 except Forbidden:
                     # We might not have MANAGE_MESSAGES.
                     # Check if we should fallback on normal delete.
@@ -486,14 +711,41 @@ class ChannelMessageWrapper(object):
                     if not fallback_from_bulk:
                         # Don't bother, actually.
                         raise
+                else:
+                    deleted += len(chunk)
+                    chunk = []
+
+            # Anything left over couldn't be bulk deleted, so just delete each message.
+            if chunk:
+                deleted += await self._delete_each(chunk, fallback_concurrency)
+
+            if progress is not None:
+                result = progress(deleted, scanned)
+                if inspect.isawaitable(result):
+                    await result
+
+        # purges are background work, so let interactive requests in the same buckets go first
+        # and the messages are about to be deleted, so there's no point in caching them
+        # the next page of history is fetched whilst the current chunk is being deleted
+        history = self.get_history(limit=limit, priority=Priority.BULK, cache_messages=False,
+                                   prefetch=1)
+
+        chunk = []
+        async with history:
+            async for message in history:
+                scanned += 1
+                if not all(check(message) for check in checks):
+                    continue
+
+                chunk.append(message)
+                if len(chunk) >= 100:
+                    await delete_chunk(chunk)
+                    chunk = []
 
-            # This is an `if not` instead of an `else` because `can_bulk_delete` might've changed.
-            if not can_bulk_delete:
-                # Instead, just delete() the message.
-                for message in chunk:
-                    await message.delete()
+            if chunk:
+                await delete_chunk(chunk)
 
-        return len(to_delete)
+        return deleted
 
     async def get(self, message_id: int) -> 'dt_message.Message':
         """
@@ -1003,6 +1003,7 @@ class Guild(Dataclass):
             else:
                 member_obj = dt_member.Member(self._bot, **member_data)
                 self._members[member_obj.id] = member_obj
+                self._bot.state._add_user_ref(member_obj.id, self.id)
 
             member_obj.nickname = member_data.get("nick", member_obj.nickname)
             member_obj.guild_id = self.id
@@ -1074,6 +1075,7 @@ class Guild(Dataclass):
         for channel_data in data.get("channels", []):
             channel_obj = dt_channel.Channel(self._bot, **channel_data)
             self._channels[channel_obj.id] = channel_obj
+            self._bot.state._channels[channel_obj.id] = channel_obj
             channel_obj.guild_id = self.id
             channel_obj._update_overwrites(channel_data.get("permission_overwrites", []), )
 
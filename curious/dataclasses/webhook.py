@@ -185,7 +185,9 @@ class Webhook(Dataclass):
 
     async def execute(self, *,
                       content: str = None, username: str = None, avatar_url: str = None,
-                      embeds: 'typing.List[dt_embed.Embed]'=None, wait: bool = False) \
+                      embeds: 'typing.List[dt_embed.Embed]'=None, wait: bool = False,
+                      file_content: 'typing.Union[bytes, str, typing.BinaryIO]' = None,
+                      filename: str = None) \
             -> typing.Union[None, str]:
         """
         Executes the webhook.
@@ -195,6 +197,9 @@ class Webhook(Dataclass):
         :param avatar_url: The URL for the avatar to override the default avatar with.
         :param embeds: A list of embeds to add to the message.
         :param wait: Should we wait for the message to arrive before returning?
+        :param file_content: Optional: A file to upload with the message. This can be bytes, a \
+            path, or a binary file object, and is streamed rather than read into memory.
+        :param filename: The filename of the file uploaded.
         """
         if embeds:
             embeds = [embed.to_dict() for embed in embeds]
@@ -205,7 +210,8 @@ class Webhook(Dataclass):
         data = await self._bot.http.execute_webhook(self.id, self.token,
                                                     content=content, embeds=embeds,
                                                     username=username, avatar_url=avatar_url,
-                                                    wait=wait)
+                                                    wait=wait, file_content=file_content,
+                                                    filename=filename)
 
         if wait:
             return self._bot.state.make_message(data, cache=False)
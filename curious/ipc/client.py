@@ -21,11 +21,11 @@ The client for an IPC connection.
 import os
 import platform
 import uuid
-from typing import Coroutine
+from typing import Coroutine, Union
 
 import curio
-from curio.io import Socket
 
+from curious.core.jsoncodec import JSONCodec, get_codec
 from curious.dataclasses.presence import RichPresence
 from curious.ipc.packet import IPCOpcode, IPCPacket
 
@@ -74,14 +74,20 @@ class IPCClient(object):
     """
     VERSION = 1
 
-    def __init__(self, client_id: int, *, slot: int = 0):
+    def __init__(self, client_id: int, *, slot: int = 0,
+                 json_codec: Union[str, JSONCodec] = None):
         """
         :param client_id: The client ID to authenticate with.
+        :param json_codec: The :class:`.JSONCodec` (or the name of one) to encode and decode
+            packets with. Defaults to the fastest installed codec.
         """
         self.client_id = client_id
 
+        #: The :class:`.JSONCodec` used for packets.
+        self.json_codec = get_codec(json_codec)
+
         self._ready = False
-        self._sock = None  # type: Socket
+        self._sock = None  # type: curio.io.Socket
         self._ipc_slot = slot
 
     async def open(self):
@@ -112,7 +118,7 @@ class IPCClient(object):
 
         :param packet: The :class:`.IPCPacket` to write.
         """
-        data = packet.serialize()
+        data = packet.serialize(self.json_codec)
         await self._sock.sendall(data)
 
     def _write_json(self, opcode: IPCOpcode, data: dict) -> Coroutine[None, None, None]:
@@ -151,7 +157,7 @@ class IPCClient(object):
         """
         Reads a packet from the connection.
         """
-        return IPCPacket.read_packet(self._sock)
+        return IPCPacket.read_packet(self._sock, self.json_codec)
 
     # Convenience methods
     async def send_rich_presence(self, presence: RichPresence):
@@ -19,13 +19,17 @@ Represents a Discord IPC packet.
 .. currentmodule:: curious.client.packet
 """
 import enum
-import json
 import struct
 import uuid
 from io import BytesIO
 
 from curio.io import Socket
 
+from curious.core.jsoncodec import JSONCodec, get_codec
+
+#: The codec used for packets when none is given.
+_default_codec = get_codec()
+
 
 class IPCOpcode(enum.IntEnum):
     """
@@ -51,12 +55,14 @@ class IPCPacket(object):
         self._json_data = data
 
     @staticmethod
-    def _pack_json(data: dict) -> str:
+    def _pack_json(data: dict, codec: JSONCodec = None) -> bytes:
         """
         Packs JSON in a compact representation.
         :param data: The data to pack.
+        :param codec: The :class:`.JSONCodec` to pack with.
+            Defaults to the fastest installed codec.
         """
-        return json.dumps(data, indent=None, separators=(',', ':'))
+        return (codec or _default_codec).dumpb(data)
 
     # properties
     @property
@@ -87,39 +93,49 @@ class IPCPacket(object):
         """
         return self._json_data["data"]
 
-    def serialize(self) -> bytes:
+    def serialize(self, codec: JSONCodec = None) -> bytes:
         """
         Serializes this packet into a series of bytes.
+
+        :param codec: The :class:`.JSONCodec` to encode the data with.
+            Defaults to the fastest installed codec.
         """
         buf = BytesIO()
         # Add opcode - little endian (why not network order?)
         buf.write(self.opcode.to_bytes(4, byteorder="little"))
-        data = self._pack_json(self._json_data)
+        data = self._pack_json(self._json_data, codec)
         # Add data length - little endian (why not network order?)
+        # this is the length in bytes, not characters
         buf.write(len(data).to_bytes(4, byteorder="little"))
-        # Add data - string, obviously
-        buf.write(data.encode("utf-8"))
+        # Add data - UTF-8 JSON
+        buf.write(data)
         return buf.getvalue()
 
     @classmethod
-    def deserialize(cls, data: bytes):
+    def deserialize(cls, data: bytes, codec: JSONCodec = None):
         """
         Deserializes a full packet.
 
         This method is not usually what you want.
+
+        :param codec: The :class:`.JSONCodec` to decode the data with.
+            Defaults to the fastest installed codec.
         """
         opcode, length = struct.unpack("<ii", data[:8])
-        raw_data = data[8:].decode("utf-8")
+        raw_data = data[8:]
 
         if len(raw_data) != length:
             raise ValueError("Got invalid length.")
 
-        return IPCPacket(IPCOpcode(opcode), json.loads(raw_data))
+        return IPCPacket(IPCOpcode(opcode), (codec or _default_codec).loads(raw_data))
 
     @classmethod
-    async def read_packet(cls, sock: Socket) -> 'IPCPacket':
+    async def read_packet(cls, sock: Socket, codec: JSONCodec = None) -> 'IPCPacket':
         """
         Reads a packet off of the socket, and deserializes it.
+
+        :param codec: The :class:`.JSONCodec` to decode the data with.
+            Defaults to the fastest installed codec.
         """
         data = await sock.recv(8)
 
@@ -131,5 +147,5 @@ class IPCPacket(object):
 
         # read body based on header
         body = await sock.recv(length)
-        body_data = json.loads(body.decode("utf-8"))
+        body_data = (codec or _default_codec).loads(body)
         return IPCPacket(IPCOpcode(opcode), body_data)